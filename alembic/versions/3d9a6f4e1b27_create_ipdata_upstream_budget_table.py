@@ -0,0 +1,34 @@
+"""Create ipdata_upstream_budget table
+
+Revision ID: 3d9a6f4e1b27
+Revises: 8e4b7d2c90a6
+Create Date: 2026-10-18 16:41:52.317408
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3d9a6f4e1b27"
+down_revision: Union[str, None] = "8e4b7d2c90a6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ipdata_upstream_budget",
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("used", sa.Integer(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index("ix_ipdata_upstream_budget_expires_at", "ipdata_upstream_budget", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("ipdata_upstream_budget")
@@ -0,0 +1,30 @@
+"""Store ipdata.ip as inet
+
+Revision ID: 5c2f1e9a7d31
+Revises: b1635d5b4718
+Create Date: 2026-10-18 11:20:41.512834
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import INET
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5c2f1e9a7d31"
+down_revision: Union[str, None] = "b1635d5b4718"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Casting to inet also brings every address to its canonical form (e.g. IPv6 zero compression)
+    op.alter_column("ipdata", "ip", type_=INET(), existing_nullable=False, postgresql_using="ip::inet")
+    op.create_index("ix_ipdata_ip", "ipdata", ["ip"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.alter_column("ipdata", "ip", type_=sa.String(), existing_nullable=False, postgresql_using="host(ip)")
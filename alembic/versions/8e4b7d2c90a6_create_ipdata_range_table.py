@@ -0,0 +1,60 @@
+"""Create ipdata_range table
+
+Revision ID: 8e4b7d2c90a6
+Revises: 5c2f1e9a7d31
+Create Date: 2026-10-18 13:02:17.904215
+
+"""
+
+import uuid
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import CIDR
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8e4b7d2c90a6"
+down_revision: Union[str, None] = "5c2f1e9a7d31"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ipdata_range",
+        sa.Column("id", sa.UUID, primary_key=True, index=True, default=lambda: str(uuid.uuid4())),
+        sa.Column("network", CIDR(), nullable=False),
+        sa.Column("type", sa.String(), nullable=True),
+        sa.Column("continent_code", sa.String(), nullable=True),
+        sa.Column("continent_name", sa.String(), nullable=True),
+        sa.Column("country_code", sa.String(), nullable=True),
+        sa.Column("country_name", sa.String(), nullable=True),
+        sa.Column("region_code", sa.String(), nullable=True),
+        sa.Column("region_name", sa.String(), nullable=True),
+        sa.Column("city", sa.String(), nullable=True),
+        sa.Column("zip", sa.String(), nullable=True),
+        sa.Column("latitude", sa.Float(), nullable=True),
+        sa.Column("longitude", sa.Float(), nullable=True),
+        sa.Column("msa", sa.String(), nullable=True),
+        sa.Column("dma", sa.String(), nullable=True),
+        sa.Column("radius", sa.Float(), nullable=True),
+        sa.Column("ip_routing_type", sa.String(), nullable=True),
+        sa.Column("connection_type", sa.String(), nullable=True),
+        sa.Column("location_id", sa.UUID, sa.ForeignKey("location.id"), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("network"),
+    )
+    # GiST index with inet_ops serves the "network >>= ip" containment lookups
+    op.create_index(
+        "ix_ipdata_range_network",
+        "ipdata_range",
+        ["network"],
+        postgresql_using="gist",
+        postgresql_ops={"network": "inet_ops"},
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("ipdata_range")
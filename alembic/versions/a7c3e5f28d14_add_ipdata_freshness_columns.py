@@ -0,0 +1,35 @@
+"""Add ipdata freshness columns
+
+Revision ID: a7c3e5f28d14
+Revises: 3d9a6f4e1b27
+Create Date: 2026-10-18 18:12:05.640933
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import context, op
+
+# revision identifiers, used by Alembic.
+revision: str = "a7c3e5f28d14"
+down_revision: Union[str, None] = "3d9a6f4e1b27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("ipdata", sa.Column("fetched_at", sa.DateTime(timezone=True), nullable=True))
+    op.add_column("ipdata", sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True))
+    # Existing rows cannot be told apart from manually created ones, so they never expire unless asked for with
+    # `alembic -x expire_existing=true upgrade head`, when every existing row is refreshed over time
+    if context.get_x_argument(as_dictionary=True).get("expire_existing", "false").lower() == "true":
+        op.execute("UPDATE ipdata SET expires_at = now()")
+    op.create_index("ix_ipdata_expires_at", "ipdata", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ipdata_expires_at", table_name="ipdata")
+    op.drop_column("ipdata", "expires_at")
+    op.drop_column("ipdata", "fetched_at")
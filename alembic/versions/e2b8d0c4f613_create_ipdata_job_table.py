@@ -0,0 +1,42 @@
+"""Create ipdata_job table
+
+Revision ID: e2b8d0c4f613
+Revises: a7c3e5f28d14
+Create Date: 2026-10-18 19:12:07.541236
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import INET
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e2b8d0c4f613"
+down_revision: Union[str, None] = "a7c3e5f28d14"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ipdata_job",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("ip", INET(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("available_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("status_code", sa.Integer(), nullable=True),
+        sa.Column("detail", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_ipdata_job_status_available_at", "ipdata_job", ["status", "available_at"])
+    op.create_index("ix_ipdata_job_finished_at", "ipdata_job", ["finished_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("ipdata_job")
@@ -0,0 +1,73 @@
+"""
+Rows per second of the bulk import, on synthetic records spread over a few thousand locations:
+
+    python -m benchmarks.bulk_import --rows 1000000 --chunk-size 10000
+
+Imports into the database of DATABASE_DSN, run it against a scratch database.
+"""
+
+import json
+import tempfile
+from argparse import ArgumentParser
+from ipaddress import IPv4Address
+from time import perf_counter
+
+from ipdata.db import init_database
+from ipdata.services.bulk_import.importer import import_file
+
+LOCATION = {
+    "capital": "Prague",
+    "languages": ["cs", "sk"],
+    "country_flag": "https://assets.ipstack.com/flags/cz.svg",
+    "country_flag_emoji": "🇨🇿",
+    "country_flag_emoji_unicode": "U+1F1E8 U+1F1FF",
+    "calling_code": "420",
+    "is_eu": True,
+}
+IP_DATA = {
+    "type": "ipv4",
+    "continent_code": "EU",
+    "continent_name": "Europe",
+    "country_code": "CZ",
+    "country_name": "Czechia",
+    "region_code": "10",
+    "region_name": "Hlavní město Praha",
+    "city": "Prague",
+    "zip": "106 00",
+    "latitude": 50.0878,
+    "longitude": 14.4205,
+    "msa": None,
+    "dma": None,
+    "radius": None,
+    "ip_routing_type": "fixed",
+    "connection_type": "tx",
+}
+# First address of the synthetic records, far from addresses used elsewhere
+FIRST_IP = int(IPv4Address("100.64.0.0"))
+
+
+def write_dump(path: str, rows: int, locations: int) -> None:
+    with open(path, "w") as file:
+        for i in range(rows):
+            location = {**LOCATION, "geoname_id": 10_000_000 + i % locations}
+            file.write(json.dumps({**IP_DATA, "ip": str(IPv4Address(FIRST_IP + i)), "location": location}) + "\n")
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Measure rows per second of the bulk import")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--locations", type=int, default=5_000)
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".jsonl") as dump:
+        write_dump(dump.name, args.rows, args.locations)
+        started_at = perf_counter()
+        progress = import_file(init_database(), dump.name, chunk_size=args.chunk_size, update=True)
+        elapsed = perf_counter() - started_at
+
+    print(f"{progress.rows} rows in {elapsed:.2f} s: {progress.rows / elapsed:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
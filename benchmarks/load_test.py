@@ -0,0 +1,319 @@
+"""
+Load test of the whole service: starts the application with uvicorn against the database of DATABASE_DSN and
+a local ipstack stand-in (see benchmarks.stub_ipstack), sends a mix of requests whose IPs follow a Zipf distribution
+and prints throughput and latency percentiles per endpoint as JSON, to compare runs of different commits:
+
+    python -m benchmarks.load_test --reset --duration 30 --mix get=80,post=10,delete=5,manual=5 > before.json
+    python -m benchmarks.load_test --reset --duration 30 --mix get=80,post=10,delete=5,manual=5 --baseline before.json
+
+IPs are taken from a JSONL dump in the bulk import format (--keys-file) or generated (--keys), a --preload share
+of them is imported before the run. --reset recreates the tables first, run it only against a scratch database.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from bisect import bisect
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from ipaddress import IPv4Address
+from random import Random
+from time import perf_counter, sleep
+from typing import Any, Iterator
+
+import httpx
+
+from benchmarks.bulk_import import FIRST_IP, IP_DATA, LOCATION
+from benchmarks.stub_ipstack import FIRST_GEONAME_ID, StubIPStack
+from ipdata.db import Base, init_database
+from ipdata.services.bulk_import.importer import import_file
+
+OPERATIONS = {
+    "get": "GET /ipdata/{ip}",
+    "post": "POST /ipdata/",
+    "delete": "DELETE /ipdata/{ip}",
+    "manual": "POST /ipdata/manual",
+}
+# Seconds to wait for the application to answer after it is started
+STARTUP_TIMEOUT = 30.0
+
+
+class ZipfKeys:
+    """
+    Draws keys by popularity: the key of rank r (from 1) with probability proportional to 1 / r ** exponent.
+    """
+
+    def __init__(self, keys: list[str], exponent: float, random: Random) -> None:
+        self._keys = keys
+        self._random = random
+        self._cumulative = []
+        total = 0.0
+        for rank in range(1, len(keys) + 1):
+            total += rank**-exponent
+            self._cumulative.append(total)
+
+    def sample(self) -> str:
+        index = bisect(self._cumulative, self._random.random() * self._cumulative[-1])
+        return self._keys[min(index, len(self._keys) - 1)]
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, operation: str, status: str, latency: float) -> None:
+        self.latencies[operation].append(latency)
+        self.statuses[operation][status] += 1
+
+    def report(self, elapsed: float) -> dict[str, Any]:
+        endpoints = {
+            operation: summarize(self.latencies[operation], self.statuses[operation], elapsed)
+            for operation in self.latencies
+        }
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        total = summarize(everything, sum(self.statuses.values(), Counter()), elapsed)
+        return {"total": total, "endpoints": endpoints}
+
+
+def summarize(latencies: list[float], statuses: Counter, elapsed: float) -> dict[str, Any]:
+    """
+    Errors are failed connections and 5xx answers, 4xx answers (e.g. an IP which is already stored) are expected.
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status == "error" or status.startswith("5")),
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        operation, _, weight = part.partition("=")
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation}, use {', '.join(OPERATIONS)}")
+        weights[operation] = float(weight or 1)
+    return weights
+
+
+def ip_record(ip: str) -> dict[str, Any]:
+    geoname_id = FIRST_GEONAME_ID + int(IPv4Address(ip)) % 1000 if "." in ip else FIRST_GEONAME_ID
+    return {**IP_DATA, "ip": ip, "location": {**LOCATION, "geoname_id": geoname_id}}
+
+
+def load_keys(path: str | None, count: int) -> dict[str, str]:
+    """
+    IPs with their records in the bulk import format, by default synthetic ones.
+    """
+    if path is None:
+        ips = [str(IPv4Address(FIRST_IP + i)) for i in range(count)]
+        return {ip: json.dumps(ip_record(ip)) for ip in ips}
+
+    keys = {}
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                keys[json.loads(line)["ip"]] = line.strip()
+    return keys
+
+
+def prepare_database(records: list[str], reset: bool) -> None:
+    engine = init_database()
+    if reset:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    if not records:
+        return
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as dump:
+        dump.write("\n".join(records) + "\n")
+        dump.flush()
+        import_file(engine, dump.name)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def running_app(env: dict[str, str], workers: int) -> Iterator[str]:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "ipdata.app.main:app", "--port", str(port), "--workers", str(workers)]
+        + ["--log-level", "warning"],
+        env={**os.environ, **env},
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(url, process)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def wait_until_ready(url: str, process: subprocess.Popen) -> None:
+    started_at = perf_counter()
+    while perf_counter() - started_at < STARTUP_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError(f"The application exited with code {process.returncode}")
+        try:
+            httpx.get(f"{url}/stats").raise_for_status()
+            return
+        except httpx.HTTPError:
+            sleep(0.2)
+    raise RuntimeError(f"The application did not start in {STARTUP_TIMEOUT} seconds")
+
+
+async def send(client: httpx.AsyncClient, operation: str, ip: str, records: dict[str, str]) -> httpx.Response:
+    match operation:
+        case "get":
+            return await client.get(f"/ipdata/{ip}")
+        case "post":
+            return await client.post("/ipdata/", json={"ip": ip})
+        case "delete":
+            return await client.delete(f"/ipdata/{ip}")
+        case _:
+            return await client.post("/ipdata/manual", content=records[ip])
+
+
+async def drive(
+    url: str,
+    records: dict[str, str],
+    keys: ZipfKeys,
+    mix: dict[str, float],
+    concurrency: int,
+    duration: float,
+    random: Random,
+) -> dict[str, Any]:
+    recorder = Recorder()
+    operations, weights = list(mix), list(mix.values())
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=30.0, limits=limits) as client:
+        started_at = perf_counter()
+
+        async def worker() -> None:
+            while perf_counter() - started_at < duration:
+                operation, ip = random.choices(operations, weights)[0], keys.sample()
+                sent_at = perf_counter()
+                try:
+                    status = str((await send(client, operation, ip, records)).status_code)
+                except httpx.HTTPError:
+                    status = "error"
+                recorder.record(operation, status, perf_counter() - sent_at)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = perf_counter() - started_at
+    return recorder.report(elapsed)
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any]) -> dict[str, Any]:
+    """
+    Ratios of this run to the baseline: above 1 is more throughput, or a higher latency.
+    """
+    comparison = {}
+    for operation, current in report["endpoints"].items():
+        previous = baseline["endpoints"].get(operation)
+        if previous is None:
+            continue
+        comparison[operation] = {
+            name: current[name] / previous[name] if previous[name] else None
+            for name in ["throughput_rps", "p50_ms", "p95_ms", "p99_ms"]
+        }
+    return comparison
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Load test the service against a local ipstack stand-in")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--mix", default="get=80,post=10,delete=5,manual=5", help="weights of the operations")
+    parser.add_argument("--keys", type=int, default=10_000, help="number of synthetic IPs")
+    parser.add_argument("--keys-file", help="JSONL dump in the bulk import format to take the IPs from")
+    parser.add_argument("--zipf", type=float, default=1.1, help="exponent of the key popularity")
+    parser.add_argument("--preload", type=float, default=0.5, help="share of the IPs imported before the run")
+    parser.add_argument("--reset", action="store_true", help="drop and create the tables first")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--env", action="append", default=[], help="setting of the application, e.g. ASYNC_MODE=true")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--upstream-jitter", type=float, default=0.02, help="seconds")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.01)
+    parser.add_argument("--upstream-limit-rate", type=float, default=0.001)
+    parser.add_argument("--upstream-invalid-rate", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="report of an earlier run to compare with")
+    args = parser.parse_args()
+
+    random = Random(args.seed)
+    records = load_keys(args.keys_file, args.keys)
+    ips = list(records)
+    # Popularity does not depend on the order of the file, and popular IPs are not all preloaded
+    random.shuffle(ips)
+    preloaded = random.sample(ips, int(len(ips) * args.preload))
+    prepare_database([records[ip] for ip in preloaded], args.reset)
+
+    stub = StubIPStack(
+        latency=args.upstream_latency,
+        jitter=args.upstream_jitter,
+        error_rate=args.upstream_error_rate,
+        limit_rate=args.upstream_limit_rate,
+        invalid_rate=args.upstream_invalid_rate,
+        seed=args.seed,
+    )
+    env = {"IP_STACK_URL": stub.url, "IP_STACK_ACCESS_KEY": "load-test", **dict(e.split("=", 1) for e in args.env)}
+    with stub, running_app(env, args.workers) as url:
+        report = asyncio.run(
+            drive(
+                url,
+                records,
+                ZipfKeys(ips, args.zipf, random),
+                parse_mix(args.mix),
+                args.concurrency,
+                args.duration,
+                random,
+            )
+        )
+
+    report = {
+        "commit": git_commit(),
+        "config": {name: value for name, value in vars(args).items() if name != "baseline"},
+        **report,
+        "upstream": stub.stats(),
+    }
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["comparison"] = compare(report, json.load(file))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
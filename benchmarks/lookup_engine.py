@@ -0,0 +1,134 @@
+"""
+Compare GET /ipdata/{ip} lookups served by the in-process lookup engine with lookups served by PostgreSQL.
+
+    python -m benchmarks.lookup_engine --seed 100000 --samples 5000
+
+--seed inserts synthetic rows before the benchmark, use it only against a scratch database.
+"""
+
+import json
+from argparse import ArgumentParser
+from ipaddress import IPv4Address
+from random import Random
+from statistics import median, quantiles
+from time import perf_counter
+from typing import Any, Callable
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from ipdata.app.utils import (
+    get_ip_data_by_ip,
+    get_location,
+    ip_data_attributes,
+    ip_data_entity_to_schema,
+    location_attributes,
+    rebuild_ip_lookup_engine,
+)
+from ipdata.db import get_session
+from ipdata.models.ip_data import IPDataModel, LocationModel
+from ipdata.services.ip_client.data import IPData, LocationData
+from ipdata.services.lookup.ip_lookup_engine import ip_lookup_engine
+
+SAMPLE_IP_DATA = {
+    "ip": "0.0.0.0",
+    "type": "ipv4",
+    "continent_code": "EU",
+    "continent_name": "Europe",
+    "country_code": "CZ",
+    "country_name": "Czechia",
+    "region_code": "10",
+    "region_name": "Hlavní město Praha",
+    "city": "Prague",
+    "zip": "106 00",
+    "latitude": 50.0878,
+    "longitude": 14.4205,
+    "msa": None,
+    "dma": None,
+    "radius": None,
+    "ip_routing_type": "fixed",
+    "connection_type": "tx",
+    "location": {
+        "geoname_id": 3067696,
+        "capital": "Prague",
+        "languages": [{"code": "cs", "name": "Czech", "native": "Čeština"}],
+        "country_flag": "https://assets.ipstack.com/flags/cz.svg",
+        "country_flag_emoji": "🇨🇿",
+        "country_flag_emoji_unicode": "U+1F1E8 U+1F1FF",
+        "calling_code": "420",
+        "is_eu": True,
+    },
+}
+SEED_CHUNK_SIZE = 10000
+LOCATIONS_COUNT = 100
+
+
+def seed(db: Session, count: int, random: Random) -> None:
+    locations = []
+    for geoname_id in range(1, LOCATIONS_COUNT + 1):
+        location = LocationModel(
+            **location_attributes(LocationData(**{**SAMPLE_IP_DATA["location"], "geoname_id": geoname_id}))
+        )
+        locations.append(location)
+    db.add_all(locations)
+    db.flush()
+
+    attributes = ip_data_attributes(IPData(**SAMPLE_IP_DATA))
+    ips = {str(IPv4Address(random.getrandbits(32))) for _ in range(count)}
+    rows = [{**attributes, "ip": ip, "location_id": random.choice(locations).id} for ip in ips]
+    for start in range(0, len(rows), SEED_CHUNK_SIZE):
+        db.execute(insert(IPDataModel), rows[start : start + SEED_CHUNK_SIZE])
+    db.commit()
+
+
+def measure(lookup: Callable[[str], Any], ips: list[str]) -> dict[str, float]:
+    timings = []
+    for ip in ips:
+        started_at = perf_counter()
+        lookup(ip)
+        timings.append((perf_counter() - started_at) * 1e6)
+    return {"median_us": median(timings), "p99_us": quantiles(timings, n=100)[98], "lookups": len(timings)}
+
+
+def lookup_in_database(db: Session) -> Callable[[str], Any]:
+    def lookup(ip: str) -> Any:
+        ip_data = get_ip_data_by_ip(db, ip)
+        return ip_data_entity_to_schema(ip_data, get_location(db, ip_data.location_id)) if ip_data else None
+
+    return lookup
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, default=0, help="insert that many synthetic rows first")
+    parser.add_argument("--samples", type=int, default=2000, help="number of stored IPs to look up")
+    args = parser.parse_args()
+    random = Random(0)
+
+    db = get_session()
+    try:
+        if args.seed:
+            seed(db, args.seed, random)
+
+        started_at = perf_counter()
+        rebuild_ip_lookup_engine(db)
+        build_seconds = perf_counter() - started_at
+
+        stored_ips = list(db.scalars(select(IPDataModel.ip).limit(args.samples * 10)))
+        ips = random.sample(stored_ips, min(args.samples, len(stored_ips)))
+        report = {
+            "rows": db.query(IPDataModel).count(),
+            "locations": db.query(LocationModel).count(),
+            "build_seconds": build_seconds,
+            "memory": ip_lookup_engine.stats()["memory"],
+            "lookup_engine": measure(ip_lookup_engine.get, ips),
+            "database": measure(lookup_in_database(db), ips),
+        }
+    finally:
+        db.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+CPU time per GET /ipdata/{ip} response, from a stored row to response bytes, of the response model path
+(IPDataReturnSchema built from the row, validated again as response_model by FastAPI and encoded by JSONResponse)
+and of the fast path (row encoded straight to JSON by orjson with the location encoded once):
+
+    python -m benchmarks.serialization --requests 100000
+
+No database is needed, rows are synthetic.
+"""
+
+import asyncio
+import json
+from argparse import ArgumentParser
+from collections import namedtuple
+from time import process_time
+from typing import Callable
+from uuid import uuid4
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from benchmarks.lookup_engine import SAMPLE_IP_DATA
+from ipdata.app.main import app
+from ipdata.app.utils import ip_data_attributes, ip_data_entity_to_schema
+from ipdata.schemas.ipdata import LocationDataWithSimpleLanguages
+from ipdata.services.cache.location_cache import LocationCache
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.serialization.ip_data_json import encode_ip_data
+
+IP = "172.68.213.129"
+
+
+def build_row() -> tuple:
+    attributes = ip_data_attributes(IPData(**SAMPLE_IP_DATA))
+    Row = namedtuple("Row", ["ip", *attributes, "location_id"])
+    return Row(ip=IP, **attributes, location_id=str(uuid4()))
+
+
+def response_model_path(row, location_cache: LocationCache) -> Callable[[], bytes]:
+    field = next(
+        route.response_field for route in app.routes if isinstance(route, APIRoute) and route.path == "/ipdata/{ip}"
+    )
+    loop = asyncio.new_event_loop()
+
+    def respond() -> bytes:
+        schema = ip_data_entity_to_schema(row, location_cache.get(row.location_id))
+        content = loop.run_until_complete(serialize_response(field=field, response_content=schema))
+        return JSONResponse(content).body
+
+    return respond
+
+
+def fast_path(row, location_cache: LocationCache) -> Callable[[], bytes]:
+    def respond() -> bytes:
+        return encode_ip_data(row, IP, location_cache.get_json(row.location_id))
+
+    return respond
+
+
+def measure(respond: Callable[[], bytes], requests: int) -> float:
+    """
+    Microseconds of CPU time per response.
+    """
+    started_at = process_time()
+    for _ in range(requests):
+        respond()
+    return (process_time() - started_at) / requests * 1e6
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Measure CPU time per response of the response model and the fast path")
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    row = build_row()
+    location_cache = LocationCache()
+    location = {**SAMPLE_IP_DATA["location"], "languages": ["cs"]}
+    location_cache.set(row.location_id, LocationDataWithSimpleLanguages(**location))
+    old, new = response_model_path(row, location_cache), fast_path(row, location_cache)
+    assert json.loads(old()) == json.loads(new())
+
+    report = {"response_model_us": measure(old, args.requests), "fast_path_us": measure(new, args.requests)}
+    report["speedup"] = report["response_model_us"] / report["fast_path_us"]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
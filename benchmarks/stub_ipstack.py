@@ -0,0 +1,167 @@
+"""
+Local stand-in for the ipstack API, for load tests:
+
+    python -m benchmarks.stub_ipstack --port 9000 --latency 0.05 --error-rate 0.01 --limit-rate 0.001
+
+Every IP gets synthetic data with one of --locations locations. Answers take --latency seconds (± --jitter),
+and a share of them are HTTP 500 errors (--error-rate) or ipstack errors 104, monthly limit reached (--limit-rate)
+and 106, invalid IP address (--invalid-rate). Bulk lookups (IPs separated by commas) are supported.
+"""
+
+import json
+import zlib
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Lock, Thread
+from time import sleep
+from typing import Any
+from urllib.parse import unquote, urlsplit
+
+from benchmarks.bulk_import import IP_DATA, LOCATION
+
+# geoname_id of the first synthetic location, far from real ones
+FIRST_GEONAME_ID = 20_000_000
+ERRORS = {
+    104: ("usage_limit_reached", "Your monthly usage limit has been reached."),
+    106: ("invalid_ip_address", "The IP Address supplied is invalid."),
+}
+
+
+class StubIPStack:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        limit_rate: float = 0.0,
+        invalid_rate: float = 0.0,
+        locations: int = 1000,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limit_rate = limit_rate
+        self.invalid_rate = invalid_rate
+        self.locations = locations
+        self.requests = 0
+        self.lookups = 0
+        self._random = Random(seed)
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def __enter__(self) -> "StubIPStack":
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict[str, int]:
+        return {"requests": self.requests, "lookups": self.lookups}
+
+    def answer(self, path: str) -> tuple[int, Any]:
+        """
+        Return the status code and the body of the answer to a GET of path, and wait for the latency.
+        """
+        ips = unquote(urlsplit(path).path).strip("/").split(",")
+        with self._lock:
+            self.requests += 1
+            self.lookups += len(ips)
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            draws = [self._random.random() for _ in ips]
+            failed = self._random.random() < self.error_rate
+        sleep(delay)
+        if failed:
+            return 500, {"detail": "Internal Server Error"}
+
+        answers = [self.ip_data(ip, draw) for ip, draw in zip(ips, draws)]
+        return 200, answers if len(ips) > 1 else answers[0]
+
+    def ip_data(self, ip: str, draw: float) -> dict[str, Any]:
+        if draw < self.limit_rate:
+            return error(104)
+        if draw < self.limit_rate + self.invalid_rate:
+            return error(106)
+        geoname_id = FIRST_GEONAME_ID + zlib.crc32(ip.encode()) % self.locations
+        return {
+            **IP_DATA,
+            "ip": ip,
+            "type": "ipv6" if ":" in ip else "ipv4",
+            "location": {**LOCATION, "geoname_id": geoname_id, "languages": languages()},
+        }
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                status_code, body = stub.answer(self.path)
+                content = json.dumps(body).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+def error(code: int) -> dict[str, Any]:
+    error_type, info = ERRORS[code]
+    return {"success": False, "error": {"code": code, "type": error_type, "info": info}}
+
+
+def languages() -> list[dict[str, str]]:
+    return [{"code": code, "name": code, "native": code} for code in LOCATION["languages"]]
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Serve a local stand-in for the ipstack API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency varies uniformly by up to that")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of HTTP 500 answers")
+    parser.add_argument("--limit-rate", type=float, default=0.0, help="share of 104 monthly limit reached errors")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of 106 invalid IP address errors")
+    parser.add_argument("--locations", type=int, default=1000)
+    args = parser.parse_args()
+
+    stub = StubIPStack(
+        args.host,
+        args.port,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.limit_rate,
+        args.invalid_rate,
+        args.locations,
+    )
+    print(f"Serving ipstack stand-in at {stub.url}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,401 @@
-from fastapi import Depends, FastAPI
-from pydantic import IPvAnyAddress
+import asyncio
+import secrets
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from typing import Any, Literal
+from uuid import UUID
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import IPvAnyAddress, IPvAnyNetwork
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm import Session
 
-from ipdata.app.utils import create_ip_data_manually_schema, create_ip_data_schema, delete_ip_schema, get_ip_data_schema
-from ipdata.db import get_db
-from ipdata.schemas.ipdata import IPDataCreateManuallySchema, IPDataCreateSchema, IPDataReturnSchema
+from ipdata.app.utils import (
+    create_ip_data_job_schema,
+    create_ip_data_manually_schema,
+    create_ip_data_schema,
+    create_ip_data_schema_async,
+    delete_ip_schema,
+    enrich_ip_data_batch_schema,
+    enrich_ip_data_batch_schema_async,
+    get_ip_data_batch_schema,
+    get_ip_data_batch_schema_async,
+    get_ip_data_batch_snapshot_schema,
+    get_ip_data_job_schema,
+    get_ip_data_json,
+    get_ip_data_range_schema,
+    get_ip_data_schema,
+    get_ip_data_snapshot_schema,
+    ip_data_batch_to_ndjson,
+    ip_data_creates,
+    ip_data_creates_async,
+    load_location_cache_async,
+    process_ip_data_jobs_continuously,
+    rebuild_ip_lookup_engine_async,
+    refresh_ip_lookup_engine_periodically,
+    refresh_stale_ip_data_periodically,
+)
+from ipdata.db import (
+    dispose_async_database,
+    dispose_database,
+    get_db,
+    get_engine,
+    get_pool_stats,
+    init_async_database,
+    init_database,
+    run_in_session,
+)
+from ipdata.schemas.ipdata import (
+    IPDataBatchEnrichReturnSchema,
+    IPDataBatchRequestSchema,
+    IPDataBatchReturnSchema,
+    IPDataCreateManuallySchema,
+    IPDataCreateSchema,
+    IPDataJobReturnSchema,
+    IPDataRangeReturnSchema,
+    IPDataReturnSchema,
+)
+from ipdata.services.bulk_export.exporter import (
+    MEDIA_TYPES,
+    ExportWriter,
+    export_chunks,
+    export_chunks_async,
+    export_query,
+)
+from ipdata.services.cache.backends import create_cache_backend
+from ipdata.services.cache.ip_data_cache import ip_data_cache
+from ipdata.services.cache.location_cache import location_cache
+from ipdata.services.instrumentation.profiler import ProfilerBusyError, sampling_profiler
+from ipdata.services.instrumentation.request_log import (
+    RequestLogMiddleware,
+    configure_logging,
+    install_query_hooks,
+    remove_query_hooks,
+)
+from ipdata.services.ip_client.providers import dispose_ip_clients, ip_clients_stats
+from ipdata.services.lookup.ip_lookup_engine import ip_lookup_engine
+from ipdata.services.metrics.middleware import MetricsMiddleware
+from ipdata.services.metrics.registry import render_family, render_metrics
+from ipdata.services.refresh.freshness import refresh_queue
+from ipdata.services.serialization.ip_data_json import JSONBytesResponse, encode_ip_data_schema
+from ipdata.services.snapshot.snapshot_reader import dispose_snapshot, get_snapshot, init_snapshot
+from ipdata.settings import settings
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    configure_logging()
+    install_query_hooks()
+
+    cache_backend = create_cache_backend(settings)
+    if cache_backend is not None:
+        # Changes made by other workers are dropped from the lookup engine too
+        ip_data_cache.connect(cache_backend, on_invalidate=ip_lookup_engine.invalidate)
+
+    if settings.async_mode:
+        init_async_database()
+    else:
+        init_database()
+
+    if settings.read_mode == "snapshot":
+        init_snapshot(settings.snapshot_path)
+
+    lookup_engine_refresher = None
+    if settings.lookup_engine_enabled and settings.read_mode == "database":
+        # Also loads the location cache
+        await rebuild_ip_lookup_engine_async()
+        lookup_engine_refresher = asyncio.create_task(
+            refresh_ip_lookup_engine_periodically(settings.lookup_engine_refresh_interval)
+        )
+    elif settings.location_cache_preload and settings.read_mode == "database":
+        await load_location_cache_async()
+
+    stale_data_refresher = None
+    if settings.refresh_enabled and settings.read_mode == "database":
+        stale_data_refresher = asyncio.create_task(refresh_stale_ip_data_periodically(settings.refresh_interval))
+
+    job_workers = []
+    if settings.read_mode == "database":
+        job_workers = [
+            asyncio.create_task(process_ip_data_jobs_continuously(settings.job_poll_interval))
+            for _ in range(settings.job_workers)
+        ]
+
+    yield
+
+    for job_worker in job_workers:
+        job_worker.cancel()
+    if stale_data_refresher is not None:
+        stale_data_refresher.cancel()
+    if lookup_engine_refresher is not None:
+        lookup_engine_refresher.cancel()
+    ip_lookup_engine.clear()
+    location_cache.clear()
+    dispose_snapshot()
+    await dispose_ip_clients()
 
-app = FastAPI()
+    if settings.async_mode:
+        await dispose_async_database()
+    # Also created in async mode, by rebuilds of the lookup engine
+    dispose_database()
+
+    await ip_data_cache.disconnect()
+    sampling_profiler.stop()
+    remove_query_hooks()
+
+
+app = FastAPI(lifespan=lifespan)
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+# Outermost, so that the request id and timings cover the metrics middleware too
+app.add_middleware(RequestLogMiddleware)
 
 
 @app.post("/ipdata/", response_model=IPDataReturnSchema, description="Create IP data based on external API response")
-def create_ip_data(ip_create: IPDataCreateSchema, db: Session = Depends(get_db())):
-    return create_ip_data_schema(ip_create, db)
+async def create_ip_data(ip_create: IPDataCreateSchema, db: Session | AsyncSession = Depends(get_db())):
+    if isinstance(db, AsyncSession):
+        return await create_ip_data_schema_async(ip_create, db)
+    return await run_in_session(db, create_ip_data_schema, ip_create)
 
 
 @app.post("/ipdata/manual", response_model=IPDataReturnSchema, description="Manually create IP data based on request")
-def create_ip_data_manually(ip_data: IPDataCreateManuallySchema, db: Session = Depends(get_db())):
-    return create_ip_data_manually_schema(ip_data, db)
+async def create_ip_data_manually(ip_data: IPDataCreateManuallySchema, db: Session | AsyncSession = Depends(get_db())):
+    return await run_in_session(db, create_ip_data_manually_schema, ip_data)
+
+
+@app.post(
+    "/ipdata/jobs",
+    status_code=HTTPStatus.ACCEPTED,
+    response_model=IPDataJobReturnSchema,
+    description="Queue creation of IP data based on external API response and return right away. "
+    "The job is processed in the background, its status is at the URL in the Location header",
+)
+async def create_ip_data_job(
+    ip_create: IPDataCreateSchema, response: Response, db: Session | AsyncSession = Depends(get_db())
+):
+    job = await run_in_session(db, create_ip_data_job_schema, ip_create)
+    response.headers["Location"] = f"/ipdata/jobs/{job.id}"
+    return job
+
+
+@app.get("/ipdata/jobs/{job_id}", response_model=IPDataJobReturnSchema, description="Get status of IP data job")
+async def get_ip_data_job(job_id: UUID, db: Session | AsyncSession = Depends(get_db())):
+    return await run_in_session(db, get_ip_data_job_schema, job_id)
+
+
+@app.post(
+    "/ipdata/batch",
+    response_model=IPDataBatchReturnSchema,
+    description="Get IP data of many IP addresses at once. Use stream=true to receive NDJSON lines instead",
+)
+async def get_ip_data_batch(
+    batch: IPDataBatchRequestSchema, stream: bool = False, db: Session | AsyncSession = Depends(get_db())
+):
+    if settings.read_mode == "snapshot":
+        ip_data_batch = get_ip_data_batch_snapshot_schema(batch)
+    else:
+        if isinstance(db, AsyncSession):
+            ip_data_batch = await get_ip_data_batch_schema_async(batch, db)
+        else:
+            ip_data_batch = await run_in_session(db, get_ip_data_batch_schema, batch)
+    if stream:
+        return StreamingResponse(ip_data_batch_to_ndjson(ip_data_batch), media_type="application/x-ndjson")
+    return ip_data_batch
+
+
+@app.post(
+    "/ipdata/batch/enrich",
+    response_model=IPDataBatchEnrichReturnSchema,
+    description="Create IP data of many IP addresses at once based on external API responses",
+)
+async def enrich_ip_data_batch(batch: IPDataBatchRequestSchema, db: Session | AsyncSession = Depends(get_db())):
+    if isinstance(db, AsyncSession):
+        return await enrich_ip_data_batch_schema_async(batch, db)
+    return await run_in_session(db, enrich_ip_data_batch_schema, batch)
+
+
+@app.get(
+    "/ipdata/range/{cidr:path}",
+    response_model=IPDataRangeReturnSchema,
+    description="Get IP data of all IP addresses in a network, e.g. /ipdata/range/172.68.0.0/16. "
+    "Pass next_cursor of the previous page as `after` to get the next page",
+)
+async def get_ip_data_range(
+    cidr: IPvAnyNetwork,
+    after: IPvAnyAddress | None = None,
+    limit: int = Query(default=100, ge=1),
+    db: Session | AsyncSession = Depends(get_db()),
+):
+    return await run_in_session(db, get_ip_data_range_schema, cidr, after, limit)
+
+
+@app.get(
+    "/ipdata/export",
+    description="Stream all IP data, or that of a network or a country, ordered by IP. "
+    "Pass the last exported IP as `after` to continue an interrupted export",
+)
+async def export_ip_data(
+    format: Literal["ndjson", "csv", "columnar"] = "ndjson",
+    network: IPvAnyNetwork | None = None,
+    country_code: str | None = None,
+    after: IPvAnyAddress | None = None,
+    limit: int | None = Query(default=None, ge=1),
+    compression: Literal["none", "gzip", "zstd"] = "none",
+):
+    query = export_query(network, country_code, after, limit)
+    writer = ExportWriter(format, compression)
+    engine = get_engine()
+    if isinstance(engine, AsyncEngine):
+        chunks = export_chunks_async(engine, query, writer)
+    else:
+        chunks = export_chunks(engine, query, writer)
+    headers = {"Content-Encoding": compression} if compression != "none" else None
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[format], headers=headers)
 
 
 @app.get("/ipdata/{ip}", response_model=IPDataReturnSchema, description="Get IP data based on IP address")
-def get_ip_data(ip: IPvAnyAddress, db: Session = Depends(get_db())):
-    return get_ip_data_schema(ip, db)
+async def get_ip_data(ip: IPvAnyAddress, db: Session | AsyncSession = Depends(get_db())):
+    if settings.read_mode == "snapshot":
+        ip_data_schema = get_ip_data_snapshot_schema(ip)
+        return (
+            JSONBytesResponse(encode_ip_data_schema(ip_data_schema)) if settings.response_fast_path else ip_data_schema
+        )
+
+    # The lookup runs on the event loop in async mode, where it does not read the shared cache by itself
+    if isinstance(db, AsyncSession):
+        await ip_data_cache.prefetch([ip])
+    if not settings.response_fast_path:
+        return await run_in_session(db, get_ip_data_schema, ip)
+    return JSONBytesResponse(await run_in_session(db, get_ip_data_json, ip))
 
 
 @app.delete("/ipdata/{ip}", description="Delete IP data")
-def delete_ip_data(ip: IPvAnyAddress, db: Session = Depends(get_db())):
-    return delete_ip_schema(ip, db)
+async def delete_ip_data(ip: IPvAnyAddress, db: Session | AsyncSession = Depends(get_db())):
+    return await run_in_session(db, delete_ip_schema, ip)
+
+
+@app.get("/stats", description="Get runtime statistics of the service")
+def get_stats() -> dict[str, Any]:
+    snapshot = get_snapshot()
+    return {
+        "db_pool": get_pool_stats(),
+        "cache": ip_data_cache.stats(),
+        "location_cache": location_cache.stats(),
+        "lookup_engine": ip_lookup_engine.stats(),
+        "coalesced_creates": {"sync": ip_data_creates.stats(), "async": ip_data_creates_async.stats()},
+        "snapshot": snapshot.stats() if snapshot is not None else None,
+        "ip_providers": ip_clients_stats(),
+        "refresh": refresh_queue.stats(),
+    }
+
+
+@app.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    description="Get latency histograms by route and by stage, upstream errors, database pool and cache metrics "
+    "in the Prometheus text format",
+)
+def get_metrics() -> str:
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Metrics are disabled")
+    return render_metrics(*collect_component_metrics())
+
+
+def collect_component_metrics() -> list[str]:
+    pool = get_pool_stats()
+    caches = {
+        "ip_data": ip_data_cache.stats(),
+        "location": location_cache.stats(),
+        "lookup_engine": ip_lookup_engine.stats(),
+    }
+    return [
+        render_family(
+            "ipdata_db_pool_connections",
+            "Connections of the database pool by state",
+            "gauge",
+            {(state,): pool.get(state, 0) for state in ["size", "checked_in", "checked_out", "overflow"]},
+            ["state"],
+        ),
+        render_family("ipdata_db_pool_checkouts_total", "Connection checkouts", "counter", {(): pool["checkouts"]}),
+        render_family(
+            "ipdata_db_pool_checkout_timeouts_total",
+            "Connection checkouts which timed out",
+            "counter",
+            {(): pool["checkout_timeouts"]},
+        ),
+        render_family(
+            "ipdata_db_pool_wait_seconds_total",
+            "Time spent waiting for a connection",
+            "counter",
+            {(): pool["wait_seconds_total"]},
+        ),
+        render_family(
+            "ipdata_cache_hits_total",
+            "Hits of the in-process caches",
+            "counter",
+            {(name,): stats["hits"] for name, stats in caches.items()},
+            ["cache"],
+        ),
+        render_family(
+            "ipdata_cache_misses_total",
+            "Misses of the in-process caches",
+            "counter",
+            {(name,): stats["misses"] for name, stats in caches.items()},
+            ["cache"],
+        ),
+        render_family(
+            "ipdata_cache_hit_ratio",
+            "Share of lookups answered by the in-process caches since the start",
+            "gauge",
+            {(name,): hit_ratio(stats["hits"], stats["misses"]) for name, stats in caches.items()},
+            ["cache"],
+        ),
+    ]
+
+
+def hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def require_admin_token(x_admin_token: str = Header(default="")) -> None:
+    """
+    Admin endpoints exist only when ADMIN_TOKEN is set, and answer only requests sending it in X-Admin-Token.
+    """
+    admin_token = settings.admin_token.get_secret_value()
+    if not admin_token:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Not Found")
+    if not secrets.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail="Invalid admin token")
+
+
+@app.post(
+    "/admin/profile",
+    status_code=HTTPStatus.ACCEPTED,
+    dependencies=[Depends(require_admin_token)],
+    description="Start the sampling profiler for `seconds`, or for the next `requests` requests when that comes first. "
+    "The stacks are at GET /admin/profile",
+)
+def start_profile(
+    seconds: float | None = Query(default=None, gt=0),
+    requests: int | None = Query(default=None, ge=1),
+) -> dict[str, Any]:
+    duration = min(seconds or settings.profiler_max_duration, settings.profiler_max_duration)
+    try:
+        sampling_profiler.start(duration, requests, settings.profiler_interval)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=HTTPStatus.CONFLICT, detail=str(e))
+    return sampling_profiler.stats()
+
+
+@app.get(
+    "/admin/profile",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_admin_token)],
+    description="Get the stacks sampled by the last profile in the folded format of flame graph tools",
+)
+def get_profile(response: Response) -> str:
+    stats = sampling_profiler.stats()
+    response.headers["X-Profile-Running"] = str(stats["running"]).lower()
+    response.headers["X-Profile-Samples"] = str(stats["samples"])
+    return sampling_profiler.folded()
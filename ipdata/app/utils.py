@@ -1,40 +1,93 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
+from inspect import iscoroutinefunction
+from ipaddress import ip_network
+from logging import getLogger
+from typing import Any, Iterable, Iterator
 from uuid import UUID
 
 from fastapi import HTTPException
-from furl import furl
-from pydantic import IPvAnyAddress
-from sqlalchemy.exc import OperationalError
+from pydantic import IPvAnyAddress, IPvAnyNetwork
+from sqlalchemy import ARRAY, Row, Select, any_, delete, exists, func, literal, select, update
+from sqlalchemy.dialects.postgresql import INET, insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from ipdata.models.ip_data import IPDataModel, LocationModel
+from ipdata.db import get_db, get_engine, get_session, run_in_session
+from ipdata.models.ip_data import IPAddressType, IPDataModel, IPRangeModel, LocationModel
+from ipdata.models.ip_data_job import IPDataJobModel
 from ipdata.schemas.ipdata import (
+    IPDataBatchEnrichReturnSchema,
+    IPDataBatchErrorSchema,
+    IPDataBatchRequestSchema,
+    IPDataBatchReturnSchema,
     IPDataCreateManuallySchema,
     IPDataCreateSchema,
+    IPDataJobReturnSchema,
+    IPDataRangeReturnSchema,
     IPDataReturnSchema,
     LocationDataWithSimpleLanguages,
 )
+from ipdata.services.cache.ip_data_cache import NOT_FOUND, ip_data_cache, normalize_ip
+from ipdata.services.cache.location_cache import location_cache
+from ipdata.services.coalescing.advisory_lock import advisory_lock, advisory_lock_async
+from ipdata.services.coalescing.single_flight import AsyncSingleFlight, SingleFlight
+from ipdata.services.ip_client.budget import Priority, lookup_priority
 from ipdata.services.ip_client.data import IPData, LanguagesData, LocationData
-from ipdata.services.ip_client.exceptions import IpStackException
-from ipdata.services.ip_client.ip_stack_client import IPStackClient
+from ipdata.services.ip_client.exceptions import BUDGET_EXHAUSTED, CIRCUIT_OPEN, IpStackException
+from ipdata.services.ip_client.fan_out import fetch_ip_data_batch, fetch_ip_data_batch_async
+from ipdata.services.ip_client.providers import get_async_ip_client, get_ip_client
+from ipdata.services.ip_client.upstream_guard import is_transient
+from ipdata.services.lookup.ip_lookup_engine import ip_lookup_engine
+from ipdata.services.metrics.registry import stage_duration
+from ipdata.services.refresh.freshness import freshness_attributes, is_stale, refresh_queue
+from ipdata.services.serialization.ip_data_json import IP_DATA_FIELDS, encode_ip_data
+from ipdata.services.snapshot.snapshot_reader import get_snapshot
 from ipdata.settings import settings
 
+# Rows fetched from the database at once while the lookup engine is rebuilt
+LOOKUP_ENGINE_LOAD_BATCH_SIZE = 10000
+
+logger = getLogger(__name__)
+
+# Concurrent creates of the same IP share one upstream call and one insert
+ip_data_creates: SingleFlight[IPDataReturnSchema] = SingleFlight()
+ip_data_creates_async: AsyncSingleFlight[IPDataReturnSchema] = AsyncSingleFlight()
+
 
 def db_operations_wrapper():
     """
     This is decorator that wraps the function and catches sqlalchemy errors.
+    Both regular and coroutine functions are supported.
     :return:
     """
 
+    def service_unavailable() -> HTTPException:
+        return HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail=f"Service is unavailable. Please try again later.",
+        )
+
     def decorator(func):
+        if iscoroutinefunction(func):
+
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except OperationalError:
+                    raise service_unavailable()
+
+            return async_wrapper
+
         def wrapper(*args, **kwargs):
             try:
                 return func(*args, **kwargs)
             except OperationalError:
-                raise HTTPException(
-                    status_code=HTTPStatus.SERVICE_UNAVAILABLE,
-                    detail=f"Service is unavailable. Please try again later.",
-                )
+                raise service_unavailable()
 
         return wrapper
 
@@ -43,41 +96,295 @@ def db_operations_wrapper():
 
 @db_operations_wrapper()
 def get_ip_data_schema(ip: IPvAnyAddress, db: Session) -> IPDataReturnSchema:
+    ip_data_schema = ip_lookup_engine.get(ip)
+    if ip_data_schema is not None:
+        return ip_data_schema
+
+    cached = ip_data_cache.get(ip)
+    if cached is NOT_FOUND:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="IP not found in the database")
+    if cached is not None:
+        return cached
+
+    # Exact IP row is the most specific match, network blocks are only a fallback
     ip_data = get_ip_data_by_ip(db, ip)
+    if ip_data:
+        queue_refresh_if_stale(ip_data)
+    elif settings.range_store_enabled:
+        ip_data = get_ip_range_by_ip(db, ip)
+    if not ip_data:
+        ip_data_cache.set_not_found(ip)
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="IP not found in the database")
+
+    location = get_location(db, ip_data.location_id)
+    with stage_duration.time("build_response"):
+        ip_data_schema = ip_data_entity_to_schema(ip_data, location, ip=ip)
+    ip_data_cache.set(ip, ip_data_schema)
+    return ip_data_schema
+
+
+@db_operations_wrapper()
+def get_ip_data_json(ip: IPvAnyAddress, db: Session) -> bytes:
+    """
+    Fast path of get_ip_data_schema: the same response, encoded straight from the row without building
+    and validating response models. Encoded responses are kept in the response cache.
+    """
+    encoded = ip_lookup_engine.get_json(ip)
+    if encoded is not None:
+        return encoded
+
+    cached = ip_data_cache.get_json(ip)
+    if cached is NOT_FOUND:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="IP not found in the database")
+    if cached is not None:
+        return cached
+
+    ip_data = get_ip_data_row_by_ip(db, ip)
+    if ip_data:
+        queue_refresh_if_stale(ip_data)
+    elif settings.range_store_enabled:
+        ip_data = get_ip_range_by_ip(db, ip)
     if not ip_data:
+        ip_data_cache.set_not_found(ip)
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="IP not found in the database")
 
-    location = get_location_by_id(db, ip_data.location_id)
-    return ip_data_entity_to_schema(ip_data, location)
+    location = get_location_json(db, ip_data.location_id)
+    with stage_duration.time("build_response"):
+        encoded = encode_ip_data(ip_data, str(ip), location)
+    ip_data_cache.set(ip, encoded)
+    return encoded
+
+
+@db_operations_wrapper()
+def get_ip_data_batch_schema(batch: IPDataBatchRequestSchema, db: Session) -> IPDataBatchReturnSchema:
+    results = lookup_ip_data_batch(normalize_batch_ips(batch))
+    # The batch only reads the response cache and does not promote its hits, so large batches do not evict hot entries
+    results.update(ip_data_cache.get_many(missing_ips(results)))
+    return complete_ip_data_batch(results, db)
+
+
+@db_operations_wrapper()
+async def get_ip_data_batch_schema_async(batch: IPDataBatchRequestSchema, db: AsyncSession) -> IPDataBatchReturnSchema:
+    results = lookup_ip_data_batch(normalize_batch_ips(batch))
+    results.update(await ip_data_cache.get_many_async(missing_ips(results)))
+    return await run_in_session(db, complete_ip_data_batch, results)
+
+
+def lookup_ip_data_batch(ips: list[str]) -> dict[str, IPDataReturnSchema | object | None]:
+    return {ip: ip_lookup_engine.get(ip) for ip in ips}
+
+
+def missing_ips(results: dict[str, IPDataReturnSchema | object | None]) -> list[str]:
+    return [ip for ip, result in results.items() if result is None]
+
+
+def complete_ip_data_batch(
+    results: dict[str, IPDataReturnSchema | object | None], db: Session
+) -> IPDataBatchReturnSchema:
+    """
+    Read the IPs found in neither the lookup engine nor the response cache from the database, with one query.
+    """
+    for ip, ip_data in get_ip_data_by_ips(db, missing_ips(results)).items():
+        queue_refresh_if_stale(ip_data)
+        results[ip] = ip_data_entity_to_schema(ip_data, get_location(db, ip_data.location_id))
+
+    return IPDataBatchReturnSchema(
+        results=[result for result in results.values() if isinstance(result, IPDataReturnSchema)],
+        not_found=[ip for ip, result in results.items() if not isinstance(result, IPDataReturnSchema)],
+    )
+
+
+def get_ip_data_snapshot_schema(ip: IPvAnyAddress) -> IPDataReturnSchema:
+    ip_data_schema = get_snapshot().get(ip)
+    if ip_data_schema is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="IP not found in the snapshot")
+    return ip_data_schema
+
+
+def get_ip_data_batch_snapshot_schema(batch: IPDataBatchRequestSchema) -> IPDataBatchReturnSchema:
+    snapshot = get_snapshot()
+    results = {ip: snapshot.get(ip) for ip in normalize_batch_ips(batch)}
+    return IPDataBatchReturnSchema(
+        results=[result for result in results.values() if result is not None],
+        not_found=[ip for ip, result in results.items() if result is None],
+    )
+
+
+@db_operations_wrapper()
+def enrich_ip_data_batch_schema(batch: IPDataBatchRequestSchema, db: Session) -> IPDataBatchEnrichReturnSchema:
+    ips = normalize_batch_ips(batch)
+    existing = get_existing_ips(db, ips)
+    missing = [ip for ip in ips if ip not in existing]
+
+    with lookup_priority("batch"):
+        fetched = fetch_ip_data_batch(
+            get_ip_client(),
+            missing,
+            concurrency=settings.ip_stack_concurrency,
+            bulk=settings.ip_stack_bulk_lookup,
+        )
+
+    return save_enriched_ip_data_batch(db, ips, existing, fetched)
+
+
+@db_operations_wrapper()
+async def enrich_ip_data_batch_schema_async(
+    batch: IPDataBatchRequestSchema, db: AsyncSession
+) -> IPDataBatchEnrichReturnSchema:
+    ips = normalize_batch_ips(batch)
+    existing = await db.run_sync(get_existing_ips, ips)
+    missing = [ip for ip in ips if ip not in existing]
+
+    with lookup_priority("batch"):
+        fetched = await fetch_ip_data_batch_async(
+            get_async_ip_client(),
+            missing,
+            concurrency=settings.ip_stack_concurrency,
+            bulk=settings.ip_stack_bulk_lookup,
+        )
+
+    return await db.run_sync(save_enriched_ip_data_batch, ips, existing, fetched)
+
+
+def normalize_batch_ips(batch: IPDataBatchRequestSchema) -> list[str]:
+    return list(dict.fromkeys(normalize_ip(ip) for ip in batch.ips))
+
+
+def save_enriched_ip_data_batch(
+    db: Session, ips: list[str], existing: set[str], fetched: dict[str, IPData | IpStackException]
+) -> IPDataBatchEnrichReturnSchema:
+    created = save_ip_data_batch(
+        db,
+        [ip_data for ip_data in fetched.values() if isinstance(ip_data, IPData)],
+        store_range=settings.range_store_enabled,
+    )
+    existing = existing | skipped_ips(fetched, created)
+
+    errors = []
+    for ip, result in fetched.items():
+        if isinstance(result, IpStackException):
+            exception = get_exception_based_on_status_code(result.code)
+            errors.append(IPDataBatchErrorSchema(ip=ip, status_code=exception.status_code, detail=exception.detail))
+
+    return IPDataBatchEnrichReturnSchema(
+        created=created,
+        existing=[ip for ip in ips if ip in existing],
+        errors=errors,
+    )
+
+
+def skipped_ips(fetched: dict[str, IPData | IpStackException], created: list[IPDataReturnSchema]) -> set[str]:
+    """
+    Fetched IPs which were not inserted, because they have been created in the meantime.
+    """
+    created_ips = {normalize_ip(ip_data.ip) for ip_data in created}
+    return {ip for ip, result in fetched.items() if isinstance(result, IPData) and ip not in created_ips}
+
+
+def ip_data_batch_to_ndjson(ip_data_batch: IPDataBatchReturnSchema) -> Iterator[bytes]:
+    for result in ip_data_batch.results:
+        yield result.model_dump_json().encode() + b"\n"
+    for ip in ip_data_batch.not_found:
+        yield json.dumps({"ip": ip, "detail": "IP not found in the database"}).encode() + b"\n"
+
+
+@db_operations_wrapper()
+def get_ip_data_range_schema(
+    network: IPvAnyNetwork, after: IPvAnyAddress | None, limit: int, db: Session
+) -> IPDataRangeReturnSchema:
+    if after is not None and after.version != network.version:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Cursor and network must be of the same IP version"
+        )
+
+    limit = min(limit, settings.range_page_max_size)
+    ip_data_entities = get_ip_data_by_network(db, network, after, limit)
+
+    return IPDataRangeReturnSchema(
+        results=[ip_data_entity_to_schema(entity, get_location(db, entity.location_id)) for entity in ip_data_entities],
+        next_cursor=ip_data_entities[-1].ip if len(ip_data_entities) == limit else None,
+    )
 
 
 @db_operations_wrapper()
 def create_ip_data_schema(ip_create: IPDataCreateSchema, db: Session) -> IPDataReturnSchema:
-    ip_exists_in_db = get_ip_data_by_ip(db, ip_create.ip)
-    if ip_exists_in_db:
-        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="IP already exists in the database")
+    # Only spares the upstream lookup of a stored IP, the insert detects duplicates by itself
+    ensure_ip_not_in_db(db, ip_create.ip)
+    # Gives the connection back to the pool, it is not needed while waiting for other creates or for the upstream
+    db.close()
+
+    ip = normalize_ip(ip_create.ip)
+    if not settings.ip_stack_coalesce_requests:
+        return fetch_and_save_ip_data(db, ip)
+    return ip_data_creates.do(ip, lambda: fetch_and_save_ip_data(db, ip))
+
+
+def fetch_and_save_ip_data(db: Session, ip: str) -> IPDataReturnSchema:
+    if not settings.ip_stack_coalesce_across_workers:
+        return save_ip_data(db, fetch_ip_data(ip), store_range=settings.range_store_enabled)
 
+    with advisory_lock(get_engine(), ip, settings.ip_stack_coalesce_lock_timeout) as locked:
+        if not locked:
+            log_create_lock_timeout(ip)
+        # Another worker may have created the IP while this one was waiting for the lock
+        ip_data = get_ip_data_by_ip(db, ip)
+        if ip_data:
+            return ip_data_entity_to_schema(ip_data, get_location(db, ip_data.location_id))
+        db.close()
+        return save_ip_data(db, fetch_ip_data(ip), store_range=settings.range_store_enabled)
+
+
+def log_create_lock_timeout(ip: str) -> None:
+    # The insert tolerates duplicates, so the create goes on at the cost of another upstream call
+    logger.warning(
+        "Timed out after %ss waiting for another worker to create %s, creating it without the lock",
+        settings.ip_stack_coalesce_lock_timeout,
+        ip,
+    )
+
+
+def fetch_ip_data(ip: str) -> IPData:
     try:
-        ip_data: IPData = IPStackClient(furl(settings.ip_stack_url)).get_ip_data(str(ip_create.ip))
+        return get_ip_client().get_ip_data(ip)
     except IpStackException as e:
         raise get_exception_based_on_status_code(e.code)
 
-    location = add_location_to_db(db, ip_data.location)
-    ip_data_entity = create_ip_data_entity(ip_data, location, db)
 
-    return ip_data_entity_to_schema(ip_data_entity, location)
+@db_operations_wrapper()
+async def create_ip_data_schema_async(ip_create: IPDataCreateSchema, db: AsyncSession) -> IPDataReturnSchema:
+    await db.run_sync(ensure_ip_not_in_db, ip_create.ip)
+    await db.close()
 
+    ip = normalize_ip(ip_create.ip)
+    if not settings.ip_stack_coalesce_requests:
+        return await fetch_and_save_ip_data_async(db, ip)
+    return await ip_data_creates_async.do(ip, lambda: fetch_and_save_ip_data_async(db, ip))
 
-@db_operations_wrapper()
-def create_ip_data_manually_schema(ip_data: IPDataCreateManuallySchema, db: Session) -> IPDataReturnSchema:
-    ip_exists_in_db = get_ip_data_by_ip(db, ip_data.ip)
-    if ip_exists_in_db:
-        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="IP already exists in the database")
 
-    location = add_location_to_db(db, ip_data.location)
-    ip_data_entity = create_ip_data_entity(ip_data, location, db)
+async def fetch_and_save_ip_data_async(db: AsyncSession, ip: str) -> IPDataReturnSchema:
+    if not settings.ip_stack_coalesce_across_workers:
+        return await db.run_sync(save_ip_data, await fetch_ip_data_async(ip), settings.range_store_enabled)
 
-    return ip_data_entity_to_schema(ip_data_entity, location)
+    async with advisory_lock_async(get_engine(), ip, settings.ip_stack_coalesce_lock_timeout) as locked:
+        if not locked:
+            log_create_lock_timeout(ip)
+        ip_data = await db.run_sync(get_ip_data_by_ip, ip)
+        if ip_data:
+            return ip_data_entity_to_schema(ip_data, await db.run_sync(get_location, ip_data.location_id))
+        await db.close()
+        return await db.run_sync(save_ip_data, await fetch_ip_data_async(ip), settings.range_store_enabled)
+
+
+async def fetch_ip_data_async(ip: str) -> IPData:
+    try:
+        return await get_async_ip_client().get_ip_data(ip)
+    except IpStackException as e:
+        raise get_exception_based_on_status_code(e.code)
+
+
+@db_operations_wrapper()
+def create_ip_data_manually_schema(ip_data: IPDataCreateManuallySchema, db: Session) -> IPDataReturnSchema:
+    return save_ip_data(db, ip_data, fetched=False)
 
 
 @db_operations_wrapper()
@@ -86,62 +393,626 @@ def delete_ip_schema(ip: IPvAnyAddress, db: Session) -> HTTPStatus.OK:
     if not ip_data:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="IP not found in the database")
 
-    location = get_location_by_id(db, ip_data.location_id)
-
-    if not location_used_by_others(location, db):
-        db.delete(location)
-
+    location_id = ip_data.location_id
     db.delete(ip_data)
+    db.flush()
+    orphaned = delete_location_if_orphaned(location_id, db)
     db.commit()
+    if orphaned:
+        location_cache.invalidate(location_id)
+    ip_data_cache.invalidate(ip)
+    ip_lookup_engine.invalidate(ip)
     return HTTPStatus.OK
 
 
+def rebuild_ip_lookup_engine(db: Session) -> None:
+    """
+    Load the lookup engine from the database. Lookups are served by the previous index until the new one is ready.
+    Plain rows of only the served columns are read and indexed as they are, locations come from the location cache,
+    which is reloaded first, so loading of millions of rows stays fast.
+    """
+    load_location_cache(db)
+    with ip_lookup_engine.rebuild() as index:
+        ip_data_rows = db.execute(lookup_engine_columns(IPDataModel, IPDataModel.ip)).yield_per(
+            LOOKUP_ENGINE_LOAD_BATCH_SIZE
+        )
+        for ip_data in ip_data_rows:
+            index.add(ip_data, get_location(db, ip_data.location_id))
+
+        if settings.range_store_enabled:
+            ip_range_rows = db.execute(lookup_engine_columns(IPRangeModel, IPRangeModel.network)).yield_per(
+                LOOKUP_ENGINE_LOAD_BATCH_SIZE
+            )
+            for ip_range in ip_range_rows:
+                index.add(ip_range, get_location(db, ip_range.location_id), ip_network(ip_range.network))
+
+
+def lookup_engine_columns(model: type[IPDataModel] | type[IPRangeModel], key: Any) -> Select:
+    return select(key, model.location_id, *(getattr(model, name) for name in IP_DATA_FIELDS))
+
+
+async def rebuild_ip_lookup_engine_async() -> None:
+    """
+    The rebuild is a long CPU bound loop, so it runs on a synchronous session in a worker thread in both modes,
+    where it does not stall the event loop.
+    """
+    await run_in_threadpool(rebuild_ip_lookup_engine_in_new_session)
+
+
+def rebuild_ip_lookup_engine_in_new_session() -> None:
+    db = get_session()
+    try:
+        rebuild_ip_lookup_engine(db)
+    finally:
+        db.close()
+
+
+async def refresh_ip_lookup_engine_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await rebuild_ip_lookup_engine_async()
+        except Exception:
+            logger.exception("Could not refresh the lookup engine, the previous index is kept")
+
+
+def queue_refresh_if_stale(ip_data: IPDataModel) -> None:
+    """
+    Stale data is still returned, the refresh is left to the background refresher.
+    """
+    if settings.refresh_enabled and is_stale(ip_data.expires_at):
+        refresh_queue.put(ip_data.ip)
+
+
+def claim_stale_ips(limit: int, db: Session) -> list[str]:
+    """
+    Pick up to limit stale IPs to refresh: queued ones first, then those which expired the longest ago.
+    """
+    queued = refresh_queue.take(limit)
+    ips = claim_expired_ips(db, limit, among=queued) if queued else []
+    if len(ips) < limit:
+        ips += claim_expired_ips(db, limit - len(ips))
+    db.commit()
+    return ips
+
+
+def claim_expired_ips(db: Session, limit: int, among: list[str] | None = None) -> list[str]:
+    """
+    Claimed rows expire again after refresh_retry_delay, so that refreshers of other workers skip them
+    and refreshes which fail are retried later. Rows claimed by a concurrent transaction are skipped.
+    """
+    expired = select(IPDataModel.id).where(IPDataModel.expires_at <= func.now())
+    if among is not None:
+        expired = expired.where(IPDataModel.ip == any_(literal(among, ARRAY(INET))))
+    expired = expired.order_by(IPDataModel.expires_at).limit(limit).with_for_update(skip_locked=True)
+    return list(
+        db.scalars(
+            update(IPDataModel)
+            .where(IPDataModel.id.in_(expired.scalar_subquery()))
+            .values(expires_at=func.now() + timedelta(seconds=settings.refresh_retry_delay))
+            .returning(IPDataModel.ip)
+            .execution_options(synchronize_session=False)
+        )
+    )
+
+
+async def fetch_ip_data_in_background(
+    db: Session | AsyncSession, ips: list[str], priority: Priority
+) -> dict[str, IPData | IpStackException]:
+    """
+    Upstream lookups of background work: with the async client next to an AsyncSession, in a worker thread otherwise.
+    """
+    if isinstance(db, AsyncSession):
+        with lookup_priority(priority):
+            return await fetch_ip_data_batch_async(
+                get_async_ip_client(),
+                ips,
+                concurrency=settings.ip_stack_concurrency,
+                bulk=settings.ip_stack_bulk_lookup,
+            )
+    return await run_in_threadpool(fetch_ip_data_with_priority, ips, priority)
+
+
+def fetch_ip_data_with_priority(ips: list[str], priority: Priority) -> dict[str, IPData | IpStackException]:
+    with lookup_priority(priority):
+        return fetch_ip_data_batch(
+            get_ip_client(),
+            ips,
+            concurrency=settings.ip_stack_concurrency,
+            bulk=settings.ip_stack_bulk_lookup,
+        )
+
+
+def save_refreshed_ip_data(fetched: dict[str, IPData | IpStackException], db: Session) -> int:
+    """
+    Overwrite rows with their refreshed data. Rows which could not be refreshed keep their data.
+    """
+    refreshed = {ip: ip_data for ip, ip_data in fetched.items() if isinstance(ip_data, IPData)}
+    try:
+        locations = get_or_add_locations(db, [ip_data.location for ip_data in refreshed.values()])
+        updated = []
+        for ip, ip_data in refreshed.items():
+            location_id, _ = locations[ip_data.location.geoname_id]
+            updated += db.scalars(
+                update(IPDataModel)
+                .where(IPDataModel.ip == ip)
+                .values(location_id=location_id, **ip_data_attributes(ip_data), **freshness_attributes())
+                .returning(IPDataModel.ip)
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+    except IntegrityError:
+        # A cached location was deleted by another worker, the rows are refreshed again after refresh_retry_delay
+        db.rollback()
+        location_cache.clear()
+        raise
+    cache_locations(locations)
+
+    # Rows deleted in the meantime are not updated and must not come back to the lookup engine
+    for ip in updated:
+        ip_data = refreshed[ip]
+        _, location = locations[ip_data.location.geoname_id]
+        ip_data_cache.invalidate(ip)
+        ip_lookup_engine.set(ip_data_entity_to_schema(ip_data, location, ip=ip))
+    return len(updated)
+
+
+async def refresh_stale_ip_data() -> int:
+    """
+    Refresh one batch of stale rows. Upstream is called outside of any database transaction.
+    """
+    refreshed = 0
+    async for db in get_db()():
+        ips = await run_in_session(db, claim_stale_ips, settings.refresh_batch_size)
+        if ips:
+            fetched = await fetch_ip_data_in_background(db, ips, "background")
+            refreshed = await run_in_session(db, save_refreshed_ip_data, fetched)
+            refresh_queue.observe_refresh(refreshed, len(ips) - refreshed)
+    return refreshed
+
+
+async def refresh_stale_ip_data_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_stale_ip_data()
+        except Exception:
+            logger.exception("Could not refresh stale IP data")
+
+
+@db_operations_wrapper()
+def create_ip_data_job_schema(ip_create: IPDataCreateSchema, db: Session) -> IPDataJobReturnSchema:
+    job = db.scalar(insert(IPDataJobModel).values(ip=normalize_ip(ip_create.ip)).returning(IPDataJobModel))
+    job_schema = IPDataJobReturnSchema.model_validate(job)
+    db.commit()
+    return job_schema
+
+
+@db_operations_wrapper()
+def get_ip_data_job_schema(job_id: UUID, db: Session) -> IPDataJobReturnSchema:
+    job = db.get(IPDataJobModel, str(job_id))
+    if not job:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Job not found")
+    return IPDataJobReturnSchema.model_validate(job)
+
+
+def claim_ip_data_jobs(limit: int, db: Session) -> list[Row]:
+    """
+    Take up to limit available jobs, skipping those claimed by a concurrent transaction. A claimed job becomes
+    available again after job_lease, so that jobs of a worker which died are not lost.
+    Finished jobs older than job_retention are deleted whenever the queue is empty.
+    """
+    available = (
+        select(IPDataJobModel.id)
+        .where(IPDataJobModel.status.in_(("pending", "running")), IPDataJobModel.available_at <= func.now())
+        .order_by(IPDataJobModel.available_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    jobs = db.execute(
+        update(IPDataJobModel)
+        .where(IPDataJobModel.id.in_(available.scalar_subquery()))
+        .values(
+            status="running",
+            attempts=IPDataJobModel.attempts + 1,
+            available_at=func.now() + timedelta(seconds=settings.job_lease),
+        )
+        .returning(IPDataJobModel.id, IPDataJobModel.ip, IPDataJobModel.attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not jobs:
+        db.execute(
+            delete(IPDataJobModel).where(
+                IPDataJobModel.finished_at < func.now() - timedelta(seconds=settings.job_retention)
+            )
+        )
+    db.commit()
+    return jobs
+
+
+def get_existing_job_ips(jobs: list[Row], db: Session) -> set[str]:
+    return get_existing_ips(db, list({job.ip for job in jobs}))
+
+
+def finish_ip_data_jobs(
+    jobs: list[Row], existing: set[str], fetched: dict[str, IPData | IpStackException], db: Session
+) -> None:
+    """
+    Save the fetched IP data and record the result of every job. Jobs which failed transiently
+    are retried after job_retry_delay, until they have been tried job_max_attempts times.
+    """
+    try:
+        created = save_ip_data_batch(
+            db,
+            [ip_data for ip_data in fetched.values() if isinstance(ip_data, IPData)],
+            store_range=settings.range_store_enabled,
+        )
+        existing = existing | skipped_ips(fetched, created)
+        conflict = False
+    except IntegrityError:
+        # A cached location has been deleted by another worker, the jobs are taken again right away and store it again
+        db.rollback()
+        location_cache.clear()
+        conflict = True
+
+    now = datetime.now(timezone.utc)
+    results = []
+    for job in jobs:
+        result = {"id": job.id, "status": "done", "available_at": now, "finished_at": now, "detail": None}
+        if conflict and job.ip not in existing:
+            result["status"], result["status_code"], result["finished_at"] = "pending", None, None
+        elif job.ip in existing:
+            result["status_code"], result["detail"] = HTTPStatus.OK, "IP already exists in the database"
+        elif isinstance(fetched.get(job.ip), IPData):
+            result["status_code"] = HTTPStatus.CREATED
+        else:
+            error = fetched.get(job.ip)
+            exception = get_exception_based_on_status_code(error.code if error else 0)
+            result["status_code"], result["detail"] = exception.status_code, exception.detail
+            if job_should_be_retried(error, job.attempts):
+                result["status"], result["finished_at"] = "pending", None
+                result["available_at"] = now + timedelta(seconds=settings.job_retry_delay)
+            else:
+                result["status"] = "failed"
+        results.append(result)
+    db.execute(update(IPDataJobModel), results)
+    db.commit()
+
+
+def job_should_be_retried(error: IpStackException | None, attempts: int) -> bool:
+    if error is None or attempts >= settings.job_max_attempts:
+        return False
+    return is_transient(error) or error.code in (CIRCUIT_OPEN, BUDGET_EXHAUSTED)
+
+
+async def process_ip_data_jobs() -> int:
+    """
+    Process one batch of jobs, return how many were taken. Upstream is called outside of any database transaction.
+    """
+    claimed = 0
+    async for db in get_db()():
+        jobs = await run_in_session(db, claim_ip_data_jobs, settings.job_batch_size)
+        if jobs:
+            existing = await run_in_session(db, get_existing_job_ips, jobs)
+            missing = list(dict.fromkeys(job.ip for job in jobs if job.ip not in existing))
+            fetched = await fetch_ip_data_in_background(db, missing, "batch")
+            await run_in_session(db, finish_ip_data_jobs, jobs, existing, fetched)
+        claimed = len(jobs)
+    return claimed
+
+
+async def process_ip_data_jobs_continuously(poll_interval: float) -> None:
+    """
+    Job worker: takes batches back to back while there are jobs, polls every poll_interval seconds otherwise.
+    """
+    while True:
+        try:
+            claimed = await process_ip_data_jobs()
+        except Exception:
+            logger.exception("Could not process IP data jobs")
+            claimed = 0
+        if claimed < settings.job_batch_size:
+            await asyncio.sleep(poll_interval)
+
+
+def ensure_ip_not_in_db(db: Session, ip: IPvAnyAddress) -> None:
+    if db.query(exists().where(IPDataModel.ip == str(ip))).scalar():
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="IP already exists in the database")
+
+
+def save_ip_data(db: Session, ip_data: IPData, store_range: bool = False, fetched: bool = True) -> IPDataReturnSchema:
+    """
+    Location and IP data are stored in one transaction, with one statement each.
+    Upstream answers can also be stored as their covering network block (see save_ip_range).
+    Data which was not fetched from upstream (created manually) never expires.
+    """
+    try:
+        location_id, location = store_ip_data(db, ip_data, store_range, fetched)
+    except IntegrityError:
+        # The cached location was deleted by another worker in the meantime (see delete_ip_schema)
+        db.rollback()
+        location_cache.clear()
+        location_id, location = store_ip_data(db, ip_data, store_range, fetched)
+    location_cache.set(location_id, location)
+
+    ip_data_schema = ip_data_entity_to_schema(ip_data, location)
+    ip_data_cache.invalidate(ip_data.ip)
+    ip_lookup_engine.set(ip_data_schema)
+    return ip_data_schema
+
+
+def store_ip_data(
+    db: Session, ip_data: IPData, store_range: bool, fetched: bool
+) -> tuple[str, LocationDataWithSimpleLanguages]:
+    """
+    Store and commit the IP data, return the id and the response of its location. A cached location costs no statement.
+    """
+    location_id, location = get_or_add_locations(db, [ip_data.location])[ip_data.location.geoname_id]
+    insert_ip_data_entity(db, ip_data, location_id, fetched)
+    if store_range:
+        save_ip_range(db, ip_data, location_id)
+    db.commit()
+    return location_id, location
+
+
 def get_ip_data_by_ip(db: Session, ip: IPvAnyAddress) -> IPDataModel | None:
-    return db.query(IPDataModel).filter(IPDataModel.ip == str(ip)).one_or_none()
+    """
+    Location is not loaded, it is taken from the location cache (see get_location).
+    """
+    with stage_duration.time("db_get_ip_data"):
+        return db.query(IPDataModel).filter(IPDataModel.ip == str(ip)).one_or_none()
+
+
+def get_ip_data_row_by_ip(db: Session, ip: IPvAnyAddress) -> Row | None:
+    """
+    Plain row, without the cost of an entity.
+    """
+    with stage_duration.time("db_get_ip_data"):
+        return db.execute(select(*IPDataModel.__table__.columns).where(IPDataModel.ip == str(ip))).one_or_none()
+
+
+def get_ip_range_by_ip(db: Session, ip: IPvAnyAddress) -> IPRangeModel | None:
+    """
+    Longest prefix match: the most specific network block containing the IP.
+    Containment is served by the GiST index on network.
+    """
+    return (
+        db.query(IPRangeModel)
+        .filter(IPRangeModel.network.op(">>=")(literal(str(ip), IPAddressType())))
+        .order_by(func.masklen(IPRangeModel.network).desc())
+        .limit(1)
+        .one_or_none()
+    )
 
 
-def get_location_by_geoname_id(db: Session, geoname_id: int) -> LocationModel | None:
-    return db.query(LocationModel).filter(LocationModel.geoname_id == geoname_id).one_or_none()
+def covering_network(ip: IPvAnyAddress | str) -> str:
+    prefix = settings.range_store_prefix_v4 if ip_network(str(ip)).version == 4 else settings.range_store_prefix_v6
+    return str(ip_network(f"{ip}/{prefix}", strict=False))
 
 
-def get_location_by_id(db, location_id: UUID) -> LocationModel | None:
-    return db.get(LocationModel, location_id)
+def save_ip_range(db: Session, ip_data: IPData, location_id: UUID | str) -> None:
+    """
+    Store ip_data as the data of its covering network block. Blocks which are already known are left as they are.
+    The change is committed together with the rest of the transaction.
+    """
+    db.execute(
+        insert(IPRangeModel)
+        .values(network=covering_network(ip_data.ip), location_id=location_id, **ip_data_attributes(ip_data))
+        .on_conflict_do_nothing(index_elements=[IPRangeModel.network])
+    )
+
+
+def get_existing_ips(db: Session, ips: list[str]) -> set[str]:
+    if not ips:
+        return set()
+
+    ips_array = literal(ips, ARRAY(INET))
+    return set(db.scalars(select(IPDataModel.ip).where(IPDataModel.ip == any_(ips_array))))
+
+
+def get_ip_data_by_network(
+    db: Session, network: IPvAnyNetwork, after: IPvAnyAddress | None, limit: int
+) -> list[IPDataModel]:
+    """
+    Keyset paginated scan of the IPs inside a network. The network is turned into an address range,
+    so the query is served by a range scan of the ip index.
+    """
+    query = db.query(IPDataModel).filter(
+        IPDataModel.ip >= str(network.network_address),
+        IPDataModel.ip <= str(network.broadcast_address),
+    )
+    if after is not None:
+        query = query.filter(IPDataModel.ip > str(after))
+    return query.order_by(IPDataModel.ip).limit(limit).all()
+
+
+def get_ip_data_by_ips(db: Session, ips: list[IPvAnyAddress]) -> dict[str, IPDataModel]:
+    """
+    Resolve many IPs in a single statement, their locations are taken from the location cache.
+    """
+    if not ips:
+        return {}
+
+    ips_array = literal([str(ip) for ip in ips], ARRAY(INET))
+    ip_data_entities = db.query(IPDataModel).filter(IPDataModel.ip == any_(ips_array)).all()
+    return {ip_data.ip: ip_data for ip_data in ip_data_entities}
+
+
+def get_location(db: Session, location_id: UUID | str) -> LocationDataWithSimpleLanguages:
+    """
+    Location of a stored row from the location cache, read from the database and cached on a miss.
+    """
+    location = location_cache.get(location_id)
+    if location is None:
+        with stage_duration.time("db_get_location"):
+            stored = db.get(LocationModel, location_id)
+        location = location_cache.set(location_id, location_entity_to_schema(stored))
+    return location
+
 
+def get_location_json(db: Session, location_id: UUID | str) -> bytes:
+    encoded = location_cache.get_json(location_id)
+    if encoded is None:
+        get_location(db, location_id)
+        encoded = location_cache.get_json(location_id)
+    return encoded
 
-def generate_languages_string(languages: list[LanguagesData]) -> str:
-    return ";".join([f"{lang.code}" for lang in languages])
 
+def load_location_cache(db: Session) -> None:
+    location_cache.load((location.id, location_entity_to_schema(location)) for location in db.query(LocationModel))
 
-def add_location_to_db(db: Session, location: LocationData) -> LocationModel:
-    location_in_db = get_location_by_geoname_id(db, location.geoname_id)
-    if location_in_db:
-        return location_in_db
 
-    else:
-        if len(location.languages) > 0 and isinstance(location.languages[0], LanguagesData):
-            languages = generate_languages_string(location.languages)
+async def load_location_cache_async() -> None:
+    """
+    A location cache which could not be loaded is filled lazily, as locations are read.
+    """
+    try:
+        async for db in get_db()():
+            await run_in_session(db, load_location_cache)
+    except OperationalError:
+        logger.warning("Could not load the location cache, locations are cached as they are read")
+
+
+def get_or_add_locations(
+    db: Session, locations: Iterable[LocationData]
+) -> dict[int, tuple[str, LocationDataWithSimpleLanguages]]:
+    """
+    Ids and responses of the locations by geoname_id. Cached locations cost no statement, all others are inserted
+    unless already stored, in one statement. Nothing is committed: the caller caches the locations
+    with cache_locations once they are committed together with the IP data.
+    """
+    resolved, missing = {}, {}
+    for location in locations:
+        cached = location_cache.get_by_geoname_id(location.geoname_id)
+        if cached is None:
+            missing[location.geoname_id] = location
         else:
-            languages = location.languages
-
-        location = LocationModel(
-            geoname_id=location.geoname_id,
-            capital=location.capital,
-            country_flag=location.country_flag,
-            country_flag_emoji=location.country_flag_emoji,
-            country_flag_emoji_unicode=location.country_flag_emoji_unicode,
-            calling_code=location.calling_code,
-            is_eu=location.is_eu,
-            languages=languages,
+            resolved[location.geoname_id] = cached
+    for stored in add_locations_to_db(db, list(missing.values())):
+        resolved[stored.geoname_id] = (str(stored.id), location_entity_to_schema(stored))
+    return resolved
+
+
+def cache_locations(locations: dict[int, tuple[str, LocationDataWithSimpleLanguages]]) -> None:
+    for location_id, location in locations.values():
+        location_cache.set(location_id, location)
+
+
+def generate_languages_string(languages: list[LanguagesData] | list[str]) -> str:
+    return ";".join([lang.code if isinstance(lang, LanguagesData) else lang for lang in languages])
+
+
+def add_locations_to_db(db: Session, locations: list[LocationData]) -> list[LocationModel]:
+    """
+    Insert the locations whose geoname_id is not stored yet, and return the stored rows in the same statement.
+    Locations which already exist are left as they are: the no-op update only makes RETURNING give back their rows,
+    which ON CONFLICT DO NOTHING would not. Not committed, so they are stored together with the IP data.
+    Rows are locked in geoname_id order, so that concurrent inserts of the same locations do not deadlock.
+    """
+    if not locations:
+        return []
+
+    locations = sorted(locations, key=lambda location: location.geoname_id)
+    statement = insert(LocationModel).values([location_attributes(location) for location in locations])
+    with stage_duration.time("db_add_locations"):
+        return list(
+            db.scalars(
+                statement.on_conflict_do_update(
+                    index_elements=[LocationModel.geoname_id],
+                    set_={"geoname_id": statement.excluded.geoname_id},
+                ).returning(LocationModel)
+            )
         )
-        db.add(location)
-        db.commit()
-        db.refresh(location)
-        return location
 
 
-def create_ip_data_entity(ip_data: IPData, location: LocationModel, db: Session):
-    ip_data_entity = IPDataModel(
-        ip=str(ip_data.ip),
+def location_attributes(location: LocationData) -> dict[str, Any]:
+    return dict(
+        geoname_id=location.geoname_id,
+        capital=location.capital,
+        country_flag=location.country_flag,
+        country_flag_emoji=location.country_flag_emoji,
+        country_flag_emoji_unicode=location.country_flag_emoji_unicode,
+        calling_code=location.calling_code,
+        is_eu=location.is_eu,
+        languages=generate_languages_string(location.languages),
+    )
+
+
+def insert_ip_data_entity(db: Session, ip_data: IPData, location_id: UUID | str, fetched: bool = True) -> None:
+    """
+    A stored IP is detected by the conflict on its unique constraint: the transaction is rolled back and 400 raised.
+    """
+    inserted = db.scalar(
+        insert(IPDataModel)
+        .values(
+            ip=str(ip_data.ip),
+            location_id=location_id,
+            **ip_data_attributes(ip_data),
+            **(freshness_attributes() if fetched else {}),
+        )
+        .on_conflict_do_nothing(index_elements=[IPDataModel.ip])
+        .returning(IPDataModel.id)
+    )
+    if inserted is None:
+        db.rollback()
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="IP already exists in the database")
+
+
+def insert_ip_data_entities(
+    db: Session, ip_data_list: list[IPData], locations: dict[int, tuple[str, LocationDataWithSimpleLanguages]]
+) -> dict[str, IPDataModel]:
+    """
+    Insert many IPs in one statement and return the inserted rows by IP. IPs which are already stored are skipped.
+    """
+    values = [
+        dict(
+            ip=str(ip_data.ip),
+            location_id=locations[ip_data.location.geoname_id][0],
+            **ip_data_attributes(ip_data),
+            **freshness_attributes(),
+        )
+        for ip_data in ip_data_list
+    ]
+    return {
+        normalize_ip(entity.ip): entity
+        for entity in db.scalars(
+            insert(IPDataModel)
+            .values(values)
+            .on_conflict_do_nothing(index_elements=[IPDataModel.ip])
+            .returning(IPDataModel)
+        )
+    }
+
+
+def save_ip_data_batch(db: Session, ip_data_list: list[IPData], store_range: bool = False) -> list[IPDataReturnSchema]:
+    """
+    Store many IP data records together with their locations in one transaction.
+    IPs created meanwhile by someone else are skipped, only the created ones are returned.
+    """
+    if not ip_data_list:
+        return []
+
+    locations = get_or_add_locations(db, [ip_data.location for ip_data in ip_data_list])
+    inserted = insert_ip_data_entities(db, ip_data_list, locations)
+    created = [ip_data for ip_data in ip_data_list if normalize_ip(ip_data.ip) in inserted]
+    if store_range:
+        for ip_data in created:
+            save_ip_range(db, ip_data, locations[ip_data.location.geoname_id][0])
+    ip_data_schemas = [
+        ip_data_entity_to_schema(inserted[normalize_ip(ip_data.ip)], locations[ip_data.location.geoname_id][1])
+        for ip_data in created
+    ]
+    db.commit()
+    cache_locations(locations)
+
+    for ip_data_schema in ip_data_schemas:
+        ip_data_cache.invalidate(ip_data_schema.ip)
+        ip_lookup_engine.set(ip_data_schema)
+    return ip_data_schemas
+
+
+def ip_data_attributes(ip_data: IPData) -> dict[str, Any]:
+    return dict(
         type=ip_data.type,
         continent_code=ip_data.continent_code,
         continent_name=ip_data.continent_name,
@@ -159,16 +1030,18 @@ def create_ip_data_entity(ip_data: IPData, location: LocationModel, db: Session)
         ip_routing_type=ip_data.ip_routing_type,
         connection_type=ip_data.connection_type,
     )
-    ip_data_entity.location_id = location.id
-    db.add(ip_data_entity)
-    db.commit()
-    db.refresh(ip_data_entity)
-    return ip_data_entity
 
 
-def ip_data_entity_to_schema(ip_data_entity: IPDataModel, location: LocationModel) -> IPDataReturnSchema:
+def ip_data_entity_to_schema(
+    ip_data_entity: IPDataModel | IPRangeModel | Row,
+    location: LocationModel | LocationDataWithSimpleLanguages,
+    ip: IPvAnyAddress | str | None = None,
+) -> IPDataReturnSchema:
+    """
+    ip has to be given for network blocks, which have no IP of their own.
+    """
     return IPDataReturnSchema(
-        ip=IPvAnyAddress(ip_data_entity.ip),
+        ip=IPvAnyAddress(ip if ip is not None else ip_data_entity.ip),
         type=ip_data_entity.type,
         continent_code=ip_data_entity.continent_code,
         continent_name=ip_data_entity.continent_name,
@@ -185,19 +1058,25 @@ def ip_data_entity_to_schema(ip_data_entity: IPDataModel, location: LocationMode
         radius=ip_data_entity.radius,
         ip_routing_type=ip_data_entity.ip_routing_type,
         connection_type=ip_data_entity.connection_type,
-        location=LocationDataWithSimpleLanguages(
-            geoname_id=location.geoname_id,
-            capital=location.capital,
-            languages=[location for location in location.languages.split(";")],
-            country_flag=location.country_flag,
-            country_flag_emoji=location.country_flag_emoji,
-            country_flag_emoji_unicode=location.country_flag_emoji_unicode,
-            calling_code=location.calling_code,
-            is_eu=location.is_eu,
+        location=(
+            location if isinstance(location, LocationDataWithSimpleLanguages) else location_entity_to_schema(location)
         ),
     )
 
 
+def location_entity_to_schema(location: LocationModel) -> LocationDataWithSimpleLanguages:
+    return LocationDataWithSimpleLanguages(
+        geoname_id=location.geoname_id,
+        capital=location.capital,
+        languages=[location for location in location.languages.split(";")],
+        country_flag=location.country_flag,
+        country_flag_emoji=location.country_flag_emoji,
+        country_flag_emoji_unicode=location.country_flag_emoji_unicode,
+        calling_code=location.calling_code,
+        is_eu=location.is_eu,
+    )
+
+
 def get_exception_based_on_status_code(code: int) -> HTTPException:
     general_msg = "There is a problem with connection to the external service. Please try again later or try to use POST /ipdata/manual endpoint."
     match code:
@@ -209,9 +1088,29 @@ def get_exception_based_on_status_code(code: int) -> HTTPException:
             return HTTPException(HTTPStatus.BAD_REQUEST, "Invalid IP address or domain")
         case 999:  # No info
             return HTTPException(HTTPStatus.BAD_REQUEST, "This IP address does not have any info.")
+        case 1003:  # Our own lookup budget of the external service is used up
+            return HTTPException(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                "Lookup budget of the external service is used up. Please try again later or try to use POST /ipdata/manual endpoint.",
+            )
         case _:
             return HTTPException(HTTPStatus.BAD_GATEWAY, general_msg)
 
 
-def location_used_by_others(location: LocationModel, db: Session) -> bool:
-    return db.query(IPDataModel).filter(IPDataModel.location_id == location.id).count() > 1
+def delete_location_if_orphaned(location_id: UUID | str, db: Session) -> bool:
+    """
+    Delete the location in one statement unless IP data or a network block still refers to it.
+    A create which refers to it meanwhile makes the delete fail on the foreign key, the location is then kept.
+    """
+    try:
+        with db.begin_nested():
+            deleted = db.execute(
+                delete(LocationModel).where(
+                    LocationModel.id == location_id,
+                    ~exists().where(IPDataModel.location_id == location_id),
+                    ~exists().where(IPRangeModel.location_id == location_id),
+                )
+            ).rowcount
+    except IntegrityError:
+        return False
+    return deleted == 1
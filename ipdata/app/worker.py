@@ -0,0 +1,48 @@
+"""
+Process IP data jobs queued through POST /ipdata/jobs outside of the API workers:
+
+    python -m ipdata.app.worker --workers 4
+"""
+
+import asyncio
+from argparse import ArgumentParser
+
+from ipdata.app.utils import process_ip_data_jobs_continuously
+from ipdata.db import dispose_async_database, dispose_database, init_async_database, init_database
+from ipdata.services.cache.backends import create_cache_backend
+from ipdata.services.cache.ip_data_cache import ip_data_cache
+from ipdata.services.ip_client.providers import dispose_ip_clients
+from ipdata.settings import settings
+
+
+async def run_job_workers(workers: int) -> None:
+    # Created IP data is invalidated in the shared cache, as in the API workers
+    cache_backend = create_cache_backend(settings)
+    if cache_backend is not None:
+        ip_data_cache.connect(cache_backend)
+    if settings.async_mode:
+        init_async_database()
+    else:
+        init_database()
+
+    try:
+        await asyncio.gather(*(process_ip_data_jobs_continuously(settings.job_poll_interval) for _ in range(workers)))
+    finally:
+        await dispose_ip_clients()
+        if settings.async_mode:
+            await dispose_async_database()
+        else:
+            dispose_database()
+        await ip_data_cache.disconnect()
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Process IP data jobs queued through POST /ipdata/jobs")
+    parser.add_argument("--workers", type=int, default=max(1, settings.job_workers))
+    args = parser.parse_args()
+
+    asyncio.run(run_job_workers(args.workers))
+
+
+if __name__ == "__main__":
+    main()
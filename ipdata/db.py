@@ -1,38 +1,205 @@
-from typing import Any, Iterator
+from threading import Lock
+from time import perf_counter
+from typing import Any, AsyncIterator, Callable, TypeVar
 
-from pydantic import SecretStr
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import Engine, MetaData, create_engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
 
-from ipdata.settings import settings
+from ipdata.settings import Settings, settings
 
 Base = declarative_base()
 Meta = MetaData()
 
+T = TypeVar("T")
 
-def get_session(database_dsn: SecretStr) -> Any:
-    session_constructor = get_session_constructor(database_dsn)
-    session = session_constructor()
-    return session
+_engine: Engine | None = None
+_session_constructor: sessionmaker | None = None
+_async_engine: AsyncEngine | None = None
+_async_session_constructor: async_sessionmaker | None = None
 
 
-def get_session_constructor(database_dsn: SecretStr) -> Any:
-    engine = prepare_database(database_dsn)
-    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class PoolMetrics:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.reset()
 
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
 
-def prepare_database(database_dsn: SecretStr) -> Any:
+    def observe_checkout(self, wait: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+    def observe_timeout(self, wait: float) -> None:
+        with self._lock:
+            self.checkout_timeouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedPoolMixin:
+    """
+    Pool mixin which measures how long callers wait for a connection to be checked out.
+    """
+
+    def connect(self):
+        start = perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_metrics.observe_timeout(perf_counter() - start)
+            raise
+        pool_metrics.observe_checkout(perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool): ...
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool): ...
+
+
+def prepare_database(config: Settings) -> Engine:
     return create_engine(
-        database_dsn.get_secret_value(),
+        config.database_dsn.get_secret_value(),
+        poolclass=InstrumentedQueuePool,
+        pool_size=config.database_pool_size,
+        max_overflow=config.database_pool_max_overflow,
+        pool_timeout=config.database_pool_timeout,
+        pool_recycle=config.database_pool_recycle,
+        pool_pre_ping=config.database_pool_pre_ping,
+    )
+
+
+def prepare_async_database(config: Settings) -> AsyncEngine:
+    database_url = make_url(config.database_dsn.get_secret_value()).set(drivername="postgresql+asyncpg")
+    return create_async_engine(
+        database_url,
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        pool_size=config.database_pool_size,
+        max_overflow=config.database_pool_max_overflow,
+        pool_timeout=config.database_pool_timeout,
+        pool_recycle=config.database_pool_recycle,
+        pool_pre_ping=config.database_pool_pre_ping,
     )
 
 
+def init_database(config: Settings = settings) -> Engine:
+    global _engine, _session_constructor
+
+    if _engine is None:
+        _engine = prepare_database(config)
+        _session_constructor = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+    return _engine
+
+
+def dispose_database() -> None:
+    global _engine, _session_constructor
+
+    if _engine is not None:
+        _engine.dispose()
+    _engine = None
+    _session_constructor = None
+
+
+def init_async_database(config: Settings = settings) -> AsyncEngine:
+    global _async_engine, _async_session_constructor
+
+    if _async_engine is None:
+        _async_engine = prepare_async_database(config)
+        _async_session_constructor = async_sessionmaker(
+            autocommit=False, autoflush=False, expire_on_commit=False, bind=_async_engine
+        )
+    return _async_engine
+
+
+async def dispose_async_database() -> None:
+    global _async_engine, _async_session_constructor
+
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session_constructor = None
+
+
+def get_engine() -> Engine | AsyncEngine | None:
+    return _async_engine if _async_engine is not None else _engine
+
+
+def get_session_constructor() -> sessionmaker:
+    if _session_constructor is None:
+        init_database()
+    return _session_constructor
+
+
+def get_session() -> Session:
+    return get_session_constructor()()
+
+
+def get_async_session_constructor() -> async_sessionmaker:
+    if _async_session_constructor is None:
+        init_async_database()
+    return _async_session_constructor
+
+
+async def run_in_session(db: Session | AsyncSession, func: Callable[..., T], *args: Any) -> T:
+    """
+    Run `func(*args, db)` written against a synchronous session without blocking the event loop.
+    Synchronous sessions are used in a worker thread, asynchronous ones through `AsyncSession.run_sync`.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(lambda session: func(*args, session))
+    return await run_in_threadpool(func, *args, db)
+
+
+def get_pool_stats() -> dict[str, Any]:
+    stats = pool_metrics.snapshot()
+    engine = get_engine()
+    if engine is not None:
+        pool = engine.pool
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    return stats
+
+
 def get_db():
-    def inner() -> Iterator[Session]:
-        db = get_session(settings.database_dsn)
+    async def inner() -> AsyncIterator[Session | AsyncSession]:
+        if settings.async_mode:
+            async with get_async_session_constructor()() as db:
+                yield db
+            return
+
+        db = get_session()
         try:
             yield db
         finally:
-            db.close()
+            await run_in_threadpool(db.close)
 
     return inner
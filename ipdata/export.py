@@ -0,0 +1,10 @@
+"""
+Entry point of the bulk export, see ipdata.services.bulk_export.exporter:
+
+    python -m ipdata.export dump.jsonl.gz
+"""
+
+from ipdata.services.bulk_export.exporter import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+Entry point of the bulk import, see ipdata.services.bulk_import.importer:
+
+    python -m ipdata.import dump.jsonl
+"""
+
+from ipdata.services.bulk_import.importer import main
+
+if __name__ == "__main__":
+    main()
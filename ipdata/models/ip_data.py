@@ -5,21 +5,45 @@ from sqlalchemy import (
     FLOAT,
     INTEGER,
     Column,
+    DateTime,
     ForeignKey,
+    Index,
     String,
     UniqueConstraint,
 )
-from sqlalchemy.types import UUID
+from sqlalchemy.dialects.postgresql import CIDR, INET
+from sqlalchemy.orm import relationship
+from sqlalchemy.types import UUID, TypeDecorator
 
 from ipdata.db import Base
 
 
-class IPDataModel(Base):
-    __tablename__ = "ipdata"
-    __table_args__ = (UniqueConstraint("ip"),)
+class IPAddressType(TypeDecorator):
+    """
+    PostgreSQL INET column which reads and writes addresses in their canonical text form, regardless of the driver
+    (psycopg2 returns strings, asyncpg returns ipaddress objects).
+    """
 
-    id = Column(UUID, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
-    ip = Column(String, index=True, nullable=False)
+    impl = INET
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else str(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else str(value)
+
+
+class IPNetworkType(IPAddressType):
+    """
+    PostgreSQL CIDR column, see IPAddressType.
+    """
+
+    impl = CIDR
+    cache_ok = True
+
+
+class IPDataAttributesMixin:
     type = Column(String)
     continent_code = Column(String)
     continent_name = Column(String)
@@ -37,9 +61,44 @@ class IPDataModel(Base):
     ip_routing_type = Column(String)
     connection_type = Column(String)
 
+
+class IPDataModel(IPDataAttributesMixin, Base):
+    __tablename__ = "ipdata"
+    __table_args__ = (UniqueConstraint("ip"),)
+
+    id = Column(UUID, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    ip = Column(IPAddressType, index=True, nullable=False)
+    # Both are empty for data created manually, which is never refreshed
+    fetched_at = Column(DateTime(timezone=True))
+    expires_at = Column(DateTime(timezone=True), index=True)
+
     # Foreign keys
     location_id = Column(UUID, ForeignKey("location.id"))
 
+    # Relationships, locations are read through the location cache instead of being joined
+    location = relationship("LocationModel")
+
+
+class IPRangeModel(IPDataAttributesMixin, Base):
+    """
+    Geolocation data of a whole network block, used for IPs without their own ipdata row.
+    """
+
+    __tablename__ = "ipdata_range"
+    __table_args__ = (
+        UniqueConstraint("network"),
+        Index("ix_ipdata_range_network", "network", postgresql_using="gist", postgresql_ops={"network": "inet_ops"}),
+    )
+
+    id = Column(UUID, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    network = Column(IPNetworkType, nullable=False)
+
+    # Foreign keys
+    location_id = Column(UUID, ForeignKey("location.id"))
+
+    # Relationships, locations are read through the location cache instead of being joined
+    location = relationship("LocationModel")
+
 
 class LocationModel(Base):
     __tablename__ = "location"
@@ -0,0 +1,28 @@
+import uuid
+
+from sqlalchemy import INTEGER, Column, DateTime, Index, String, func
+from sqlalchemy.types import UUID
+
+from ipdata.db import Base
+from ipdata.models.ip_data import IPAddressType
+
+
+class IPDataJobModel(Base):
+    """
+    Create of IP data requested through POST /ipdata/jobs, processed in the background by job workers.
+    """
+
+    __tablename__ = "ipdata_job"
+    __table_args__ = (Index("ix_ipdata_job_status_available_at", "status", "available_at"),)
+
+    id = Column(UUID, primary_key=True, default=lambda: str(uuid.uuid4()))
+    ip = Column(IPAddressType, nullable=False)
+    # pending, running, done or failed
+    status = Column(String, nullable=False, default="pending")
+    # Pending jobs are not taken before this time, running jobs are taken again after it (their worker died)
+    available_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    attempts = Column(INTEGER, nullable=False, default=0)
+    status_code = Column(INTEGER)
+    detail = Column(String)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), index=True)
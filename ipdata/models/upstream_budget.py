@@ -0,0 +1,15 @@
+from sqlalchemy import INTEGER, Column, DateTime, String
+
+from ipdata.db import Base
+
+
+class UpstreamBudgetModel(Base):
+    """
+    Lookups made in one budget window of an upstream provider, e.g. "ipstack:month:2026-10", shared by all workers.
+    """
+
+    __tablename__ = "ipdata_upstream_budget"
+
+    key = Column(String, primary_key=True)
+    used = Column(INTEGER, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
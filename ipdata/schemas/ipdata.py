@@ -1,8 +1,13 @@
-from pydantic import BaseModel, Field, IPvAnyAddress
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+from pydantic import BaseModel, Field, IPvAnyAddress, field_validator
 from pydantic.config import ConfigDict
 
 from ipdata.services.ip_client.base_ip_client import IPData
 from ipdata.services.ip_client.data import LocationData
+from ipdata.settings import settings
 
 
 class IPDataCreateSchema(BaseModel):
@@ -25,3 +30,52 @@ class IPDataReturnSchema(IPDataSchema):
     model_config = ConfigDict(
         from_attributes=True,
     )
+
+
+class IPDataBatchRequestSchema(BaseModel):
+    ips: list[IPvAnyAddress] = Field(min_length=1, examples=[["172.68.213.129", "2001:db8::1"]])
+
+    @field_validator("ips", mode="before")
+    @classmethod
+    def limit_batch_size(cls, ips: Any) -> Any:
+        # Checked before the addresses are parsed, duplicates count too
+        if isinstance(ips, list) and len(ips) > settings.batch_max_size:
+            raise ValueError(f"Batch can contain at most {settings.batch_max_size} IP addresses")
+        return ips
+
+
+class IPDataBatchReturnSchema(BaseModel):
+    results: list[IPDataReturnSchema]
+    not_found: list[str]
+
+
+class IPDataBatchErrorSchema(BaseModel):
+    ip: str
+    status_code: int
+    detail: str
+
+
+class IPDataBatchEnrichReturnSchema(BaseModel):
+    created: list[IPDataReturnSchema]
+    existing: list[str]
+    errors: list[IPDataBatchErrorSchema]
+
+
+class IPDataRangeReturnSchema(BaseModel):
+    results: list[IPDataReturnSchema]
+    next_cursor: str | None
+
+
+class IPDataJobReturnSchema(BaseModel):
+    id: UUID
+    ip: str
+    status: str
+    attempts: int
+    status_code: int | None
+    detail: str | None
+    created_at: datetime
+    finished_at: datetime | None
+
+    model_config = ConfigDict(
+        from_attributes=True,
+    )
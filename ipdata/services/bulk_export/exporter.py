@@ -0,0 +1,190 @@
+"""
+Export IP data, all of it or the IPs of a network or a country, in the formats of the bulk import:
+
+    python -m ipdata.export dump.jsonl.gz --network 10.0.0.0/8
+
+Rows are read in IP order through a server-side cursor, so memory use does not depend on the size of the export.
+An interrupted export is continued by passing the last exported IP as `after`.
+"""
+
+import csv
+import io
+import json
+import sys
+import zlib
+from argparse import ArgumentParser
+from logging import INFO, basicConfig, getLogger
+from time import perf_counter
+from typing import Any, AsyncIterator, BinaryIO, Iterator, Literal
+
+import zstandard
+from pydantic import IPvAnyAddress, IPvAnyNetwork
+from sqlalchemy import Engine, Row, Select, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ipdata.db import init_database
+from ipdata.models.ip_data import IPDataModel, LocationModel
+from ipdata.services.bulk_import.importer import IP_DATA_COLUMNS, LOCATION_COLUMNS
+
+logger = getLogger(__name__)
+
+Format = Literal["ndjson", "csv", "columnar"]
+Compression = Literal["none", "gzip", "zstd"]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv", "columnar": "application/x-ndjson"}
+CSV_HEADER = ["ip", *IP_DATA_COLUMNS, *(f"location.{column}" for column in LOCATION_COLUMNS)]
+
+# Rows fetched from the server-side cursor, and encoded, at once
+EXPORT_BATCH_SIZE = 10000
+
+
+def export_query(
+    network: IPvAnyNetwork | None = None,
+    country_code: str | None = None,
+    after: IPvAnyAddress | None = None,
+    limit: int | None = None,
+) -> Select:
+    """
+    Keyset pagination on ip: after is the last IP of the previous export. IPv4 addresses go before IPv6 ones.
+    """
+    query = (
+        select(
+            IPDataModel.ip,
+            *(getattr(IPDataModel, column) for column in IP_DATA_COLUMNS),
+            *(getattr(LocationModel, column).label(f"location_{column}") for column in LOCATION_COLUMNS),
+        )
+        .join(LocationModel, IPDataModel.location_id == LocationModel.id)
+        .order_by(IPDataModel.ip)
+        .limit(limit)
+    )
+    if network is not None:
+        query = query.where(
+            IPDataModel.ip >= str(network.network_address), IPDataModel.ip <= str(network.broadcast_address)
+        )
+    if country_code is not None:
+        query = query.where(IPDataModel.country_code == country_code.upper())
+    if after is not None:
+        query = query.where(IPDataModel.ip > str(after))
+    return query
+
+
+def row_to_dict(row: Row) -> dict[str, Any]:
+    """
+    The record as GET /ipdata/{ip} returns it, which is also the record format of the bulk import.
+    """
+    record = {"ip": row.ip, **{column: getattr(row, column) for column in IP_DATA_COLUMNS}}
+    record["location"] = {column: getattr(row, f"location_{column}") for column in LOCATION_COLUMNS}
+    languages = record["location"]["languages"]
+    record["location"]["languages"] = languages.split(";") if languages else []
+    return record
+
+
+class ExportWriter:
+    """
+    Turns batches of rows into the bytes of the export, compressed as a single stream.
+    `columnar` writes one JSON line per batch with a list of values per column and the resume cursor.
+    """
+
+    def __init__(self, fmt: Format = "ndjson", compression: Compression = "none", header: bool = True) -> None:
+        self._fmt = fmt
+        self._header = header
+        match compression:
+            case "gzip":
+                self._compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+            case "zstd":
+                self._compressor = zstandard.ZstdCompressor().compressobj()
+            case _:
+                self._compressor = None
+        self.rows = 0
+        self.last_ip: str | None = None
+
+    def start(self) -> bytes:
+        return self._compress(self._csv([CSV_HEADER]) if self._fmt == "csv" and self._header else b"")
+
+    def write(self, rows: list[Row]) -> bytes:
+        if not rows:
+            return b""
+        self.rows += len(rows)
+        self.last_ip = rows[-1].ip
+        match self._fmt:
+            case "csv":
+                return self._compress(self._csv(tuple(row) for row in rows))
+            case "columnar":
+                columns = {name: [getattr(row, name) for row in rows] for name in ["ip", *IP_DATA_COLUMNS]}
+                for column in LOCATION_COLUMNS:
+                    columns[f"location.{column}"] = [getattr(row, f"location_{column}") for row in rows]
+                chunk = {"rows": len(rows), "columns": columns, "next_cursor": self.last_ip}
+                return self._compress(json.dumps(chunk).encode() + b"\n")
+            case _:
+                return self._compress(b"".join(json.dumps(row_to_dict(row)).encode() + b"\n" for row in rows))
+
+    def finish(self) -> bytes:
+        return self._compressor.flush() if self._compressor is not None else b""
+
+    def _csv(self, rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    def _compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) if self._compressor is not None else data
+
+
+def export_chunks(engine: Engine, query: Select, writer: ExportWriter) -> Iterator[bytes]:
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(query)
+        yield writer.start()
+        for rows in result.partitions():
+            yield writer.write(rows)
+        yield writer.finish()
+
+
+async def export_chunks_async(engine: AsyncEngine, query: Select, writer: ExportWriter) -> AsyncIterator[bytes]:
+    async with engine.connect() as connection:
+        result = await connection.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        yield writer.start()
+        async for rows in result.partitions():
+            yield writer.write(rows)
+        yield writer.finish()
+
+
+def export_ip_data(engine: Engine, output: BinaryIO, query: Select, writer: ExportWriter) -> None:
+    started_at = perf_counter()
+    for chunk in export_chunks(engine, query, writer):
+        output.write(chunk)
+        if writer.rows:
+            logger.info(
+                "%s rows, %.0f rows/s, last IP %s",
+                writer.rows,
+                writer.rows / (perf_counter() - started_at),
+                writer.last_ip,
+            )
+
+
+def guess_compression(path: str) -> Compression:
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Export IP data as NDJSON, CSV or columnar chunks")
+    parser.add_argument("path", help="output file, - for standard output")
+    parser.add_argument("--format", choices=["ndjson", "csv", "columnar"], default="ndjson")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], help="by default guessed from the path")
+    parser.add_argument("--network", type=IPvAnyNetwork, help="export only IPs of this network, e.g. 10.0.0.0/8")
+    parser.add_argument("--country", help="export only IPs of this country code, e.g. CZ")
+    parser.add_argument("--after", type=IPvAnyAddress, help="continue an export after this IP")
+    args = parser.parse_args()
+
+    basicConfig(level=INFO, format="%(asctime)s %(message)s", stream=sys.stderr)
+    query = export_query(args.network, args.country, args.after)
+    writer = ExportWriter(args.format, args.compression or guess_compression(args.path), header=args.after is None)
+    if args.path == "-":
+        export_ip_data(init_database(), sys.stdout.buffer, query, writer)
+        return
+    # An export continued after an IP is appended, gzip and zstd allow concatenated streams
+    with open(args.path, "ab" if args.after else "wb") as output:
+        export_ip_data(init_database(), output, query, writer)
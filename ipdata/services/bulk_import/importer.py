@@ -0,0 +1,340 @@
+"""
+Import IP data from JSONL or CSV dumps in the shape of POST /ipdata/manual requests:
+
+    python -m ipdata.import dump.jsonl
+
+CSV files have a header with the IP data fields and the location fields prefixed with "location.",
+languages separated by ";", one record per line unless a quoted value spans lines. Records are validated
+in chunks and every chunk is loaded with COPY into temporary staging tables and merged into location and ipdata
+in one transaction.
+The position in the file is saved after each chunk, so an interrupted import continues where it stopped.
+"""
+
+import csv
+import io
+import json
+import os
+from argparse import ArgumentParser
+from logging import INFO, basicConfig, getLogger
+from time import perf_counter
+from typing import Any, Callable, Iterator, Literal
+
+from pydantic import ValidationError
+from sqlalchemy import Column, Connection, Engine, text
+
+from ipdata.db import init_database
+from ipdata.models.ip_data import IPDataAttributesMixin, IPDataModel, LocationModel
+from ipdata.schemas.ipdata import IPDataCreateManuallySchema
+
+logger = getLogger(__name__)
+
+Format = Literal["jsonl", "csv"]
+
+IP_DATA_COLUMNS = [name for name, value in vars(IPDataAttributesMixin).items() if isinstance(value, Column)]
+LOCATION_COLUMNS = [
+    "geoname_id",
+    "capital",
+    "country_flag",
+    "country_flag_emoji",
+    "country_flag_emoji_unicode",
+    "calling_code",
+    "is_eu",
+    "languages",
+]
+
+# Invalid records are counted, but only the first ones are logged
+MAX_LOGGED_ERRORS = 20
+
+
+class ImportProgress:
+    def __init__(self, offset: int = 0, rows: int = 0, imported: int = 0, existing: int = 0, invalid: int = 0):
+        self.offset = offset
+        self.rows = rows
+        self.imported = imported
+        self.existing = existing
+        self.invalid = invalid
+        self.started_at = perf_counter()
+        self.rows_at_start = rows
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = perf_counter() - self.started_at
+        return (self.rows - self.rows_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict[str, int]:
+        return {
+            "offset": self.offset,
+            "rows": self.rows,
+            "imported": self.imported,
+            "existing": self.existing,
+            "invalid": self.invalid,
+        }
+
+
+class IPDataImporter:
+    """
+    Locations are interned by geoname_id: each one is sent to the database once per run, however many IPs use it.
+    With `update` IPs which are already stored are overwritten, otherwise they are left as they are.
+    """
+
+    def __init__(self, connection: Connection, update: bool = False) -> None:
+        self._connection = connection
+        self._update = update
+        self._geoname_ids: set[int] = set()
+        self._create_staging_tables()
+
+    def load(self, records: list[IPDataCreateManuallySchema]) -> tuple[int, int]:
+        """
+        Load one chunk in one transaction, return how many IPs were imported and how many were already stored.
+        """
+        # The same IP twice in one INSERT ... ON CONFLICT DO UPDATE is an error, the last record wins.
+        # Validated addresses are already in canonical form.
+        ip_data = {str(record.ip): record for record in records}
+        locations = {}
+        for record in ip_data.values():
+            if record.location.geoname_id not in self._geoname_ids:
+                locations[record.location.geoname_id] = record.location
+
+        with self._connection.begin():
+            cursor = self._connection.connection.cursor()
+            copy_rows(cursor, "ipdata_import_location", LOCATION_COLUMNS, map(location_row, locations.values()))
+            copy_rows(
+                cursor,
+                "ipdata_import_ipdata",
+                ["ip", *IP_DATA_COLUMNS, "geoname_id"],
+                map(ip_data_row, ip_data.values()),
+            )
+            cursor.execute(MERGE_LOCATIONS)
+            cursor.execute(merge_ip_data(self._update))
+            imported = cursor.rowcount
+        self._geoname_ids.update(locations)
+        return imported, len(ip_data) - imported
+
+    def _create_staging_tables(self) -> None:
+        location = LocationModel.__table__.columns
+        ip_data = IPDataModel.__table__.columns
+        with self._connection.begin():
+            for table, columns in [
+                ("ipdata_import_location", [location[column] for column in LOCATION_COLUMNS]),
+                (
+                    "ipdata_import_ipdata",
+                    [ip_data.ip, *(ip_data[column] for column in IP_DATA_COLUMNS), location.geoname_id],
+                ),
+            ]:
+                definitions = ", ".join(
+                    f"{column.name} {column.type.compile(self._connection.dialect)}" for column in columns
+                )
+                self._connection.execute(
+                    text(f"CREATE TEMPORARY TABLE IF NOT EXISTS {table} ({definitions}) ON COMMIT DELETE ROWS")
+                )
+
+
+def copy_rows(cursor, table: str, columns: list[str], rows: Iterator[list[Any]]) -> None:
+    """
+    Stream rows through COPY in CSV format: None is sent as NULL, everything else quoted, so empty strings stay.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_NOTNULL).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def location_row(location) -> list[Any]:
+    languages = ";".join(language if isinstance(language, str) else language.code for language in location.languages)
+    return [*(getattr(location, column) for column in LOCATION_COLUMNS[:-1]), languages]
+
+
+def ip_data_row(record: IPDataCreateManuallySchema) -> list[Any]:
+    return [str(record.ip), *(getattr(record, column) for column in IP_DATA_COLUMNS), record.location.geoname_id]
+
+
+MERGE_LOCATIONS = f"""
+    INSERT INTO location (id, {', '.join(LOCATION_COLUMNS)})
+    SELECT gen_random_uuid(), {', '.join(LOCATION_COLUMNS)} FROM ipdata_import_location
+    ON CONFLICT (geoname_id) DO NOTHING
+"""
+
+
+def merge_ip_data(update: bool) -> str:
+    """
+    Overwritten IPs become manually created data, which is never refreshed.
+    """
+    overwrite = ", ".join(f"{column} = excluded.{column}" for column in ["location_id", *IP_DATA_COLUMNS])
+    return f"""
+        INSERT INTO ipdata (id, ip, location_id, {', '.join(IP_DATA_COLUMNS)})
+        SELECT gen_random_uuid(), s.ip, l.id, {', '.join(f's.{column}' for column in IP_DATA_COLUMNS)}
+        FROM ipdata_import_ipdata s JOIN location l ON l.geoname_id = s.geoname_id
+        ON CONFLICT (ip) DO {f"UPDATE SET {overwrite}, fetched_at = NULL, expires_at = NULL" if update else "NOTHING"}
+    """
+
+
+def read_records(path: str, fmt: Format, offset: int = 0) -> Iterator[tuple[bytes, int]]:
+    """
+    Yield (raw record, offset after it) of every non-empty record from offset on. Records are decoded and parsed
+    in validate, so that a broken one is counted as invalid instead of stopping the import.
+    A CSV record goes on over the next line while a quoted field is open, quoted values may contain line breaks.
+    """
+    with open(path, "rb") as file:
+        if fmt == "csv":
+            file.readline()
+        position = offset if offset else file.tell()
+        file.seek(position)
+        record = b""
+        for line in file:
+            position += len(line)
+            record += line
+            # Quotes inside quoted fields are doubled, an odd count leaves the last field open
+            if fmt == "csv" and record.count(b'"') % 2:
+                continue
+            if record.strip():
+                yield record, position
+            record = b""
+        if record.strip():
+            yield record, position
+
+
+def read_header(path: str, fmt: Format) -> list[str] | None:
+    if fmt != "csv":
+        return None
+    with open(path, "rb") as file:
+        return next(csv.reader([file.readline().decode()]))
+
+
+def csv_record(header: list[str], values: list[str]) -> dict[str, Any]:
+    record: dict[str, Any] = {"location": {}}
+    for name, value in zip(header, values):
+        value = None if value == "" else value
+        if name.startswith("location."):
+            record["location"][name.removeprefix("location.")] = value
+        else:
+            record[name] = value
+    languages = record["location"].get("languages")
+    record["location"]["languages"] = languages.split(";") if languages else []
+    return record
+
+
+def validate(record: bytes, header: list[str] | None) -> IPDataCreateManuallySchema:
+    """
+    JSONL records are parsed and validated by pydantic in one go.
+    """
+    if header is None:
+        return IPDataCreateManuallySchema.model_validate_json(record)
+    values = next(csv.reader(io.StringIO(record.decode(), newline=""), strict=True))
+    return IPDataCreateManuallySchema.model_validate(csv_record(header, values))
+
+
+def import_file(
+    engine: Engine,
+    path: str,
+    fmt: Format | None = None,
+    chunk_size: int = 10000,
+    update: bool = False,
+    state_path: str | None = None,
+    on_progress: Callable[[ImportProgress], None] | None = None,
+) -> ImportProgress:
+    """
+    Import the file, continuing from the position saved in state_path if there is one. Chunks are merged
+    with ON CONFLICT, so a chunk loaded again after a crash right before its position was saved changes nothing.
+    """
+    fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+    progress = ImportProgress(**load_state(state_path))
+
+    header = read_header(path, fmt)
+
+    with engine.connect() as connection:
+        importer = IPDataImporter(connection, update=update)
+        records: list[IPDataCreateManuallySchema] = []
+        rows = invalid = 0
+        for record, position in read_records(path, fmt, progress.offset):
+            rows += 1
+            try:
+                records.append(validate(record, header))
+            except (ValidationError, ValueError, csv.Error) as e:
+                invalid += 1
+                if progress.invalid + invalid <= MAX_LOGGED_ERRORS:
+                    logger.warning("Invalid record ending at byte %s: %s", position, e)
+            if rows == chunk_size:
+                flush_chunk(importer, records, progress, rows, invalid, position, state_path, on_progress)
+                records, rows, invalid = [], 0, 0
+        if rows:
+            flush_chunk(importer, records, progress, rows, invalid, position, state_path, on_progress)
+    return progress
+
+
+def flush_chunk(
+    importer: IPDataImporter,
+    records: list[IPDataCreateManuallySchema],
+    progress: ImportProgress,
+    rows: int,
+    invalid: int,
+    position: int,
+    state_path: str | None,
+    on_progress: Callable[[ImportProgress], None] | None,
+) -> None:
+    imported, existing = importer.load(records) if records else (0, 0)
+    progress.offset = position
+    progress.rows += rows
+    progress.invalid += invalid
+    progress.imported += imported
+    progress.existing += existing
+    save_state(state_path, progress)
+    if on_progress is not None:
+        on_progress(progress)
+
+
+def load_state(state_path: str | None) -> dict[str, int]:
+    if state_path is None or not os.path.exists(state_path):
+        return {}
+    with open(state_path) as file:
+        return json.load(file)
+
+
+def save_state(state_path: str | None, progress: ImportProgress) -> None:
+    if state_path is None:
+        return
+    # Written aside and renamed, so that a crash never leaves a truncated state
+    with open(f"{state_path}.tmp", "w") as file:
+        json.dump(progress.to_dict(), file)
+    os.replace(f"{state_path}.tmp", state_path)
+
+
+def log_progress(size: int) -> Callable[[ImportProgress], None]:
+    def on_progress(progress: ImportProgress) -> None:
+        logger.info(
+            "%.1f%% read, %s rows: %s imported, %s already stored, %s invalid, %.0f rows/s",
+            100 * progress.offset / size if size else 100.0,
+            progress.rows,
+            progress.imported,
+            progress.existing,
+            progress.invalid,
+            progress.rows_per_second,
+        )
+
+    return on_progress
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Import IP data from a JSONL or CSV dump")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="by default guessed from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--update", action="store_true", help="overwrite IPs which are already stored")
+    parser.add_argument("--state", help="where to save the position in the file, default: <path>.import-state")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved position and start from the top")
+    args = parser.parse_args()
+
+    basicConfig(level=INFO, format="%(asctime)s %(message)s")
+    state_path = args.state or f"{args.path}.import-state"
+    if args.restart and os.path.exists(state_path):
+        os.remove(state_path)
+
+    progress = import_file(
+        init_database(),
+        args.path,
+        fmt=args.format,
+        chunk_size=args.chunk_size,
+        update=args.update,
+        state_path=state_path,
+        on_progress=log_progress(os.path.getsize(args.path)),
+    )
+    logger.info("Done: %s", progress.to_dict())
@@ -0,0 +1,102 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+from typing import Callable
+
+from ipdata.settings import Settings
+
+
+class CacheBackendError(Exception):
+    pass
+
+
+class BaseCacheBackend(ABC):
+    """
+    Cache shared between workers. Values are raw bytes, invalidations are broadcast over channels.
+    The async methods are used on the event loop, backends doing network I/O must not block in them.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None: ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def publish(self, channel: str, message: str) -> None: ...
+
+    @abstractmethod
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None: ...
+
+    def close(self) -> None: ...
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return [self.get(key) for key in keys]
+
+    async def get_many_async(self, keys: list[str]) -> list[bytes | None]:
+        return self.get_many(keys)
+
+    async def set_async(self, key: str, value: bytes, ttl: float) -> None:
+        self.set(key, value, ttl)
+
+    async def delete_async(self, key: str) -> None:
+        self.delete(key)
+
+    async def publish_async(self, channel: str, message: str) -> None:
+        self.publish(channel, message)
+
+    async def aclose(self) -> None:
+        self.close()
+
+
+class InMemoryCacheBackend(BaseCacheBackend):
+    """
+    Process local stand-in for a shared cache, used in tests and single worker deployments.
+    """
+
+    def __init__(self, clock: Callable[[], float] = monotonic) -> None:
+        self._clock = clock
+        self._values: dict[str, tuple[float, bytes]] = {}
+        self._subscribers: dict[str, list[Callable[[str], None]]] = defaultdict(list)
+        self._lock = Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._values[key]
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._values[key] = (self._clock() + ttl, value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def publish(self, channel: str, message: str) -> None:
+        for callback in list(self._subscribers[channel]):
+            callback(message)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        self._subscribers[channel].append(callback)
+
+
+def create_cache_backend(config: Settings) -> BaseCacheBackend | None:
+    match config.cache_backend:
+        case "memory":
+            return InMemoryCacheBackend()
+        case "redis":
+            from ipdata.services.cache.redis_backend import RedisCacheBackend
+
+            return RedisCacheBackend(config.cache_redis_url.get_secret_value())
+        case _:
+            return None
@@ -0,0 +1,287 @@
+import asyncio
+from ipaddress import ip_address
+from logging import getLogger
+from typing import Any, Callable, Coroutine, Iterable
+
+from pydantic import IPvAnyAddress, ValidationError
+
+from ipdata.schemas.ipdata import IPDataReturnSchema
+from ipdata.services.cache.backends import BaseCacheBackend, CacheBackendError
+from ipdata.services.cache.lru_cache import LRUTTLCache
+from ipdata.services.serialization.ip_data_json import encode_ip_data_schema
+from ipdata.settings import Settings, settings
+
+# Cached in place of a response for IPs which are not in the database
+NOT_FOUND = object()
+# Representation of NOT_FOUND in the shared cache
+NOT_FOUND_BYTES = b""
+
+
+def normalize_ip(ip: IPvAnyAddress | str) -> str:
+    return str(ip_address(str(ip)))
+
+
+def running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class IPDataCache:
+    """
+    Read-through cache of ready to serialize GET /ipdata/{ip} responses, keyed by normalized IP.
+    Responses are kept as models or, when cached by the fast path, already encoded to JSON (see get_json).
+    The in-process LRU cache can be backed by a shared cache which also broadcasts invalidations,
+    so that all workers drop stale entries.
+
+    Code running on the event loop (async mode, through AsyncSession.run_sync) must not wait for the shared cache:
+    there it is read ahead with prefetch, and written to by background tasks.
+    """
+
+    def __init__(self, config: Settings, backend: BaseCacheBackend | None = None) -> None:
+        self._enabled = config.cache_enabled
+        self._ttl = config.cache_ttl
+        self._negative_ttl = config.cache_negative_ttl
+        self._key_prefix = config.cache_key_prefix
+        self._channel = f"{config.cache_key_prefix}invalidate"
+        self._cache: LRUTTLCache[IPDataReturnSchema | bytes | object] = LRUTTLCache(
+            config.cache_max_entries, config.cache_ttl
+        )
+        self._backend: BaseCacheBackend | None = None
+        self._on_invalidate: Callable[[str], None] | None = None
+        self._writes: set[asyncio.Task] = set()
+        self._logger = getLogger(__name__)
+        self.negative_hits = 0
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        if backend is not None:
+            self.connect(backend)
+
+    def connect(self, backend: BaseCacheBackend, on_invalidate: Callable[[str], None] | None = None) -> None:
+        """
+        on_invalidate is called with every IP invalidated by any worker, for other in-process copies of the data.
+        """
+        self._backend = backend
+        self._on_invalidate = on_invalidate
+        try:
+            backend.subscribe(self._channel, self._invalidated)
+        except CacheBackendError as e:
+            self._on_backend_error(e)
+
+    async def disconnect(self) -> None:
+        for write in list(self._writes):
+            write.cancel()
+        if self._backend is not None:
+            await self._backend.aclose()
+        self._backend = None
+        self._on_invalidate = None
+
+    async def prefetch(self, ips: Iterable[IPvAnyAddress | str]) -> None:
+        """
+        Copy the entries of the IPs which are not cached in process from the shared cache, with one non-blocking
+        read, before they are looked up on the event loop.
+        """
+        if not self._enabled or self._backend is None:
+            return
+        keys = [key for key in dict.fromkeys(map(normalize_ip, ips)) if key not in self._cache]
+        if not keys:
+            return
+        try:
+            values = await self._backend.get_many_async([self._key_prefix + key for key in keys])
+        except CacheBackendError as e:
+            self._on_backend_error(e)
+            return
+        for key, raw in zip(keys, values):
+            self._load_shared(key, raw)
+
+    def get(self, ip: IPvAnyAddress | str) -> IPDataReturnSchema | object | None:
+        value = self._get(ip)
+        return IPDataReturnSchema.model_validate_json(value) if isinstance(value, bytes) else value
+
+    def get_many(self, ips: list[str]) -> dict[str, IPDataReturnSchema | object | None]:
+        """
+        Look up many normalized IPs without changing the cache, so that large batches do not evict hot entries:
+        hits are not promoted and entries of the shared cache are not copied in process.
+        IPs which are not cached in process are read from the shared cache at once.
+        """
+        values, missing = self._peek_many(ips)
+        # On the event loop only get_many_async may read the shared cache
+        if missing and self._backend is not None and running_loop() is None:
+            try:
+                raw_values = self._backend.get_many([self._key_prefix + key for key in missing])
+            except CacheBackendError as e:
+                self._on_backend_error(e)
+            else:
+                values.update(zip(missing, map(self._decode_shared, raw_values)))
+        return self._responses(values)
+
+    async def get_many_async(self, ips: list[str]) -> dict[str, IPDataReturnSchema | object | None]:
+        values, missing = self._peek_many(ips)
+        if missing and self._backend is not None:
+            try:
+                raw_values = await self._backend.get_many_async([self._key_prefix + key for key in missing])
+            except CacheBackendError as e:
+                self._on_backend_error(e)
+            else:
+                values.update(zip(missing, map(self._decode_shared, raw_values)))
+        return self._responses(values)
+
+    def get_json(self, ip: IPvAnyAddress | str) -> bytes | object | None:
+        """
+        Return the response encoded to JSON, NOT_FOUND or None.
+        """
+        value = self._get(ip)
+        return encode_ip_data_schema(value) if isinstance(value, IPDataReturnSchema) else value
+
+    def set(self, ip: IPvAnyAddress | str, response: IPDataReturnSchema | bytes) -> None:
+        """
+        response is a model or the response already encoded to JSON.
+        """
+        if self._enabled:
+            key = normalize_ip(ip)
+            self._cache.set(key, response)
+            encoded = response if isinstance(response, bytes) else response.model_dump_json().encode()
+            self._set_shared(key, encoded, self._ttl)
+
+    def set_not_found(self, ip: IPvAnyAddress | str) -> None:
+        if self._enabled and self._negative_ttl > 0:
+            key = normalize_ip(ip)
+            self._cache.set(key, NOT_FOUND, ttl=self._negative_ttl)
+            self._set_shared(key, NOT_FOUND_BYTES, self._negative_ttl)
+
+    def invalidate(self, ip: IPvAnyAddress | str) -> None:
+        key = normalize_ip(ip)
+        self._cache.delete(key)
+        if self._backend is None:
+            return
+        loop = running_loop()
+        if loop is not None:
+            self._write_in_background(loop, self._invalidate_shared_async(self._backend, key))
+            return
+        try:
+            self._backend.delete(self._key_prefix + key)
+            self._backend.publish(self._channel, key)
+        except CacheBackendError as e:
+            self._on_backend_error(e)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": self._enabled,
+            "negative_hits": self.negative_hits,
+            **self._cache.stats(),
+            "shared": {
+                "enabled": self._backend is not None,
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "errors": self.shared_errors,
+            },
+        }
+
+    def _invalidated(self, key: str) -> None:
+        self._cache.delete(key)
+        if self._on_invalidate is not None:
+            self._on_invalidate(key)
+
+    def _get(self, ip: IPvAnyAddress | str) -> IPDataReturnSchema | bytes | object | None:
+        if not self._enabled:
+            return None
+
+        key = normalize_ip(ip)
+        value = self._cache.get(key)
+        # On the event loop the shared cache was read ahead by prefetch, a blocking read would stall every request
+        if value is None and self._backend is not None and running_loop() is None:
+            value = self._get_shared(key)
+        if value is NOT_FOUND:
+            self.negative_hits += 1
+        return value
+
+    def _get_shared(self, key: str) -> IPDataReturnSchema | object | None:
+        try:
+            raw = self._backend.get(self._key_prefix + key)
+        except CacheBackendError as e:
+            self._on_backend_error(e)
+            return None
+        return self._load_shared(key, raw)
+
+    def _load_shared(self, key: str, raw: bytes | None) -> IPDataReturnSchema | object | None:
+        """
+        Keep an entry of the shared cache in process.
+        """
+        value = self._decode_shared(raw)
+        if value is NOT_FOUND:
+            self._cache.set(key, value, ttl=self._negative_ttl)
+        elif value is not None:
+            self._cache.set(key, value)
+        return value
+
+    def _decode_shared(self, raw: bytes | None) -> IPDataReturnSchema | object | None:
+        if raw is None:
+            self.shared_misses += 1
+            return None
+
+        if raw == NOT_FOUND_BYTES:
+            value = NOT_FOUND
+        else:
+            try:
+                value = IPDataReturnSchema.model_validate_json(raw)
+            except ValidationError:
+                self.shared_misses += 1
+                return None
+
+        self.shared_hits += 1
+        return value
+
+    def _peek_many(self, ips: list[str]) -> tuple[dict[str, Any], list[str]]:
+        values = {ip: self._cache.peek(ip) if self._enabled else None for ip in ips}
+        missing = [ip for ip, value in values.items() if value is None] if self._enabled else []
+        return values, missing
+
+    def _responses(self, values: dict[str, Any]) -> dict[str, IPDataReturnSchema | object | None]:
+        self.negative_hits += sum(value is NOT_FOUND for value in values.values())
+        return {
+            ip: IPDataReturnSchema.model_validate_json(value) if isinstance(value, bytes) else value
+            for ip, value in values.items()
+        }
+
+    def _set_shared(self, key: str, value: bytes, ttl: float) -> None:
+        if self._backend is None:
+            return
+        loop = running_loop()
+        if loop is not None:
+            self._write_in_background(loop, self._set_shared_async(self._backend, key, value, ttl))
+            return
+        try:
+            self._backend.set(self._key_prefix + key, value, ttl)
+        except CacheBackendError as e:
+            self._on_backend_error(e)
+
+    async def _set_shared_async(self, backend: BaseCacheBackend, key: str, value: bytes, ttl: float) -> None:
+        try:
+            await backend.set_async(self._key_prefix + key, value, ttl)
+        except CacheBackendError as e:
+            self._on_backend_error(e)
+
+    async def _invalidate_shared_async(self, backend: BaseCacheBackend, key: str) -> None:
+        try:
+            await backend.delete_async(self._key_prefix + key)
+            await backend.publish_async(self._channel, key)
+        except CacheBackendError as e:
+            self._on_backend_error(e)
+
+    def _write_in_background(self, loop: asyncio.AbstractEventLoop, write: Coroutine) -> None:
+        # The loop only keeps weak references to tasks
+        task = loop.create_task(write)
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _on_backend_error(self, error: CacheBackendError) -> None:
+        self.shared_errors += 1
+        self._logger.warning(f"Shared cache is unavailable: {error}")
+
+
+ip_data_cache = IPDataCache(settings)
@@ -0,0 +1,100 @@
+from threading import Lock
+from typing import Any, Iterable
+from uuid import UUID
+
+from ipdata.schemas.ipdata import LocationDataWithSimpleLanguages
+from ipdata.services.serialization.ip_data_json import encode_location
+
+
+class LocationCache:
+    """
+    Process-local, thread safe cache of stored locations, by id and by geoname_id.
+    There are only a few thousand locations and they almost never change, so entries neither expire nor are evicted.
+    Every location is converted to its response once, with languages already split, and that object is shared
+    by all responses of the location, and encoded to JSON once for the fast path of GET /ipdata/{ip}.
+    Only committed rows may be cached: an id of a location which was rolled back would break the foreign keys.
+    """
+
+    def __init__(self) -> None:
+        self._by_id: dict[str, LocationDataWithSimpleLanguages] = {}
+        self._ids_by_geoname_id: dict[int, str] = {}
+        self._json_by_id: dict[str, bytes] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, location_id: UUID | str) -> LocationDataWithSimpleLanguages | None:
+        location = self._by_id.get(str(location_id))
+        self._count(location is not None)
+        return location
+
+    def get_json(self, location_id: UUID | str) -> bytes | None:
+        """
+        Return the location encoded to JSON, it is encoded on first use.
+        """
+        location_id = str(location_id)
+        encoded = self._json_by_id.get(location_id)
+        if encoded is not None:
+            self._count(True)
+            return encoded
+
+        location = self.get(location_id)
+        if location is None:
+            return None
+        encoded = self._json_by_id[location_id] = encode_location(location)
+        return encoded
+
+    def get_by_geoname_id(self, geoname_id: int) -> tuple[str, LocationDataWithSimpleLanguages] | None:
+        """
+        Return the id and the location stored with the geoname_id.
+        """
+        location_id = self._ids_by_geoname_id.get(geoname_id)
+        location = self._by_id.get(location_id) if location_id is not None else None
+        self._count(location is not None)
+        return (location_id, location) if location is not None else None
+
+    def set(
+        self, location_id: UUID | str, location: LocationDataWithSimpleLanguages
+    ) -> LocationDataWithSimpleLanguages:
+        """
+        Return the cached location, which is the given one unless the id is already cached.
+        """
+        location_id = str(location_id)
+        with self._lock:
+            location = self._by_id.setdefault(location_id, location)
+            self._ids_by_geoname_id[location.geoname_id] = location_id
+        return location
+
+    def load(self, locations: Iterable[tuple[UUID | str, LocationDataWithSimpleLanguages]]) -> None:
+        """
+        Replace the content of the cache with all stored locations.
+        """
+        by_id = {str(location_id): location for location_id, location in locations}
+        ids_by_geoname_id = {location.geoname_id: location_id for location_id, location in by_id.items()}
+        with self._lock:
+            self._by_id, self._ids_by_geoname_id, self._json_by_id = by_id, ids_by_geoname_id, {}
+
+    def invalidate(self, location_id: UUID | str) -> None:
+        with self._lock:
+            location = self._by_id.pop(str(location_id), None)
+            self._json_by_id.pop(str(location_id), None)
+            if location is not None and self._ids_by_geoname_id.get(location.geoname_id) == str(location_id):
+                del self._ids_by_geoname_id[location.geoname_id]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_id, self._ids_by_geoname_id, self._json_by_id = {}, {}, {}
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict[str, Any]:
+        return {"entries": len(self._by_id), "hits": self.hits, "misses": self.misses}
+
+    def _count(self, hit: bool) -> None:
+        # Counters are approximate, lookups do not take the lock
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+
+location_cache = LocationCache()
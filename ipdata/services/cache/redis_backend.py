@@ -0,0 +1,103 @@
+from logging import getLogger
+from typing import Callable
+
+from redis import Redis, RedisError
+from redis.asyncio import Redis as AsyncRedis
+
+from ipdata.services.cache.backends import BaseCacheBackend, CacheBackendError
+
+
+class RedisCacheBackend(BaseCacheBackend):
+    """
+    Cache backend for Redis and servers speaking its protocol (Valkey, KeyDB, Dragonfly).
+    Worker threads use a blocking client, the event loop an asyncio one.
+    """
+
+    def __init__(self, redis_url: str) -> None:
+        self._client = Redis.from_url(redis_url)
+        self._async_client = AsyncRedis.from_url(redis_url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._listener = None
+        self._logger = getLogger(__name__)
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self._client.get(key)
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        try:
+            return self._client.mget(keys)
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        try:
+            self._client.set(key, value, px=max(int(ttl * 1000), 1))
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    def delete(self, key: str) -> None:
+        try:
+            self._client.delete(key)
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    def publish(self, channel: str, message: str) -> None:
+        try:
+            self._client.publish(channel, message)
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        def handler(message: dict) -> None:
+            callback(message["data"].decode())
+
+        try:
+            self._pubsub.subscribe(**{channel: handler})
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+        if self._listener is None:
+            self._listener = self._pubsub.run_in_thread(
+                sleep_time=1.0, daemon=True, exception_handler=self._handle_listener_error
+            )
+
+    async def get_many_async(self, keys: list[str]) -> list[bytes | None]:
+        try:
+            return await self._async_client.mget(keys)
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    async def set_async(self, key: str, value: bytes, ttl: float) -> None:
+        try:
+            await self._async_client.set(key, value, px=max(int(ttl * 1000), 1))
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    async def delete_async(self, key: str) -> None:
+        try:
+            await self._async_client.delete(key)
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    async def publish_async(self, channel: str, message: str) -> None:
+        try:
+            await self._async_client.publish(channel, message)
+        except RedisError as e:
+            raise CacheBackendError(str(e)) from e
+
+    async def aclose(self) -> None:
+        await self._async_client.aclose()
+        self.close()
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        self._pubsub.close()
+        self._client.close()
+
+    def _handle_listener_error(self, error: Exception, pubsub, thread) -> None:
+        self._logger.error(f"Cache invalidation listener failed: {error}")
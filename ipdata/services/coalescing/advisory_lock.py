@@ -0,0 +1,83 @@
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
+from zlib import crc32
+
+from sqlalchemy import Connection, Engine, func, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+# First key of the two-key advisory lock functions, keeps the locks of this application apart from others
+ADVISORY_LOCK_NAMESPACE = 0x1FDA7A
+# SQLSTATE of a statement cancelled by lock_timeout
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def advisory_lock_key(key: str) -> int:
+    """
+    32-bit signed key for the second argument of pg_advisory_lock. Colliding keys only serialize unrelated callers.
+    """
+    return int.from_bytes(crc32(key.encode()).to_bytes(4, "big"), "big", signed=True)
+
+
+def lock_timeout_setting(timeout: float) -> str:
+    # Zero would disable lock_timeout and wait forever
+    return f"{max(int(timeout * 1000), 1)}ms"
+
+
+def is_lock_timeout(e: DBAPIError) -> bool:
+    return getattr(e.orig, "pgcode", None) == LOCK_NOT_AVAILABLE
+
+
+def lock(connection: Connection, lock_key: int, timeout: float) -> bool:
+    try:
+        # Local to the transaction the connection begins, so it is reset when the connection is returned to the pool
+        connection.execute(select(func.set_config("lock_timeout", lock_timeout_setting(timeout), True)))
+        connection.execute(select(func.pg_advisory_lock(ADVISORY_LOCK_NAMESPACE, lock_key)))
+        return True
+    except DBAPIError as e:
+        if not is_lock_timeout(e):
+            raise
+        return False
+
+
+async def lock_async(connection: AsyncConnection, lock_key: int, timeout: float) -> bool:
+    try:
+        await connection.execute(select(func.set_config("lock_timeout", lock_timeout_setting(timeout), True)))
+        await connection.execute(select(func.pg_advisory_lock(ADVISORY_LOCK_NAMESPACE, lock_key)))
+        return True
+    except DBAPIError as e:
+        if not is_lock_timeout(e):
+            raise
+        return False
+
+
+@contextmanager
+def advisory_lock(engine: Engine, key: str, timeout: float) -> Iterator[bool]:
+    """
+    Session level PostgreSQL advisory lock, held on a dedicated connection, so that commits made meanwhile
+    by the caller's session do not release it. The lock is also released when the connection is lost.
+    Waits at most `timeout` seconds and yields whether the lock was taken, the connection is given back right away
+    when it was not.
+    """
+    lock_key = advisory_lock_key(key)
+    with engine.connect() as connection:
+        if lock(connection, lock_key, timeout):
+            try:
+                yield True
+            finally:
+                connection.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_NAMESPACE, lock_key)))
+            return
+    yield False
+
+
+@asynccontextmanager
+async def advisory_lock_async(engine: AsyncEngine, key: str, timeout: float) -> AsyncIterator[bool]:
+    lock_key = advisory_lock_key(key)
+    async with engine.connect() as connection:
+        if await lock_async(connection, lock_key, timeout):
+            try:
+                yield True
+            finally:
+                await connection.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_NAMESPACE, lock_key)))
+            return
+    yield False
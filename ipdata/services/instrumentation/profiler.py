@@ -0,0 +1,110 @@
+"""
+Sampling profiler which is switched on at runtime, for a time window or for the next N requests.
+
+A background thread takes the stacks of all other threads every interval and counts them in the folded format
+(`thread;module:function;module:function count` per line) which flamegraph.pl, speedscope and inferno read.
+Nothing is measured while it is off.
+"""
+
+import sys
+import threading
+from collections import Counter
+from time import monotonic
+from types import FrameType
+from typing import Any
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._deadline = 0.0
+        self._interval = 0.0
+        self.requests_left: int | None = None
+        self.sample_count = 0
+        self.started_at: float | None = None
+        self.stopped_at: float | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, requests: int | None = None, interval: float = 0.005) -> None:
+        """
+        Profile for `duration` seconds, or until `requests` requests are finished when that comes first.
+        Samples of the previous profile are discarded.
+        """
+        with self._lock:
+            if self.running:
+                raise ProfilerBusyError("The profiler is already running")
+            self._samples = Counter()
+            self._stop.clear()
+            self._interval = interval
+            self._deadline = monotonic() + duration
+            self.requests_left = requests
+            self.sample_count = 0
+            self.started_at, self.stopped_at = monotonic(), None
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def request_finished(self) -> None:
+        # Only called on the event loop thread, so the countdown needs no lock
+        if self.requests_left is not None:
+            self.requests_left -= 1
+            if self.requests_left <= 0:
+                self.requests_left = None
+                self._stop.set()
+
+    def folded(self) -> str:
+        with self._lock:
+            samples = sorted(self._samples.items())
+        return "".join(f"{stack} {count}\n" for stack, count in samples)
+
+    def stats(self) -> dict[str, Any]:
+        end = self.stopped_at if self.stopped_at is not None else monotonic()
+        return {
+            "running": self.running,
+            "samples": self.sample_count,
+            "stacks": len(self._samples),
+            "requests_left": self.requests_left,
+            "duration": end - self.started_at if self.started_at is not None else None,
+        }
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self._interval) and monotonic() < self._deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [
+                folded_stack(names.get(thread_id, str(thread_id)), frame)
+                for thread_id, frame in sys._current_frames().items()
+                if thread_id != own_id
+            ]
+            with self._lock:
+                self._samples.update(stacks)
+                self.sample_count += 1
+        self.requests_left = None
+        self.stopped_at = monotonic()
+
+
+def folded_stack(thread_name: str, frame: FrameType | None) -> str:
+    frames = []
+    while frame is not None:
+        frames.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    # Semicolons separate the frames of the folded format
+    return ";".join([thread_name, *reversed(frames)]).replace(" ", "_")
+
+
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,171 @@
+"""
+Structured timing log of requests: the request id, route, IP, time spent in the database and upstream, and rows read.
+Requests slower than the threshold are logged with the SQL statements they ran and their durations.
+
+The timings of a request live in a context variable, which SQLAlchemy cursor events and stage timers add to.
+Context variables are passed to the worker threads of run_in_threadpool and to the greenlets of AsyncSession,
+so queries of both modes are attributed to the request which ran them.
+"""
+
+from contextvars import ContextVar
+from logging import INFO
+from time import perf_counter
+from typing import Any
+from uuid import uuid4
+
+import orjson
+import structlog
+from sqlalchemy import Engine, event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ipdata.services.instrumentation.profiler import sampling_profiler
+from ipdata.settings import settings
+
+REQUEST_ID_HEADER = b"x-request-id"
+# Requests of the admin endpoints are neither logged nor counted by the profiler
+ADMIN_PATH_PREFIX = "/admin/"
+
+logger = structlog.get_logger("ipdata.requests")
+
+
+class RequestTimings:
+    __slots__ = ("request_id", "db_seconds", "queries", "rows", "stages", "statements", "max_statements")
+
+    def __init__(self, request_id: str, max_statements: int) -> None:
+        self.request_id = request_id
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.stages: dict[str, float] = {}
+        self.statements: list[tuple[str, float, int]] = []
+        self.max_statements = max_statements
+
+    def add_query(self, statement: str, duration: float, rows: int) -> None:
+        self.db_seconds += duration
+        self.queries += 1
+        self.rows += rows
+        if len(self.statements) < self.max_statements:
+            self.statements.append((statement, duration, rows))
+
+    def add_stage(self, stage: str, duration: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+
+current_request: ContextVar[RequestTimings | None] = ContextVar("current_request", default=None)
+
+
+def configure_logging() -> None:
+    """
+    One JSON line per event on the standard output, encoded with orjson.
+    """
+    structlog.configure(
+        processors=[
+            structlog.processors.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso", utc=True),
+            structlog.processors.JSONRenderer(serializer=orjson.dumps),
+        ],
+        wrapper_class=structlog.make_filtering_bound_logger(INFO),
+        logger_factory=structlog.BytesLoggerFactory(),
+    )
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if current_request.get() is not None:
+        conn.info.setdefault("query_started_at", []).append(perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    timings = current_request.get()
+    started_at = conn.info.get("query_started_at")
+    if timings is not None and started_at:
+        timings.add_query(statement, perf_counter() - started_at.pop(), max(cursor.rowcount, 0))
+
+
+def install_query_hooks() -> None:
+    """
+    Listen to the statements of all engines, the async ones run theirs through a sync engine too.
+    """
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+def remove_query_hooks() -> None:
+    if event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+class RequestLogMiddleware:
+    """
+    Gives every request an id, taken from the X-Request-ID header when the client sends one and returned in it,
+    tracks its timings and logs them: all requests, only the slow ones, or none (REQUEST_LOG).
+    Also counts requests for the sampling profiler, which can be limited to a number of them.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = request_id_of(scope)
+        mode, slow_threshold = settings.request_log, settings.slow_request_threshold
+        timings = RequestTimings(request_id, settings.slow_request_max_statements) if mode != "off" else None
+        token = current_request.set(timings)
+        started_at = perf_counter()
+        status = 500
+
+        async def send_with_request_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            current_request.reset(token)
+            duration = perf_counter() - started_at
+            if not scope["path"].startswith(ADMIN_PATH_PREFIX):
+                sampling_profiler.request_finished()
+                if timings is not None and (mode == "all" or duration >= slow_threshold):
+                    log_request(scope, status, duration, timings, slow=duration >= slow_threshold)
+
+
+def request_id_of(scope: Scope) -> str:
+    for name, value in scope["headers"]:
+        if name == REQUEST_ID_HEADER:
+            # Bounded, so that a client cannot make log lines arbitrarily long
+            return value.decode("latin-1")[:64]
+    return uuid4().hex
+
+
+def log_request(scope: Scope, status: int, duration: float, timings: RequestTimings, slow: bool) -> None:
+    route = scope.get("route")
+    fields: dict[str, Any] = {
+        "request_id": timings.request_id,
+        "method": scope["method"],
+        "route": route.path if route is not None else scope["path"],
+        "status": status,
+        "ip": str(scope.get("path_params", {}).get("ip", "")) or None,
+        "client": scope["client"][0] if scope.get("client") else None,
+        "duration_ms": duration * 1000,
+        "db_ms": timings.db_seconds * 1000,
+        "upstream_ms": timings.stages.get("upstream", 0.0) * 1000,
+        "queries": timings.queries,
+        "rows": timings.rows,
+        "stages_ms": {stage: seconds * 1000 for stage, seconds in timings.stages.items()},
+    }
+    if not slow:
+        logger.info("request", **fields)
+        return
+
+    statements = [
+        {"statement": statement, "duration_ms": seconds * 1000, "rows": rows}
+        for statement, seconds, rows in timings.statements
+    ]
+    logger.warning("slow_request", **fields, statements=statements)
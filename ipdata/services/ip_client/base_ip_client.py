@@ -2,16 +2,61 @@ from abc import ABC, abstractmethod
 from logging import getLogger
 
 from furl import furl
+from httpx import AsyncClient, Limits
 from requests import Session
+from requests.adapters import HTTPAdapter
 
 from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.upstream_guard import UpstreamGuard
+from ipdata.settings import Settings
+
+
+def create_session(config: Settings) -> Session:
+    """
+    Session with a keep-alive connection pool big enough for the concurrent batch fan-out.
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_maxsize=config.ip_stack_pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def create_async_session(config: Settings) -> AsyncClient:
+    return AsyncClient(
+        limits=Limits(max_connections=config.ip_stack_pool_size, max_keepalive_connections=config.ip_stack_pool_size)
+    )
 
 
 class BaseIPClient(ABC):
-    def __init__(self, ip_url: furl):
+    def __init__(self, ip_url: furl, session: Session | None = None, guard: UpstreamGuard | None = None):
         self._ip_url = ip_url
-        self._session = Session()
+        self._session = session if session is not None else Session()
+        self._guard = guard
         self._logger = getLogger(__name__)
 
+    def close(self) -> None:
+        self._session.close()
+
     @abstractmethod
     def get_ip_data(self, ip: str) -> IPData: ...
+
+
+class BaseAsyncIPClient(ABC):
+    def __init__(self, ip_url: furl, session: AsyncClient | None = None, guard: UpstreamGuard | None = None):
+        self._ip_url = ip_url
+        self._session = session if session is not None else AsyncClient()
+        self._guard = guard
+        self._logger = getLogger(__name__)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._session.aclose()
+
+    @abstractmethod
+    async def get_ip_data(self, ip: str) -> IPData: ...
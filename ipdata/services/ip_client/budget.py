@@ -0,0 +1,330 @@
+"""
+Client-side budget of upstream lookups, so that provider rate limits and monthly quotas are not overrun.
+Lookups are counted in fixed windows (the current second and the current calendar month, UTC) in a store
+shared by all workers. Every lookup has a priority: lower priorities may only use part of each budget,
+the rest is kept for interactive lookups.
+"""
+
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from math import floor
+from threading import Lock
+from time import sleep, time
+from typing import Any, Callable, Iterator, Literal
+
+from sqlalchemy import Engine, delete, func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ipdata.db import get_engine
+from ipdata.models.upstream_budget import UpstreamBudgetModel
+from ipdata.services.ip_client.exceptions import BUDGET_EXHAUSTED, IpStackException
+from ipdata.settings import Settings
+
+Priority = Literal["interactive", "batch", "background"]
+PRIORITIES: tuple[Priority, ...] = ("interactive", "batch", "background")
+
+# Windows are kept a little longer than they last, so that clocks of workers may differ slightly
+SECOND_WINDOW_TTL = 2.0
+MONTH_WINDOW_TTL = 32 * 24 * 3600.0
+
+upstream_priority: ContextVar[Priority] = ContextVar("upstream_priority", default="interactive")
+
+
+@contextmanager
+def lookup_priority(priority: Priority) -> Iterator[None]:
+    """
+    Upstream lookups made inside the block, also in tasks started from it, use the given priority.
+    """
+    token = upstream_priority.set(priority)
+    try:
+        yield
+    finally:
+        upstream_priority.reset(token)
+
+
+class BaseBudgetStore(ABC):
+    @abstractmethod
+    def consume(self, key: str, amount: int, limit: int, ttl: float) -> int | None:
+        """
+        Add amount to the usage of the window unless that would exceed limit. Return the new usage, None if denied.
+        """
+
+    async def consume_async(self, key: str, amount: int, limit: int, ttl: float) -> int | None:
+        return self.consume(key, amount, limit, ttl)
+
+    @abstractmethod
+    def release(self, key: str, amount: int) -> None:
+        """
+        Give back amount consumed in the window, for lookups which were refused after all.
+        """
+
+    async def release_async(self, key: str, amount: int) -> None:
+        self.release(key, amount)
+
+
+class InMemoryBudgetStore(BaseBudgetStore):
+    """
+    Budget of a single worker, used in tests and single worker deployments.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time) -> None:
+        self._clock = clock
+        self._windows: dict[str, tuple[float, int]] = {}
+        self._lock = Lock()
+
+    def consume(self, key: str, amount: int, limit: int, ttl: float) -> int | None:
+        now = self._clock()
+        with self._lock:
+            expires_at, used = self._windows.get(key, (0.0, 0))
+            if expires_at <= now:
+                expires_at, used = now + ttl, 0
+                # Drop expired windows from time to time, one per second would pile up otherwise
+                self._windows = {k: window for k, window in self._windows.items() if window[0] > now}
+            if used + amount > limit:
+                return None
+            self._windows[key] = (expires_at, used + amount)
+            return used + amount
+
+    def release(self, key: str, amount: int) -> None:
+        with self._lock:
+            if key in self._windows:
+                expires_at, used = self._windows[key]
+                self._windows[key] = (expires_at, max(0, used - amount))
+
+
+class DatabaseBudgetStore(BaseBudgetStore):
+    """
+    Budget shared by all workers and replicas through the ipdata_upstream_budget table.
+    Every window is a row, updated with a single conditional upsert.
+    """
+
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, engine_getter: Callable[[], Engine | AsyncEngine | None] = get_engine) -> None:
+        self._engine_getter = engine_getter
+        self._consumed = 0
+
+    def consume(self, key: str, amount: int, limit: int, ttl: float) -> int | None:
+        with self._engine_getter().begin() as connection:
+            used = connection.execute(self._consume_statement(key, amount, limit, ttl)).scalar()
+            if self._cleanup_due():
+                connection.execute(self._cleanup_statement())
+        return used
+
+    async def consume_async(self, key: str, amount: int, limit: int, ttl: float) -> int | None:
+        async with self._engine_getter().begin() as connection:
+            used = (await connection.execute(self._consume_statement(key, amount, limit, ttl))).scalar()
+            if self._cleanup_due():
+                await connection.execute(self._cleanup_statement())
+        return used
+
+    def release(self, key: str, amount: int) -> None:
+        with self._engine_getter().begin() as connection:
+            connection.execute(self._release_statement(key, amount))
+
+    async def release_async(self, key: str, amount: int) -> None:
+        async with self._engine_getter().begin() as connection:
+            await connection.execute(self._release_statement(key, amount))
+
+    def _consume_statement(self, key: str, amount: int, limit: int, ttl: float):
+        statement = insert(UpstreamBudgetModel).values(
+            key=key, used=amount, expires_at=func.now() + timedelta(seconds=ttl)
+        )
+        return statement.on_conflict_do_update(
+            index_elements=[UpstreamBudgetModel.key],
+            set_={"used": UpstreamBudgetModel.used + amount},
+            where=UpstreamBudgetModel.used + amount <= limit,
+        ).returning(UpstreamBudgetModel.used)
+
+    def _release_statement(self, key: str, amount: int):
+        return (
+            update(UpstreamBudgetModel)
+            .where(UpstreamBudgetModel.key == key)
+            .values(used=func.greatest(UpstreamBudgetModel.used - amount, 0))
+        )
+
+    def _cleanup_statement(self):
+        return delete(UpstreamBudgetModel).where(UpstreamBudgetModel.expires_at < func.now())
+
+    def _cleanup_due(self) -> bool:
+        self._consumed += 1
+        return self._consumed % self.CLEANUP_EVERY == 0
+
+
+class UpstreamBudget:
+    """
+    Per provider budgets: `rate_limits` requests per second and `monthly_quotas` looked up IPs per month
+    (a bulk request of N IPs takes one request and N lookups), providers without a limit are not limited.
+    Batch lookups may use `1 - reserve` of each budget, background ones `1 - 2 * reserve`. A lookup over
+    the per-second budget waits for the next second, at most `max_wait` seconds, one over the monthly quota
+    is refused right away.
+    """
+
+    def __init__(
+        self,
+        store: BaseBudgetStore,
+        rate_limits: dict[str, int],
+        monthly_quotas: dict[str, int],
+        reserve: float = 0.2,
+        max_wait: float = 1.0,
+        clock: Callable[[], float] = time,
+    ) -> None:
+        self._store = store
+        self._rate_limits = rate_limits
+        self._monthly_quotas = monthly_quotas
+        self._reserve = reserve
+        self._max_wait = max_wait
+        self._clock = clock
+        self._lock = Lock()
+        self._used_this_month: dict[str, int] = {}
+        self._denied: dict[str, dict[str, int]] = {}
+        self._waits: dict[str, float] = {}
+
+    def acquire(self, provider: str, amount: int = 1) -> None:
+        """
+        The monthly quota is checked first, so that a lookup refused for the month does not take a per-second slot.
+        Lookups which then run out of per-second slots give their part of the monthly quota back.
+        """
+        priority = upstream_priority.get()
+        month_key = self._month_key(provider)
+        if not self._consume_month(provider, month_key, amount, priority):
+            raise self._budget_exhausted(provider, priority, "month")
+        deadline = self._clock() + self._max_wait
+        while not self._consume_second(provider, priority):
+            delay = self._delay(deadline)
+            if delay is None:
+                self._release_month(provider, month_key, amount)
+                raise self._budget_exhausted(provider, priority, "second")
+            self._observe_wait(provider, delay)
+            sleep(delay)
+
+    async def acquire_async(self, provider: str, amount: int = 1) -> None:
+        priority = upstream_priority.get()
+        month_key = self._month_key(provider)
+        if not await self._consume_month_async(provider, month_key, amount, priority):
+            raise self._budget_exhausted(provider, priority, "month")
+        deadline = self._clock() + self._max_wait
+        while not await self._consume_second_async(provider, priority):
+            delay = self._delay(deadline)
+            if delay is None:
+                await self._release_month_async(provider, month_key, amount)
+                raise self._budget_exhausted(provider, priority, "second")
+            self._observe_wait(provider, delay)
+            await asyncio.sleep(delay)
+
+    def stats(self, provider: str) -> dict[str, Any]:
+        quota = self._monthly_quotas.get(provider)
+        with self._lock:
+            used = self._used_this_month.get(provider)
+            return {
+                "rate_limit": self._rate_limits.get(provider),
+                "monthly_quota": quota,
+                "used_this_month": used,
+                "remaining_this_month": None if quota is None or used is None else max(0, quota - used),
+                "denied": dict(self._denied.get(provider, {})),
+                "wait_seconds_total": self._waits.get(provider, 0.0),
+            }
+
+    def _consume_second(self, provider: str, priority: Priority) -> bool:
+        if provider not in self._rate_limits:
+            return True
+        limit = self._limit(self._rate_limits[provider], priority, at_least_one=True)
+        return self._store.consume(self._second_key(provider), 1, limit, SECOND_WINDOW_TTL) is not None
+
+    def _consume_month(self, provider: str, key: str, amount: int, priority: Priority) -> bool:
+        if provider not in self._monthly_quotas:
+            return True
+        limit = self._limit(self._monthly_quotas[provider], priority)
+        used = self._store.consume(key, amount, limit, MONTH_WINDOW_TTL)
+        return self._observe_month(provider, used)
+
+    def _release_month(self, provider: str, key: str, amount: int) -> None:
+        if provider in self._monthly_quotas:
+            self._store.release(key, amount)
+            self._observe_release(provider, amount)
+
+    async def _consume_second_async(self, provider: str, priority: Priority) -> bool:
+        if provider not in self._rate_limits:
+            return True
+        limit = self._limit(self._rate_limits[provider], priority, at_least_one=True)
+        return await self._store.consume_async(self._second_key(provider), 1, limit, SECOND_WINDOW_TTL) is not None
+
+    async def _consume_month_async(self, provider: str, key: str, amount: int, priority: Priority) -> bool:
+        if provider not in self._monthly_quotas:
+            return True
+        limit = self._limit(self._monthly_quotas[provider], priority)
+        used = await self._store.consume_async(key, amount, limit, MONTH_WINDOW_TTL)
+        return self._observe_month(provider, used)
+
+    async def _release_month_async(self, provider: str, key: str, amount: int) -> None:
+        if provider in self._monthly_quotas:
+            await self._store.release_async(key, amount)
+            self._observe_release(provider, amount)
+
+    def _observe_month(self, provider: str, used: int | None) -> bool:
+        if used is None:
+            return False
+        with self._lock:
+            self._used_this_month[provider] = used
+        return True
+
+    def _observe_release(self, provider: str, amount: int) -> None:
+        with self._lock:
+            if provider in self._used_this_month:
+                self._used_this_month[provider] = max(0, self._used_this_month[provider] - amount)
+
+    def _limit(self, limit: int, priority: Priority, at_least_one: bool = False) -> int:
+        share = limit * max(0.0, 1 - self._reserve * PRIORITIES.index(priority))
+        return max(1, floor(share)) if at_least_one else floor(share)
+
+    def _delay(self, deadline: float) -> float | None:
+        """
+        Time to sleep until the next second, None if it is not worth waiting for.
+        """
+        now = self._clock()
+        delay = floor(now) + 1 - now
+        if now + delay > deadline:
+            return None
+        return delay
+
+    def _budget_exhausted(self, provider: str, priority: Priority, window: str) -> IpStackException:
+        with self._lock:
+            denied = self._denied.setdefault(provider, {})
+            denied[priority] = denied.get(priority, 0) + 1
+        return IpStackException(
+            code=BUDGET_EXHAUSTED,
+            err_type="budget_exhausted",
+            info=f"Lookup budget of {provider} for this {window} is used up",
+        )
+
+    def _observe_wait(self, provider: str, delay: float) -> None:
+        with self._lock:
+            self._waits[provider] = self._waits.get(provider, 0.0) + delay
+
+    def _second_key(self, provider: str) -> str:
+        return f"{provider}:second:{floor(self._clock())}"
+
+    def _month_key(self, provider: str) -> str:
+        return f"{provider}:month:{datetime.fromtimestamp(self._clock(), timezone.utc):%Y-%m}"
+
+
+def create_budget_store(config: Settings) -> BaseBudgetStore:
+    match config.ip_provider_budget_store:
+        case "database":
+            return DatabaseBudgetStore()
+        case _:
+            return InMemoryBudgetStore()
+
+
+def create_upstream_budget(config: Settings) -> UpstreamBudget:
+    return UpstreamBudget(
+        create_budget_store(config),
+        rate_limits=config.ip_provider_rate_limits,
+        monthly_quotas=config.ip_provider_monthly_quotas,
+        reserve=config.ip_provider_budget_reserve,
+        max_wait=config.ip_provider_budget_max_wait,
+    )
@@ -1,3 +1,9 @@
+# Codes of errors raised by this application, next to the error codes returned by ipstack
+CONNECTION_ERROR = 1001
+CIRCUIT_OPEN = 1002
+BUDGET_EXHAUSTED = 1003
+
+
 class IpStackException(Exception):
     def __init__(self, code: int, err_type: str, info: str):
         self.code = code
@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.exceptions import IpStackException
+from ipdata.services.ip_client.ip_stack_client import IP_STACK_BULK_LIMIT
+from ipdata.services.ip_client.routing import AsyncIPClientRouter, IPClientRouter
+
+
+def chunks(ips: list[str], size: int) -> list[list[str]]:
+    return [ips[i : i + size] for i in range(0, len(ips), size)]
+
+
+def fetch_ip_data_batch(
+    client: IPClientRouter, ips: list[str], concurrency: int, bulk: bool = False
+) -> dict[str, IPData | IpStackException]:
+    """
+    Fetch many IPs from ipstack with at most `concurrency` requests in flight.
+    With `bulk`, IPs are sent in comma separated groups of IP_STACK_BULK_LIMIT instead of one by one.
+    """
+    if not ips:
+        return {}
+
+    def fetch_one(ip: str) -> dict[str, IPData | IpStackException]:
+        try:
+            return {ip: client.get_ip_data(ip)}
+        except IpStackException as e:
+            return {ip: e}
+
+    def fetch_chunk(chunk: list[str]) -> dict[str, IPData | IpStackException]:
+        try:
+            return client.get_ip_data_bulk(chunk)
+        except IpStackException as e:
+            return {ip: e for ip in chunk}
+
+    fetch, tasks = (fetch_chunk, chunks(ips, IP_STACK_BULK_LIMIT)) if bulk else (fetch_one, ips)
+    # Context variables of the caller (e.g. the lookup priority) are not passed to executor threads on their own
+    contexts = [copy_context() for _ in tasks]
+    results: dict[str, IPData | IpStackException] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(tasks)))) as executor:
+        for result in executor.map(lambda context, task: context.run(fetch, task), contexts, tasks):
+            results.update(result)
+    return results
+
+
+async def fetch_ip_data_batch_async(
+    client: AsyncIPClientRouter, ips: list[str], concurrency: int, bulk: bool = False
+) -> dict[str, IPData | IpStackException]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def fetch_one(ip: str) -> dict[str, IPData | IpStackException]:
+        async with semaphore:
+            try:
+                return {ip: await client.get_ip_data(ip)}
+            except IpStackException as e:
+                return {ip: e}
+
+    async def fetch_chunk(chunk: list[str]) -> dict[str, IPData | IpStackException]:
+        async with semaphore:
+            try:
+                return await client.get_ip_data_bulk(chunk)
+            except IpStackException as e:
+                return {ip: e for ip in chunk}
+
+    if bulk:
+        coroutines = [fetch_chunk(chunk) for chunk in chunks(ips, IP_STACK_BULK_LIMIT)]
+    else:
+        coroutines = [fetch_one(ip) for ip in ips]
+
+    results: dict[str, IPData | IpStackException] = {}
+    for result in await asyncio.gather(*coroutines):
+        results.update(result)
+    return results
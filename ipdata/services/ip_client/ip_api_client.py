@@ -0,0 +1,21 @@
+from ipdata.services.ip_client.ip_stack_client import AsyncIPStackClient, IPStackClient
+from ipdata.settings import settings
+
+
+class IPAPIClient(IPStackClient):
+    """
+    Client of ipapi.com. Its API, including the response and error format, is the same as the ipstack one,
+    only the endpoint and the access key differ.
+    """
+
+    provider = "ipapi"
+
+    def _access_key(self) -> str:
+        return settings.ip_api_access_key.get_secret_value()
+
+
+class AsyncIPAPIClient(AsyncIPStackClient):
+    provider = "ipapi"
+
+    def _access_key(self) -> str:
+        return settings.ip_api_access_key.get_secret_value()
@@ -1,11 +1,13 @@
 from typing import Any
 
+import httpx
 import requests.exceptions
 from pydantic import BaseModel, ValidationError
 
-from ipdata.services.ip_client.base_ip_client import BaseIPClient
+from ipdata.services.ip_client.base_ip_client import BaseAsyncIPClient, BaseIPClient
 from ipdata.services.ip_client.data import IPData
-from ipdata.services.ip_client.exceptions import IpStackException
+from ipdata.services.ip_client.exceptions import CONNECTION_ERROR, IpStackException
+from ipdata.services.metrics.registry import stage_duration, upstream_errors
 from ipdata.settings import settings
 
 
@@ -20,10 +22,34 @@ class IPStackErrorResponse(BaseModel):
     error: IPStackError
 
 
-class IPStackClient(BaseIPClient):
-    def get_ip_data(self, ip: str) -> IPData:
-        response = self._fetch_from_api(ip)
+# Maximum number of IPs in one ipstack bulk lookup request
+IP_STACK_BULK_LIMIT = 50
+
+
+class IPStackResponseParser:
+    """
+    Translates ipstack responses into IPData objects. Shared by the sync and async clients.
+    """
+
+    # Label of the upstream error metrics
+    provider = "ipstack"
 
+    def _determine_bulk_response(
+        self, ips: list[str], response: list[dict[str, Any]] | dict[str, Any]
+    ) -> dict[str, IPData | IpStackException]:
+        if isinstance(response, dict):
+            error = self._create_error_response(response).error
+            raise IpStackException(code=error.code, err_type=error.type, info=error.info)
+
+        results: dict[str, IPData | IpStackException] = {}
+        for ip, item in zip(ips, response):
+            try:
+                results[ip] = self._raise_for_error(self._determine_response(item))
+            except IpStackException as e:
+                results[ip] = e
+        return results
+
+    def _raise_for_error(self, response: IPData | IPStackErrorResponse) -> IPData:
         if isinstance(response, IPStackErrorResponse):
             raise IpStackException(
                 code=response.error.code,
@@ -32,22 +58,6 @@ class IPStackClient(BaseIPClient):
             )
         return response
 
-    def _fetch_from_api(self, ip: str) -> IPData | IPStackErrorResponse:
-        response = self._session.get(
-            self._ip_url.join(ip),
-            params={"access_key": settings.ip_stack_access_key.get_secret_value()},
-        )
-        try:
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            raise IpStackException(
-                code=e.response.status_code,
-                err_type="http_error",
-                info=e.response.text,
-            )
-
-        return self._determine_response(response.json())
-
     def _determine_response(
         self,
         response: dict[str, Any],
@@ -60,10 +70,10 @@ class IPStackClient(BaseIPClient):
     def _create_error_response(self, response: dict[str, Any]) -> IPStackErrorResponse:
         try:
             self._logger.error(response)
-            return IPStackErrorResponse(**response)
+            error_response = IPStackErrorResponse(**response)
         except ValidationError:
             # This means that the response was successful but the data was not found
-            return IPStackErrorResponse(
+            error_response = IPStackErrorResponse(
                 success=False,
                 error=IPStackError(
                     code=999,
@@ -71,3 +81,101 @@ class IPStackClient(BaseIPClient):
                     info="This IP address does not have any info.",
                 ),
             )
+        upstream_errors.inc(self.provider, str(error_response.error.code))
+        return error_response
+
+
+class IPStackClient(IPStackResponseParser, BaseIPClient):
+    def _access_key(self) -> str:
+        return settings.ip_stack_access_key.get_secret_value()
+
+    def get_ip_data(self, ip: str) -> IPData:
+        return self._raise_for_error(self._fetch_from_api(ip))
+
+    def get_ip_data_bulk(self, ips: list[str]) -> dict[str, IPData | IpStackException]:
+        """
+        Look up to IP_STACK_BULK_LIMIT IPs in one request. Available in ipstack Professional plan and higher.
+        """
+        return self._determine_bulk_response(ips, self._fetch_json_from_api(",".join(ips)))
+
+    def _fetch_from_api(self, ip: str) -> IPData | IPStackErrorResponse:
+        return self._determine_response(self._fetch_json_from_api(ip))
+
+    def _fetch_json_from_api(self, ip: str) -> Any:
+        """
+        Timed with the retries of the guard, as the caller waits for them.
+        """
+        try:
+            with stage_duration.time("upstream"):
+                if self._guard is None:
+                    return self._request_json(ip)
+                return self._guard.call(lambda: self._request_json(ip))
+        except IpStackException as e:
+            upstream_errors.inc(self.provider, str(e.code))
+            raise
+
+    def _request_json(self, ip: str) -> Any:
+        try:
+            response = self._session.get(
+                str(self._ip_url.copy().join(ip)),
+                params={"access_key": self._access_key()},
+                timeout=(settings.ip_stack_connect_timeout, settings.ip_stack_read_timeout),
+            )
+        except requests.exceptions.RequestException as e:
+            raise IpStackException(code=CONNECTION_ERROR, err_type="connection_error", info=str(e))
+
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            raise IpStackException(
+                code=e.response.status_code,
+                err_type="http_error",
+                info=e.response.text,
+            )
+
+        return response.json()
+
+
+class AsyncIPStackClient(IPStackResponseParser, BaseAsyncIPClient):
+    def _access_key(self) -> str:
+        return settings.ip_stack_access_key.get_secret_value()
+
+    async def get_ip_data(self, ip: str) -> IPData:
+        return self._raise_for_error(await self._fetch_from_api(ip))
+
+    async def get_ip_data_bulk(self, ips: list[str]) -> dict[str, IPData | IpStackException]:
+        return self._determine_bulk_response(ips, await self._fetch_json_from_api(",".join(ips)))
+
+    async def _fetch_from_api(self, ip: str) -> IPData | IPStackErrorResponse:
+        return self._determine_response(await self._fetch_json_from_api(ip))
+
+    async def _fetch_json_from_api(self, ip: str) -> Any:
+        try:
+            with stage_duration.time("upstream"):
+                if self._guard is None:
+                    return await self._request_json(ip)
+                return await self._guard.call_async(lambda: self._request_json(ip))
+        except IpStackException as e:
+            upstream_errors.inc(self.provider, str(e.code))
+            raise
+
+    async def _request_json(self, ip: str) -> Any:
+        try:
+            response = await self._session.get(
+                str(self._ip_url.copy().join(ip)),
+                params={"access_key": self._access_key()},
+                timeout=httpx.Timeout(settings.ip_stack_read_timeout, connect=settings.ip_stack_connect_timeout),
+            )
+        except httpx.TransportError as e:
+            raise IpStackException(code=CONNECTION_ERROR, err_type="connection_error", info=str(e))
+
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise IpStackException(
+                code=e.response.status_code,
+                err_type="http_error",
+                info=e.response.text,
+            )
+
+        return response.json()
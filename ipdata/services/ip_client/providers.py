@@ -0,0 +1,160 @@
+"""
+Registry of IP data providers and the process-wide clients built from it.
+Every provider gets its own upstream guard and latency / quota stats, shared by the sync and async clients.
+"""
+
+import asyncio
+from threading import RLock
+from typing import Any, Callable
+
+from furl import furl
+
+from ipdata.services.ip_client.base_ip_client import (
+    BaseAsyncIPClient,
+    BaseIPClient,
+    create_async_session,
+    create_session,
+)
+from ipdata.services.ip_client.budget import UpstreamBudget, create_upstream_budget
+from ipdata.services.ip_client.ip_api_client import AsyncIPAPIClient, IPAPIClient
+from ipdata.services.ip_client.ip_stack_client import AsyncIPStackClient, IPStackClient
+from ipdata.services.ip_client.routing import AsyncIPClientRouter, IPClientRouter, ProviderStats
+from ipdata.services.ip_client.upstream_guard import UpstreamGuard, create_upstream_guard
+from ipdata.settings import Settings, settings
+
+IPClientFactory = Callable[[Settings, UpstreamGuard], BaseIPClient]
+AsyncIPClientFactory = Callable[[Settings, UpstreamGuard], BaseAsyncIPClient]
+
+PROVIDERS: dict[str, tuple[IPClientFactory, AsyncIPClientFactory]] = {}
+
+
+def register_provider(name: str, factory: IPClientFactory, async_factory: AsyncIPClientFactory) -> None:
+    PROVIDERS[name] = (factory, async_factory)
+
+
+register_provider(
+    "ipstack",
+    lambda config, guard: IPStackClient(furl(config.ip_stack_url), create_session(config), guard),
+    lambda config, guard: AsyncIPStackClient(furl(config.ip_stack_url), create_async_session(config), guard),
+)
+register_provider(
+    "ipapi",
+    lambda config, guard: IPAPIClient(furl(config.ip_api_url), create_session(config), guard),
+    lambda config, guard: AsyncIPAPIClient(furl(config.ip_api_url), create_async_session(config), guard),
+)
+
+_lock = RLock()
+_guards: dict[str, UpstreamGuard] = {}
+_stats: dict[str, ProviderStats] = {}
+_budget: UpstreamBudget | None = None
+_ip_client: IPClientRouter | None = None
+_async_ip_client: AsyncIPClientRouter | None = None
+_async_ip_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_provider_guard(name: str) -> UpstreamGuard:
+    with _lock:
+        if name not in _guards:
+            _guards[name] = create_upstream_guard(name, settings)
+        return _guards[name]
+
+
+def get_provider_stats(name: str) -> ProviderStats:
+    with _lock:
+        if name not in _stats:
+            _stats[name] = ProviderStats(settings.ip_provider_quota_cooldown)
+        return _stats[name]
+
+
+def get_upstream_budget() -> UpstreamBudget:
+    global _budget
+
+    with _lock:
+        if _budget is None:
+            _budget = create_upstream_budget(settings)
+        return _budget
+
+
+def provider_names(config: Settings) -> list[str]:
+    unknown = [name for name in config.ip_providers if name not in PROVIDERS]
+    if unknown or not config.ip_providers:
+        raise ValueError(f"Unknown IP data providers {unknown}, available providers are {sorted(PROVIDERS)}")
+    return list(dict.fromkeys(config.ip_providers))
+
+
+def routing_options(config: Settings) -> dict[str, Any]:
+    return {
+        "policy": config.ip_provider_routing,
+        "weights": config.ip_provider_weights,
+        "default_latency": config.ip_provider_default_latency,
+        "hedge_min_delay": config.ip_provider_hedge_min_delay,
+        "budget": get_upstream_budget(),
+    }
+
+
+def create_ip_client(config: Settings) -> IPClientRouter:
+    names = provider_names(config)
+    return IPClientRouter(
+        {name: PROVIDERS[name][0](config, get_provider_guard(name)) for name in names},
+        {name: get_provider_stats(name) for name in names},
+        **routing_options(config),
+    )
+
+
+def create_async_ip_client(config: Settings) -> AsyncIPClientRouter:
+    names = provider_names(config)
+    return AsyncIPClientRouter(
+        {name: PROVIDERS[name][1](config, get_provider_guard(name)) for name in names},
+        {name: get_provider_stats(name) for name in names},
+        **routing_options(config),
+    )
+
+
+def get_ip_client() -> IPClientRouter:
+    global _ip_client
+
+    with _lock:
+        if _ip_client is None:
+            _ip_client = create_ip_client(settings)
+        return _ip_client
+
+
+def get_async_ip_client() -> AsyncIPClientRouter:
+    """
+    Connections of the client belong to the event loop which opened them, a new loop gets a new client.
+    """
+    global _async_ip_client, _async_ip_client_loop
+
+    loop = asyncio.get_running_loop()
+    if _async_ip_client is None or _async_ip_client_loop is not loop:
+        _async_ip_client = create_async_ip_client(settings)
+        _async_ip_client_loop = loop
+    return _async_ip_client
+
+
+async def dispose_ip_clients() -> None:
+    global _ip_client, _async_ip_client, _async_ip_client_loop
+
+    if _ip_client is not None:
+        _ip_client.close()
+    if _async_ip_client is not None:
+        await _async_ip_client.aclose()
+    _ip_client = None
+    _async_ip_client = None
+    _async_ip_client_loop = None
+
+
+def ip_clients_stats() -> dict[str, Any]:
+    with _lock:
+        names = sorted(set(_guards) | set(_stats))
+    return {
+        "routing": settings.ip_provider_routing,
+        "providers": {
+            name: {
+                **get_provider_stats(name).snapshot(),
+                "upstream": get_provider_guard(name).stats(),
+                "budget": get_upstream_budget().stats(name),
+            }
+            for name in names
+        },
+    }
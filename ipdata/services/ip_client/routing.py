@@ -0,0 +1,332 @@
+import asyncio
+import random
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Lock
+from time import monotonic
+from typing import Any, Awaitable, Callable, Literal, TypeVar
+
+from ipdata.services.ip_client.base_ip_client import BaseAsyncIPClient, BaseIPClient
+from ipdata.services.ip_client.budget import UpstreamBudget
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.exceptions import IpStackException
+
+T = TypeVar("T")
+RoutingPolicy = Literal["primary", "weighted", "hedged"]
+
+INVALID_IP_ADDRESS = 106
+USAGE_LIMIT_REACHED = 104
+# Latency percentiles are not trusted before a provider has answered this many times
+MIN_LATENCY_SAMPLES = 20
+
+
+def should_fail_over(error: IpStackException) -> bool:
+    """
+    Every error is worth asking the next provider about, except an invalid IP which no provider will accept.
+    """
+    return error.code != INVALID_IP_ADDRESS
+
+
+class ProviderStats:
+    """
+    Latency of recent successful lookups and outcome counters of one provider.
+    A provider which reports its monthly limit as reached is moved to the end of the route for `quota_cooldown` seconds.
+    """
+
+    def __init__(self, quota_cooldown: float, samples: int = 200, clock: Callable[[], float] = monotonic) -> None:
+        self._quota_cooldown = quota_cooldown
+        self._clock = clock
+        self._latencies: deque[float] = deque(maxlen=samples)
+        self._lock = Lock()
+        self.calls = 0
+        self.errors = 0
+        self.answers = 0
+        self.quota_exhausted_until = 0.0
+
+    def observe(self, latency: float | None, error: IpStackException | None) -> None:
+        with self._lock:
+            self.calls += 1
+            if error is not None:
+                self.errors += 1
+                if error.code == USAGE_LIMIT_REACHED:
+                    self.quota_exhausted_until = self._clock() + self._quota_cooldown
+            elif latency is not None:
+                self._latencies.append(latency)
+
+    def observe_answer(self) -> None:
+        with self._lock:
+            self.answers += 1
+
+    @property
+    def available(self) -> bool:
+        return self._clock() >= self.quota_exhausted_until
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "answers": self.answers,
+            "available": self.available,
+            "quota_exhausted_for": max(0.0, self.quota_exhausted_until - self._clock()),
+            "latency_p50": self.latency_percentile(0.5),
+            "latency_p95": self.latency_percentile(0.95),
+        }
+
+
+class ProviderRouting:
+    """
+    Decides in which order providers are asked. Shared by the sync and async routers.
+    - primary: in the configured order, the first one is the primary and the others are fallbacks.
+    - weighted: in a random order drawn by weight divided by median latency, so faster providers get more traffic.
+    - hedged: in the configured order, but when a provider does not answer within its p95 latency the next one
+      is asked as well, and the first valid answer wins.
+    Providers out of quota always go last. A provider is asked only when its budget allows, see UpstreamBudget.
+    """
+
+    def __init__(
+        self,
+        stats: dict[str, ProviderStats],
+        policy: RoutingPolicy = "primary",
+        weights: dict[str, float] | None = None,
+        default_latency: float = 0.5,
+        hedge_min_delay: float = 0.05,
+        budget: UpstreamBudget | None = None,
+        clock: Callable[[], float] = monotonic,
+        rng: random.Random | None = None,
+    ) -> None:
+        self.stats = stats
+        self.budget = budget
+        self.policy = policy
+        self._weights = weights or {}
+        self._default_latency = default_latency
+        self._hedge_min_delay = hedge_min_delay
+        self._clock = clock
+        self._rng = rng or random.Random()
+
+    def route(self, providers: list[str]) -> list[str]:
+        available = [name for name in providers if self.stats[name].available]
+        exhausted = [name for name in providers if not self.stats[name].available]
+        if self.policy == "weighted":
+            available = self._weighted_order(available)
+        return available + exhausted
+
+    def hedge_delay(self, name: str) -> float:
+        """
+        Time to wait for the provider before asking the next one: its p95 latency, until it is known the default one.
+        """
+        latency = self.stats[name].latency_percentile(0.95)
+        return max(self._hedge_min_delay, self._default_latency if latency is None else latency)
+
+    def _weighted_order(self, providers: list[str]) -> list[str]:
+        remaining, order = list(providers), []
+        while remaining:
+            weights = [self._effective_weight(name) for name in remaining]
+            if sum(weights) <= 0:
+                return order + remaining
+            chosen = self._rng.choices(remaining, weights)[0]
+            order.append(chosen)
+            remaining.remove(chosen)
+        return order
+
+    def _effective_weight(self, name: str) -> float:
+        latency = self.stats[name].latency_percentile(0.5)
+        return self._weights.get(name, 1.0) / max(self._default_latency if latency is None else latency, 0.001)
+
+
+class IPClientRouter(ProviderRouting):
+    """
+    Sends lookups to one or more providers according to the routing policy. Has the interface of the IP clients.
+    """
+
+    def __init__(self, clients: dict[str, BaseIPClient], stats: dict[str, ProviderStats], **options: Any) -> None:
+        super().__init__(stats, **options)
+        self._clients = clients
+        self.providers = list(clients)
+        self._executor = ThreadPoolExecutor(thread_name_prefix="ip-client-hedge")
+
+    def get_ip_data(self, ip: str) -> IPData:
+        order = self.route(self.providers)
+        if self.policy == "hedged" and len(order) > 1:
+            return self._get_hedged(order, ip)
+        return self._get_with_fallback(order, lambda client: client.get_ip_data(ip))
+
+    def get_ip_data_bulk(self, ips: list[str]) -> dict[str, IPData | IpStackException]:
+        return self._get_with_fallback(
+            self.route(self.providers), lambda client: client.get_ip_data_bulk(ips), amount=len(ips), measure=False
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        for client in self._clients.values():
+            client.close()
+
+    def _get_with_fallback(
+        self, order: list[str], request: Callable[[BaseIPClient], T], amount: int = 1, measure: bool = True
+    ) -> T:
+        error = None
+        for name in order:
+            try:
+                if self.budget is not None:
+                    self.budget.acquire(name, amount)
+                result = self._call(name, request, measure)
+            except IpStackException as e:
+                if not should_fail_over(e):
+                    raise
+                error = e
+                continue
+            self.stats[name].observe_answer()
+            return result
+        raise error
+
+    def _get_hedged(self, order: list[str], ip: str) -> IPData:
+        remaining = list(order)
+        pending: dict[Future, str] = {}
+        error = None
+
+        def ask_next() -> str | None:
+            nonlocal error
+            while remaining:
+                name = remaining.pop(0)
+                try:
+                    # In the calling thread, the lookup priority is not passed to the executor threads
+                    if self.budget is not None:
+                        self.budget.acquire(name)
+                except IpStackException as e:
+                    error = e
+                    continue
+                pending[self._executor.submit(self._call, name, lambda client: client.get_ip_data(ip))] = name
+                return name
+            return None
+
+        last = ask_next()
+        while pending:
+            done, _ = wait(pending, timeout=self.hedge_delay(last) if remaining else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except IpStackException as e:
+                    if not should_fail_over(e):
+                        raise
+                    error = e
+                    continue
+                # Slower requests still in flight are left to finish, their latency is still worth recording
+                self.stats[name].observe_answer()
+                return result
+            if remaining and (not done or not pending):
+                last = ask_next()
+        raise error
+
+    def _call(self, name: str, request: Callable[[BaseIPClient], T], measure: bool = True) -> T:
+        started_at = self._clock()
+        try:
+            result = request(self._clients[name])
+        except IpStackException as e:
+            self.stats[name].observe(None, e)
+            raise
+        self.stats[name].observe(self._clock() - started_at if measure else None, None)
+        return result
+
+
+class AsyncIPClientRouter(ProviderRouting):
+    def __init__(self, clients: dict[str, BaseAsyncIPClient], stats: dict[str, ProviderStats], **options: Any) -> None:
+        super().__init__(stats, **options)
+        self._clients = clients
+        self.providers = list(clients)
+
+    async def get_ip_data(self, ip: str) -> IPData:
+        order = self.route(self.providers)
+        if self.policy == "hedged" and len(order) > 1:
+            return await self._get_hedged(order, ip)
+        return await self._get_with_fallback(order, lambda client: client.get_ip_data(ip))
+
+    async def get_ip_data_bulk(self, ips: list[str]) -> dict[str, IPData | IpStackException]:
+        return await self._get_with_fallback(
+            self.route(self.providers), lambda client: client.get_ip_data_bulk(ips), amount=len(ips), measure=False
+        )
+
+    async def aclose(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+
+    async def _get_with_fallback(
+        self,
+        order: list[str],
+        request: Callable[[BaseAsyncIPClient], Awaitable[T]],
+        amount: int = 1,
+        measure: bool = True,
+    ) -> T:
+        error = None
+        for name in order:
+            try:
+                if self.budget is not None:
+                    await self.budget.acquire_async(name, amount)
+                result = await self._call(name, request, measure)
+            except IpStackException as e:
+                if not should_fail_over(e):
+                    raise
+                error = e
+                continue
+            self.stats[name].observe_answer()
+            return result
+        raise error
+
+    async def _get_hedged(self, order: list[str], ip: str) -> IPData:
+        remaining = list(order)
+        pending: dict[asyncio.Task, str] = {}
+        error = None
+
+        async def ask_next() -> str | None:
+            nonlocal error
+            while remaining:
+                name = remaining.pop(0)
+                try:
+                    if self.budget is not None:
+                        await self.budget.acquire_async(name)
+                except IpStackException as e:
+                    error = e
+                    continue
+                pending[asyncio.create_task(self._call(name, lambda client: client.get_ip_data(ip)))] = name
+                return name
+            return None
+
+        last = await ask_next()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.hedge_delay(last) if remaining else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except IpStackException as e:
+                        if not should_fail_over(e):
+                            raise
+                        error = e
+                        continue
+                    self.stats[name].observe_answer()
+                    return result
+                if remaining and (not done or not pending):
+                    last = await ask_next()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, name: str, request: Callable[[BaseAsyncIPClient], Awaitable[T]], measure: bool = True) -> T:
+        started_at = self._clock()
+        try:
+            result = await request(self._clients[name])
+        except IpStackException as e:
+            self.stats[name].observe(None, e)
+            raise
+        self.stats[name].observe(self._clock() - started_at if measure else None, None)
+        return result
@@ -0,0 +1,217 @@
+import asyncio
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Awaitable, Callable, TypeVar
+
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from ipdata.services.ip_client.exceptions import CIRCUIT_OPEN, CONNECTION_ERROR, IpStackException
+from ipdata.settings import Settings
+
+T = TypeVar("T")
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Failures worth retrying: the upstream could not be reached, timed out, was overloaded or failed internally.
+    Errors reported by ipstack itself (invalid key, monthly limit, invalid IP...) are answers, not failures.
+    """
+    if not isinstance(error, IpStackException):
+        return False
+    return error.code == CONNECTION_ERROR or (error.type == "http_error" and (error.code >= 500 or error.code == 429))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and then rejects calls right away.
+    After `reset_timeout` seconds a single trial call is let through: its success closes the circuit,
+    its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = monotonic) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+                self._state = self.HALF_OPEN
+                return True
+            if self._state == self.CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+class UpstreamMetrics:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = 0
+            self.errors: dict[str, int] = {}
+            self.retries = 0
+            self.latency_seconds_total = 0.0
+            self.latency_seconds_max = 0.0
+
+    def observe_call(self, latency: float, error: BaseException | None) -> None:
+        with self._lock:
+            self.calls += 1
+            self.latency_seconds_total += latency
+            self.latency_seconds_max = max(self.latency_seconds_max, latency)
+            if error is not None:
+                error_type = error.type if isinstance(error, IpStackException) else type(error).__name__
+                self.errors[error_type] = self.errors.get(error_type, 0) + 1
+
+    def observe_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": dict(self.errors),
+                "retries": self.retries,
+                "latency_seconds_total": self.latency_seconds_total,
+                "latency_seconds_max": self.latency_seconds_max,
+                "latency_seconds_avg": self.latency_seconds_total / self.calls if self.calls else 0.0,
+            }
+
+
+class UpstreamGuard:
+    """
+    Wraps every request to an upstream service with a circuit breaker, retries with jittered exponential backoff
+    for transient failures and per request latency / error metrics.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        retry_attempts: int,
+        retry_max_wait: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = monotonic,
+    ) -> None:
+        self.name = name
+        self._retry_attempts = retry_attempts
+        self._retry_max_wait = retry_max_wait
+        self._clock = clock
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout, clock)
+        self.metrics = UpstreamMetrics()
+
+    def call(self, request: Callable[[], T]) -> T:
+        self._check_circuit()
+        retrying = Retrying(sleep=sleep, **self._retry_options())
+        try:
+            result = retrying(self._measured, request)
+        except BaseException as e:
+            self._record_outcome(e)
+            raise
+        self.circuit_breaker.record_success()
+        return result
+
+    async def call_async(self, request: Callable[[], Awaitable[T]]) -> T:
+        self._check_circuit()
+        retrying = AsyncRetrying(sleep=asyncio.sleep, **self._retry_options())
+        try:
+            result = await retrying(self._measured_async, request)
+        except BaseException as e:
+            self._record_outcome(e)
+            raise
+        self.circuit_breaker.record_success()
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "circuit": self.circuit_breaker.state,
+            "circuit_opened": self.circuit_breaker.opened,
+            "rejected": self.circuit_breaker.rejected,
+            **self.metrics.snapshot(),
+        }
+
+    def _measured(self, request: Callable[[], T]) -> T:
+        started_at = self._clock()
+        try:
+            result = request()
+        except BaseException as e:
+            self.metrics.observe_call(self._clock() - started_at, e)
+            raise
+        self.metrics.observe_call(self._clock() - started_at, None)
+        return result
+
+    async def _measured_async(self, request: Callable[[], Awaitable[T]]) -> T:
+        started_at = self._clock()
+        try:
+            result = await request()
+        except BaseException as e:
+            self.metrics.observe_call(self._clock() - started_at, e)
+            raise
+        self.metrics.observe_call(self._clock() - started_at, None)
+        return result
+
+    def _retry_options(self) -> dict[str, Any]:
+        return {
+            "stop": stop_after_attempt(max(1, self._retry_attempts)),
+            "wait": wait_random_exponential(multiplier=0.1, max=self._retry_max_wait),
+            "retry": retry_if_exception(is_transient),
+            "before_sleep": lambda _: self.metrics.observe_retry(),
+            "reraise": True,
+        }
+
+    def _check_circuit(self) -> None:
+        if not self.circuit_breaker.allow():
+            raise IpStackException(
+                code=CIRCUIT_OPEN,
+                err_type="circuit_open",
+                info=f"{self.name} is failing, requests are suspended for a while",
+            )
+
+    def _record_outcome(self, error: BaseException) -> None:
+        if is_transient(error):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+
+def create_upstream_guard(name: str, config: Settings) -> UpstreamGuard:
+    return UpstreamGuard(
+        name,
+        retry_attempts=config.ip_stack_retry_attempts,
+        retry_max_wait=config.ip_stack_retry_max_wait,
+        failure_threshold=config.ip_stack_circuit_failure_threshold,
+        reset_timeout=config.ip_stack_circuit_reset_timeout,
+    )
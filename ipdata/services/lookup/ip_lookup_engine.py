@@ -0,0 +1,207 @@
+from contextlib import contextmanager
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_address
+from sys import getsizeof
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Iterator
+
+from pydantic import IPvAnyAddress
+
+from ipdata.schemas.ipdata import IPDataReturnSchema, LocationDataWithSimpleLanguages
+from ipdata.services.lookup.radix_trie import NO_VALUE, RadixTrie
+from ipdata.services.serialization.ip_data_json import IP_DATA_FIELDS, encode_ip_data_values, encode_location
+
+
+def parse_address(ip: IPvAnyAddress | str) -> IPv4Address | IPv6Address:
+    return ip if isinstance(ip, (IPv4Address, IPv6Address)) else ip_address(str(ip))
+
+
+class IPLookupIndex:
+    """
+    Radix tries for IPv4 and IPv6 which point to compact records: a tuple of the IP data attributes and the number
+    of an interned location. Responses are built from the record of a hit, so the index holds no response models.
+    """
+
+    def __init__(self) -> None:
+        self._tries = {4: RadixTrie(32), 6: RadixTrie(128)}
+        self._records: list[tuple | None] = []
+        self._locations: list[LocationDataWithSimpleLanguages] = []
+        self._locations_json: list[bytes | None] = []
+        self._location_numbers: dict[int, int] = {}
+        self._lock = Lock()
+
+    def add(
+        self, ip_data: Any, location: LocationDataWithSimpleLanguages, network: IPv4Network | IPv6Network | None = None
+    ) -> None:
+        """
+        Store the data of ip_data.ip or, when a network is given, the data of all addresses inside it.
+        ip_data is a row, an entity or a response, anything with the IP data attributes.
+        """
+        if network is None:
+            address = parse_address(ip_data.ip)
+            prefixlen = address.max_prefixlen
+        else:
+            address, prefixlen = network.network_address, network.prefixlen
+        values = tuple(getattr(ip_data, name) for name in IP_DATA_FIELDS)
+        with self._lock:
+            self._records.append((*values, self._intern_location(location)))
+            replaced = self._tries[address.version].insert(int(address), prefixlen, len(self._records) - 1)
+            if replaced != NO_VALUE:
+                self._records[replaced] = None
+
+    def remove(self, ip: IPvAnyAddress | str) -> None:
+        address = parse_address(ip)
+        with self._lock:
+            record = self._tries[address.version].remove(int(address), address.max_prefixlen)
+            if record != NO_VALUE:
+                self._records[record] = None
+
+    def get(self, ip: IPvAnyAddress | str) -> IPDataReturnSchema | None:
+        address, record = self._find(ip)
+        if record is None:
+            return None
+        *values, location = record
+        # A network block is answered with the requested address
+        return IPDataReturnSchema(ip=address, **dict(zip(IP_DATA_FIELDS, values)), location=self._locations[location])
+
+    def get_json(self, ip: IPvAnyAddress | str) -> bytes | None:
+        address, record = self._find(ip)
+        if record is None:
+            return None
+        location = record[-1]
+        location_json = self._locations_json[location]
+        if location_json is None:
+            location_json = self._locations_json[location] = encode_location(self._locations[location])
+        return encode_ip_data_values(record[:-1], str(address), location_json)
+
+    def __len__(self) -> int:
+        return sum(len(trie) for trie in self._tries.values())
+
+    def memory_usage(self) -> dict[str, Any]:
+        return {
+            "entries": len(self),
+            "locations": len(self._locations),
+            "ipv4_nodes": self._tries[4].node_count(),
+            "ipv6_nodes": self._tries[6].node_count(),
+            "trie_bytes": sum(trie.memory_usage() for trie in self._tries.values()),
+            "records_bytes": getsizeof(self._records) + sum(getsizeof(record) for record in self._records),
+        }
+
+    def _find(self, ip: IPvAnyAddress | str) -> tuple[IPv4Address | IPv6Address, tuple | None]:
+        address = parse_address(ip)
+        record = self._tries[address.version].lookup(int(address))
+        return address, self._records[record] if record != NO_VALUE else None
+
+    def _intern_location(self, location: LocationDataWithSimpleLanguages) -> int:
+        number = self._location_numbers.get(location.geoname_id)
+        if number is None:
+            number = self._location_numbers[location.geoname_id] = len(self._locations)
+            self._locations.append(location)
+            self._locations_json.append(None)
+        elif self._locations[number] is not location and self._locations[number] != location:
+            # The location has changed, records which share it answer with the new one
+            self._locations[number], self._locations_json[number] = location, None
+        return number
+
+
+class IPLookupEngine:
+    """
+    Read-only in-process copy of the stored IP data, used to answer lookups without a database round trip.
+    The index is rebuilt from the database in the background and swapped in when ready. Writes made by this process
+    are applied right away, also to an index which is being rebuilt, so that they are not lost by the swap.
+    """
+
+    def __init__(self, clock: Callable[[], float] = monotonic) -> None:
+        self._index: IPLookupIndex | None = None
+        self._journal: list[tuple[str, Any]] | None = None
+        self._lock = Lock()
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.last_rebuild_duration: float | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._index is not None
+
+    def get(self, ip: IPvAnyAddress | str) -> IPDataReturnSchema | None:
+        index = self._index
+        if index is None:
+            return None
+        return self._count(index.get(ip))
+
+    def get_json(self, ip: IPvAnyAddress | str) -> bytes | None:
+        """
+        Return the response encoded to JSON, see encode_ip_data.
+        """
+        index = self._index
+        if index is None:
+            return None
+        return self._count(index.get_json(ip))
+
+    def set(self, schema: IPDataReturnSchema) -> None:
+        self._apply("add", schema)
+
+    def invalidate(self, ip: IPvAnyAddress | str) -> None:
+        self._apply("remove", ip)
+
+    @contextmanager
+    def rebuild(self) -> Iterator[IPLookupIndex]:
+        """
+        Yield an empty index to be filled in. It replaces the current one when the block exits without an error.
+        """
+        started_at = self._clock()
+        with self._lock:
+            self._journal = []
+        try:
+            index = IPLookupIndex()
+            yield index
+            with self._lock:
+                for operation, argument in self._journal:
+                    self._apply_to(index, operation, argument)
+                self._index = index
+        finally:
+            with self._lock:
+                self._journal = None
+
+        self.rebuilds += 1
+        self.last_rebuild_duration = self._clock() - started_at
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index = None
+
+    def stats(self) -> dict[str, Any]:
+        index = self._index
+        return {
+            "enabled": index is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_duration": self.last_rebuild_duration,
+            "memory": index.memory_usage() if index is not None else None,
+        }
+
+    def _count(self, response: Any) -> Any:
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def _apply(self, operation: str, argument: Any) -> None:
+        with self._lock:
+            if self._index is not None:
+                self._apply_to(self._index, operation, argument)
+            if self._journal is not None:
+                self._journal.append((operation, argument))
+
+    def _apply_to(self, index: IPLookupIndex, operation: str, argument: Any) -> None:
+        if operation == "add":
+            index.add(argument, argument.location)
+        else:
+            index.remove(argument)
+
+
+ip_lookup_engine = IPLookupEngine()
@@ -0,0 +1,146 @@
+from array import array
+from sys import getsizeof
+from threading import Lock
+
+# Marks a missing child node and a node without a value
+NO_NODE = -1
+NO_VALUE = -1
+
+
+class RadixTrie:
+    """
+    Path compressed binary trie which maps prefixes of `bits` long integers to integer values
+    and answers longest prefix match lookups.
+    Nodes live in flat arrays indexed by node number, so N prefixes take at most 2N nodes of a few machine words each.
+    Writers are serialized, readers do not lock: a node is fully built before it is linked into the trie.
+    """
+
+    def __init__(self, bits: int) -> None:
+        self.bits = bits
+        self._prefixes: array | list[int] = array("I") if bits <= 32 else []
+        self._lengths = array("B")
+        self._children = (array("i"), array("i"))
+        self._values = array("i")
+        self._lock = Lock()
+        self._size = 0
+        self._new_node(0, 0, NO_VALUE)
+
+    def insert(self, prefix: int, length: int, value: int) -> int:
+        """
+        Store the value of a prefix and return the value it replaced, NO_VALUE if there was none.
+        """
+        key = self._mask(prefix, length)
+        with self._lock:
+            node = 0
+            while True:
+                node_length = self._lengths[node]
+                if node_length == length:
+                    replaced = self._values[node]
+                    self._size += replaced == NO_VALUE
+                    self._values[node] = value
+                    return replaced
+
+                bit = self._bit(key, node_length)
+                child = self._children[bit][node]
+                if child == NO_NODE:
+                    self._children[bit][node] = self._new_node(key, length, value)
+                    self._size += 1
+                    return NO_VALUE
+
+                child_length = self._lengths[child]
+                common = min(self._common_length(key, self._prefixes[child]), length, child_length)
+                if common == child_length:
+                    node = child
+                    continue
+
+                # The new prefix diverges from the child (or ends) inside the child's compressed path: split the path
+                if common == length:
+                    split = self._new_node(key, length, value)
+                else:
+                    split = self._new_node(self._mask(key, common), common, NO_VALUE)
+                    self._children[self._bit(key, common)][split] = self._new_node(key, length, value)
+                self._children[self._bit(self._prefixes[child], common)][split] = child
+                self._children[bit][node] = split
+                self._size += 1
+                return NO_VALUE
+
+    def find(self, prefix: int, length: int) -> int:
+        """
+        Value stored for exactly this prefix, NO_VALUE if there is none.
+        """
+        node = self._find_node(self._mask(prefix, length), length)
+        return NO_VALUE if node == NO_NODE else self._values[node]
+
+    def remove(self, prefix: int, length: int) -> int:
+        """
+        Remove the value of a prefix and return it. Nodes are not reclaimed until the trie is rebuilt.
+        """
+        with self._lock:
+            node = self._find_node(self._mask(prefix, length), length)
+            if node == NO_NODE or self._values[node] == NO_VALUE:
+                return NO_VALUE
+            value = self._values[node]
+            self._values[node] = NO_VALUE
+            self._size -= 1
+            return value
+
+    def lookup(self, address: int) -> int:
+        """
+        Value of the longest prefix containing the address, NO_VALUE if there is none.
+        """
+        # Attributes are bound to locals, this loop is the hot path of every lookup
+        bits, prefixes, lengths, values = self.bits, self._prefixes, self._lengths, self._values
+        children = self._children
+        node, best = 0, values[0]
+        while lengths[node] < bits:
+            node = children[(address >> (bits - lengths[node] - 1)) & 1][node]
+            if node == NO_NODE or (address ^ prefixes[node]) >> (bits - lengths[node]):
+                break
+            if values[node] != NO_VALUE:
+                best = values[node]
+        return best
+
+    def __len__(self) -> int:
+        return self._size
+
+    def node_count(self) -> int:
+        return len(self._lengths)
+
+    def memory_usage(self) -> int:
+        """
+        Approximate size of the node arrays in bytes.
+        """
+        size = sum(getsizeof(column) for column in (self._prefixes, self._lengths, self._values, *self._children))
+        if isinstance(self._prefixes, list):
+            size += sum(getsizeof(prefix) for prefix in self._prefixes)
+        return size
+
+    def _find_node(self, key: int, length: int) -> int:
+        node = 0
+        while self._lengths[node] < length:
+            node = self._children[self._bit(key, self._lengths[node])][node]
+            if (
+                node == NO_NODE
+                or self._lengths[node] > length
+                or self._mask(key, self._lengths[node]) != self._prefixes[node]
+            ):
+                return NO_NODE
+        return node if self._lengths[node] == length else NO_NODE
+
+    def _new_node(self, prefix: int, length: int, value: int) -> int:
+        self._prefixes.append(prefix)
+        self._lengths.append(length)
+        self._children[0].append(NO_NODE)
+        self._children[1].append(NO_NODE)
+        self._values.append(value)
+        return len(self._lengths) - 1
+
+    def _bit(self, key: int, position: int) -> int:
+        return (key >> (self.bits - position - 1)) & 1
+
+    def _mask(self, key: int, length: int) -> int:
+        shift = self.bits - length
+        return key >> shift << shift
+
+    def _common_length(self, a: int, b: int) -> int:
+        return self.bits - (a ^ b).bit_length()
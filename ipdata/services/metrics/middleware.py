@@ -0,0 +1,44 @@
+from time import perf_counter
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ipdata.services.metrics.registry import request_duration
+
+# Label of requests which matched no route, so that scanners cannot create a time series per path
+UNMATCHED_ROUTE = "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Observes the duration of HTTP requests, until the whole body is sent, by route template and status.
+    A plain ASGI middleware: BaseHTTPMiddleware would cost a task and a stream per request.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = perf_counter()
+        status = "500"
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            request_duration.observe(
+                perf_counter() - started_at,
+                scope["method"],
+                route.path if route is not None else UNMATCHED_ROUTE,
+                status,
+            )
@@ -0,0 +1,190 @@
+"""
+Counters and histograms exposed at /metrics in the Prometheus text format.
+
+Hot paths never take a lock: every thread counts into its own shard, which only that thread writes, and shards are
+summed up when metrics are scraped. Coroutines all run on the event loop thread, so they share one shard.
+"""
+
+from bisect import bisect_left
+from threading import Lock, local
+from time import perf_counter
+from typing import Iterable, Iterator, Literal
+
+from ipdata.services.instrumentation.request_log import current_request
+
+# Upper bounds in seconds, from a cached lookup to a slow upstream call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[str, ...]
+
+
+class ShardedMetric:
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._local = local()
+        self._shards: list[dict[Labels, list]] = []
+        self._lock = Lock()
+
+    def _shard(self) -> dict[Labels, list]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Taken once per thread, shards of finished threads are kept so that counts never go back
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _merged(self) -> dict[Labels, list]:
+        merged: dict[Labels, list] = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # Copying a dict holds the GIL, so a label added meanwhile by the owning thread cannot break the iteration
+            for labels, values in list(shard.items()):
+                total = merged.setdefault(labels, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        return merged
+
+    def _label_string(self, labels: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def clear(self) -> None:
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+class Counter(ShardedMetric):
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = [0]
+        values[0] += amount
+
+    def value(self, *labels: str) -> float:
+        return self._merged().get(labels, [0])[0]
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, values in sorted(self._merged().items()):
+            yield f"{self.name}{self._label_string(labels)} {format_value(values[0])}"
+
+
+class Histogram(ShardedMetric):
+    """
+    Values of a label set are the counts per bucket (not cumulative), the count above the last bucket and the sum.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = [0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def time(self, *labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        values = self._merged().get(labels)
+        return sum(values[:-1]) if values is not None else 0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, values in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], values):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self._label_string(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{self._label_string(labels)} {format_value(values[-1])}"
+            yield f"{self.name}_count{self._label_string(labels)} {cumulative}"
+
+
+class Timer:
+    """
+    Observes the time spent in a with block, also when it raises, and adds it to the timings of the current request.
+    """
+
+    __slots__ = ("_histogram", "_labels", "_started_at")
+
+    def __init__(self, histogram: Histogram, labels: Labels) -> None:
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> None:
+        self._started_at = perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        duration = perf_counter() - self._started_at
+        self._histogram.observe(duration, *self._labels)
+        timings = current_request.get()
+        if timings is not None:
+            timings.add_stage(",".join(self._labels), duration)
+
+
+def render_family(
+    name: str,
+    documentation: str,
+    metric_type: Literal["counter", "gauge"],
+    samples: dict[Labels, float],
+    label_names: Iterable[str] = (),
+) -> str:
+    """
+    Metrics which are not kept here but read from the stats of the components when metrics are scraped.
+    """
+    label_names = tuple(label_names)
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in sorted(samples.items()):
+        pairs = ",".join(f'{label}="{escape(str(v))}"' for label, v in zip(label_names, labels))
+        lines.append(f"{name}{{{pairs}}} {format_value(value)}" if pairs else f"{name} {format_value(value)}")
+    return "\n".join(lines)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+request_duration = Histogram(
+    "ipdata_request_duration_seconds", "Duration of HTTP requests by route and status", ["method", "route", "status"]
+)
+stage_duration = Histogram(
+    "ipdata_stage_duration_seconds",
+    "Time spent in a stage of request handling: database queries, upstream calls and response building",
+    ["stage"],
+)
+upstream_errors = Counter(
+    "ipdata_upstream_errors_total",
+    "Errors of IP data providers by provider and ipstack error code",
+    ["provider", "code"],
+)
+
+METRICS: list[ShardedMetric] = [request_duration, stage_duration, upstream_errors]
+
+
+def render_metrics(*families: str) -> str:
+    return "\n".join([*(line for metric in METRICS for line in metric.render()), *families]) + "\n"
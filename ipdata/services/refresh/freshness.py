@@ -0,0 +1,75 @@
+import random
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Any
+
+from ipdata.settings import Settings, settings
+
+
+def freshness_attributes(config: Settings = settings) -> dict[str, datetime]:
+    """
+    Freshness of data fetched just now: it expires after `ip_data_ttl` seconds, give or take `ip_data_ttl_jitter`
+    of it, so that rows fetched together do not all expire together.
+    """
+    fetched_at = datetime.now(timezone.utc)
+    jitter = random.uniform(-config.ip_data_ttl_jitter, config.ip_data_ttl_jitter)
+    return {"fetched_at": fetched_at, "expires_at": fetched_at + timedelta(seconds=config.ip_data_ttl * (1 + jitter))}
+
+
+def is_stale(expires_at: datetime | None) -> bool:
+    return expires_at is not None and expires_at <= datetime.now(timezone.utc)
+
+
+class RefreshQueue:
+    """
+    IPs whose stale data has been read, refreshed before other stale rows. Duplicates are dropped, and so are
+    new IPs when the queue is full: the background refresher gets to all stale rows eventually anyway.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._ips: dict[str, None] = {}
+        self._lock = Lock()
+        self.dropped = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    def put(self, ip: str) -> None:
+        with self._lock:
+            if ip in self._ips:
+                return
+            if len(self._ips) >= self._max_size:
+                self.dropped += 1
+                return
+            self._ips[ip] = None
+
+    def take(self, limit: int) -> list[str]:
+        with self._lock:
+            ips = list(self._ips)[:limit]
+            for ip in ips:
+                del self._ips[ip]
+            return ips
+
+    def observe_refresh(self, refreshed: int, failed: int) -> None:
+        with self._lock:
+            self.refreshed += refreshed
+            self.failed += failed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ips.clear()
+            self.dropped = self.refreshed = self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._ips)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queued": len(self),
+            "dropped": self.dropped,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
+
+
+refresh_queue = RefreshQueue(settings.refresh_queue_max_size)
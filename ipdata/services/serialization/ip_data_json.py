@@ -0,0 +1,52 @@
+"""
+JSON encoding of GET /ipdata/{ip} responses without building and validating response models.
+
+Stored data was validated when it was written, so responses are encoded straight from rows with orjson,
+and the location part of a response is encoded once per location (see LocationCache.get_json).
+The output is the same JSON FastAPI produces from IPDataReturnSchema.
+"""
+
+from typing import Any, Sequence
+
+import orjson
+from fastapi import Response
+
+from ipdata.schemas.ipdata import IPDataReturnSchema, LocationDataWithSimpleLanguages
+
+IP_DATA_FIELDS = [name for name in IPDataReturnSchema.model_fields if name not in ("ip", "location")]
+
+
+class JSONBytesResponse(Response):
+    """
+    Response of already encoded JSON, which FastAPI neither validates against response_model nor encodes again.
+    """
+
+    media_type = "application/json"
+
+
+def encode_ip_data(ip_data: Any, ip: str, location: bytes) -> bytes:
+    """
+    ip_data is a row, or anything else with the IP data attributes, location the encoded location.
+    ip has to be given, network blocks have no IP of their own.
+    """
+    encoded = orjson.dumps({"ip": ip, **{name: getattr(ip_data, name) for name in IP_DATA_FIELDS}})
+    return b'%s,"location":%s}' % (encoded[:-1], location)
+
+
+def encode_ip_data_values(values: Sequence[Any], ip: str, location: bytes) -> bytes:
+    """
+    encode_ip_data of the values of IP_DATA_FIELDS, in that order.
+    """
+    encoded = orjson.dumps({"ip": ip, **dict(zip(IP_DATA_FIELDS, values))})
+    return b'%s,"location":%s}' % (encoded[:-1], location)
+
+
+def encode_location(location: LocationDataWithSimpleLanguages) -> bytes:
+    return location.__pydantic_serializer__.to_json(location)
+
+
+def encode_ip_data_schema(schema: IPDataReturnSchema) -> bytes:
+    """
+    Responses which are models already (lookup engine, snapshot) are encoded by pydantic, without validation.
+    """
+    return schema.__pydantic_serializer__.to_json(schema)
@@ -0,0 +1,50 @@
+"""
+Export the IP data stored in the database as a snapshot file:
+
+    python -m ipdata.services.snapshot.export ipdata.snapshot
+"""
+
+from argparse import ArgumentParser
+from ipaddress import ip_network
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ipdata.db import get_session
+from ipdata.models.ip_data import IPDataModel, IPRangeModel, LocationModel
+from ipdata.services.snapshot.snapshot_format import SnapshotWriter
+from ipdata.settings import settings
+
+# Rows fetched from the database at once
+EXPORT_BATCH_SIZE = 10000
+
+
+def export_snapshot(db: Session, path: str, include_ranges: bool = False) -> None:
+    writer = SnapshotWriter()
+    locations = {location.id: location for location in db.query(LocationModel)}
+
+    # Network blocks go first, so that a host stored also as a /32 or /128 block is answered from its own row
+    if include_ranges:
+        for ip_range in db.execute(select(*IPRangeModel.__table__.columns)).yield_per(EXPORT_BATCH_SIZE):
+            writer.add(ip_network(ip_range.network), ip_range, locations[ip_range.location_id])
+
+    for ip_data in db.execute(select(*IPDataModel.__table__.columns)).yield_per(EXPORT_BATCH_SIZE):
+        writer.add(ip_network(ip_data.ip), ip_data, locations[ip_data.location_id])
+
+    writer.write(path)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Export the IP data stored in the database as a snapshot file")
+    parser.add_argument("path", nargs="?", default=settings.snapshot_path)
+    args = parser.parse_args()
+
+    db = get_session()
+    try:
+        export_snapshot(db, args.path, include_ranges=settings.range_store_enabled)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
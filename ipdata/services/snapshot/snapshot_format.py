@@ -0,0 +1,201 @@
+"""
+Read-only binary snapshot of the IP data, laid out to be memory mapped and queried in place.
+
+All numbers are little endian. The file starts with HEADER followed by one SECTION entry per section:
+- strings: every distinct string once, as an u32 length followed by UTF-8 bytes. Strings are referenced
+  by their offset in this section, NULL_STRING means None.
+- locations: fixed size LOCATION entries.
+- records: fixed size RECORD entries (IP data attributes without the IP), deduplicated, so all addresses
+  with the same answer share one record. None floats are stored as NaN.
+- ipv4 / ipv6 index: INDEX_V4 / INDEX_V6 entries sorted by start address, one per disjoint address range.
+  Nested networks are flattened into disjoint ranges up front, so a lookup is a single binary search.
+"""
+
+import os
+from ipaddress import IPv4Network, IPv6Network
+from math import isnan, nan
+from struct import Struct
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import Any, Iterable, Iterator
+
+MAGIC = b"IPDSNAP\x00"
+FORMAT_VERSION = 1
+NULL_STRING = 0xFFFFFFFF
+
+SECTIONS = ("strings", "locations", "records", "ipv4", "ipv6")
+HEADER = Struct("<8sIId")
+SECTION = Struct("<QQ")
+STRING_LENGTH = Struct("<I")
+LOCATION = Struct("<I6IB3x")
+RECORD = Struct("<13I3dI")
+INDEX_V4 = Struct("<III")
+INDEX_V6 = Struct("<16s16sI")
+
+LOCATION_STRING_FIELDS = (
+    "capital",
+    "languages",
+    "country_flag",
+    "country_flag_emoji",
+    "country_flag_emoji_unicode",
+    "calling_code",
+)
+RECORD_STRING_FIELDS = (
+    "type",
+    "continent_code",
+    "continent_name",
+    "country_code",
+    "country_name",
+    "region_code",
+    "region_name",
+    "city",
+    "zip",
+    "msa",
+    "dma",
+    "ip_routing_type",
+    "connection_type",
+)
+RECORD_FLOAT_FIELDS = ("latitude", "longitude", "radius")
+
+
+class SnapshotFormatError(Exception):
+    pass
+
+
+def flatten_networks(networks: Iterable[tuple[int, int, int]]) -> Iterator[tuple[int, int, int]]:
+    """
+    Turn (first address, last address, record) networks, which are either nested or disjoint, into disjoint
+    (start, end, record) ranges where the most specific network wins. Adjacent ranges of one record are merged.
+    """
+    stack: list[tuple[int, int]] = []
+    pending: list[int] | None = None
+    cursor = 0
+
+    def emit(start: int, end: int, record: int) -> Iterator[tuple[int, int, int]]:
+        nonlocal pending
+        if start > end:
+            return
+        if pending is not None and pending[1] + 1 == start and pending[2] == record:
+            pending[1] = end
+            return
+        if pending is not None:
+            yield tuple(pending)
+        pending = [start, end, record]
+
+    # Wider networks first, so that nested ones end up above them on the stack
+    for first, last, record in sorted(networks, key=lambda network: (network[0], -network[1])):
+        while stack and stack[-1][0] < first:
+            end, outer_record = stack.pop()
+            yield from emit(cursor, end, outer_record)
+            cursor = end + 1
+        if stack:
+            yield from emit(cursor, first - 1, stack[-1][1])
+        cursor = first
+        stack.append((last, record))
+
+    while stack:
+        end, record = stack.pop()
+        yield from emit(cursor, end, record)
+        cursor = end + 1
+    if pending is not None:
+        yield tuple(pending)
+
+
+class SnapshotWriter:
+    """
+    Collects IP data and writes it as a snapshot file. Strings, locations and records are deduplicated.
+    """
+
+    def __init__(self) -> None:
+        self._strings = bytearray()
+        self._string_offsets: dict[str, int] = {}
+        self._locations = bytearray()
+        self._location_ids: dict[int, int] = {}
+        self._records = bytearray()
+        self._record_ids: dict[bytes, int] = {}
+        self._networks: dict[int, list[tuple[int, int, int]]] = {4: [], 6: []}
+
+    def add(self, network: IPv4Network | IPv6Network, attributes: Any, location: Any) -> None:
+        """
+        attributes and location are objects with the IP data / location attributes, e.g. database rows.
+        A host is added as a /32 or /128 network.
+        """
+        location_id = self._add_location(location)
+        record = RECORD.pack(
+            *(self._add_string(getattr(attributes, field)) for field in RECORD_STRING_FIELDS),
+            *(
+                nan if getattr(attributes, field) is None else getattr(attributes, field)
+                for field in RECORD_FLOAT_FIELDS
+            ),
+            location_id,
+        )
+        record_id = self._record_ids.get(record)
+        if record_id is None:
+            record_id = self._record_ids[record] = len(self._record_ids)
+            self._records += record
+
+        self._networks[network.version].append(
+            (int(network.network_address), int(network.broadcast_address), record_id)
+        )
+
+    def write(self, path: str) -> None:
+        """
+        Write the snapshot next to path and move it in place, so that readers never see a partial file.
+        """
+        ipv4 = b"".join(INDEX_V4.pack(*entry) for entry in flatten_networks(self._networks[4]))
+        ipv6 = b"".join(
+            INDEX_V6.pack(start.to_bytes(16, "big"), end.to_bytes(16, "big"), record)
+            for start, end, record in flatten_networks(self._networks[6])
+        )
+        sections = (
+            (self._strings, len(self._string_offsets)),
+            (self._locations, len(self._location_ids)),
+            (self._records, len(self._record_ids)),
+            (ipv4, len(ipv4) // INDEX_V4.size),
+            (ipv6, len(ipv6) // INDEX_V6.size),
+        )
+
+        directory = os.path.dirname(os.path.abspath(path))
+        with NamedTemporaryFile("wb", dir=directory, delete=False) as file:
+            try:
+                file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), time()))
+                offset = HEADER.size + SECTION.size * len(sections)
+                for data, count in sections:
+                    file.write(SECTION.pack(offset, count))
+                    offset += len(data)
+                for data, _ in sections:
+                    file.write(data)
+            except BaseException:
+                os.unlink(file.name)
+                raise
+        # Temporary files are private, the snapshot is meant to be shipped and read by other users
+        os.chmod(file.name, 0o644)
+        os.replace(file.name, path)
+
+    def _add_string(self, value: str | None) -> int:
+        if value is None:
+            return NULL_STRING
+        offset = self._string_offsets.get(value)
+        if offset is None:
+            encoded = value.encode()
+            offset = self._string_offsets[value] = len(self._strings)
+            self._strings += STRING_LENGTH.pack(len(encoded)) + encoded
+        return offset
+
+    def _add_location(self, location: Any) -> int:
+        location_id = self._location_ids.get(location.geoname_id)
+        if location_id is None:
+            if location.is_eu is None:
+                # Only a boolean fits the entry, and the API could not answer with such a location either
+                raise SnapshotFormatError(f"Location {location.geoname_id} has no is_eu value")
+            location_id = self._location_ids[location.geoname_id] = len(self._location_ids)
+            self._locations += LOCATION.pack(
+                location.geoname_id,
+                *(self._add_string(getattr(location, field)) for field in LOCATION_STRING_FIELDS),
+                location.is_eu,
+            )
+        return location_id
+
+
+def float_or_none(value: float) -> float | None:
+    return None if isnan(value) else value
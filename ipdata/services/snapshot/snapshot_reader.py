@@ -0,0 +1,138 @@
+import mmap
+from ipaddress import IPv4Address, IPv6Address, ip_address
+from struct import Struct
+from typing import Any
+
+from pydantic import IPvAnyAddress
+
+from ipdata.schemas.ipdata import IPDataReturnSchema, LocationDataWithSimpleLanguages
+from ipdata.services.snapshot.snapshot_format import (
+    FORMAT_VERSION,
+    HEADER,
+    INDEX_V4,
+    INDEX_V6,
+    LOCATION,
+    LOCATION_STRING_FIELDS,
+    MAGIC,
+    NULL_STRING,
+    RECORD,
+    RECORD_FLOAT_FIELDS,
+    RECORD_STRING_FIELDS,
+    SECTION,
+    SECTIONS,
+    STRING_LENGTH,
+    SnapshotFormatError,
+    float_or_none,
+)
+
+
+class IPDataSnapshot:
+    """
+    Memory mapped snapshot file. Opening it only reads the header, lookups binary search the index in place
+    and decode just the matched record.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, section_count, self.created_at = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC or version != FORMAT_VERSION or section_count != len(SECTIONS):
+                raise SnapshotFormatError(f"{path} is not a version {FORMAT_VERSION} IP data snapshot")
+            self._sections = {
+                name: SECTION.unpack_from(self._mmap, HEADER.size + SECTION.size * i) for i, name in enumerate(SECTIONS)
+            }
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def get(self, ip: IPvAnyAddress | str) -> IPDataReturnSchema | None:
+        address = ip if isinstance(ip, (IPv4Address, IPv6Address)) else ip_address(str(ip))
+        if address.version == 4:
+            record_id = self._find("ipv4", INDEX_V4, int(address))
+        else:
+            record_id = self._find("ipv6", INDEX_V6, address.packed)
+        if record_id is None:
+            return None
+        return self._record_to_schema(address, record_id)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "path": self.path,
+            "created_at": self.created_at,
+            "size": len(self._mmap),
+            **{name: count for name, (_, count) in self._sections.items()},
+        }
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def _find(self, section: str, entry: Struct, key: int | bytes) -> int | None:
+        """
+        Binary search for the last range starting at or before key.
+        """
+        offset, count = self._sections[section]
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if entry.unpack_from(self._mmap, offset + middle * entry.size)[0] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+
+        _, end, record_id = entry.unpack_from(self._mmap, offset + (low - 1) * entry.size)
+        return record_id if key <= end else None
+
+    def _record_to_schema(self, address: IPv4Address | IPv6Address, record_id: int) -> IPDataReturnSchema:
+        offset, _ = self._sections["records"]
+        *values, location_id = RECORD.unpack_from(self._mmap, offset + record_id * RECORD.size)
+        strings = values[: len(RECORD_STRING_FIELDS)]
+        floats = values[len(RECORD_STRING_FIELDS) :]
+        return IPDataReturnSchema(
+            ip=address,
+            **{field: self._string(value) for field, value in zip(RECORD_STRING_FIELDS, strings)},
+            **{field: float_or_none(value) for field, value in zip(RECORD_FLOAT_FIELDS, floats)},
+            location=self._location(location_id),
+        )
+
+    def _location(self, location_id: int) -> LocationDataWithSimpleLanguages:
+        offset, _ = self._sections["locations"]
+        geoname_id, *strings, is_eu = LOCATION.unpack_from(self._mmap, offset + location_id * LOCATION.size)
+        location = {field: self._string(value) for field, value in zip(LOCATION_STRING_FIELDS, strings)}
+        location["languages"] = location["languages"].split(";")
+        return LocationDataWithSimpleLanguages(geoname_id=geoname_id, is_eu=bool(is_eu), **location)
+
+    def _string(self, string_offset: int) -> str | None:
+        if string_offset == NULL_STRING:
+            return None
+        offset = self._sections["strings"][0] + string_offset
+        (length,) = STRING_LENGTH.unpack_from(self._mmap, offset)
+        start = offset + STRING_LENGTH.size
+        return str(self._mmap[start : start + length], "utf-8")
+
+
+_snapshot: IPDataSnapshot | None = None
+
+
+def init_snapshot(path: str) -> IPDataSnapshot:
+    global _snapshot
+
+    if _snapshot is None:
+        _snapshot = IPDataSnapshot(path)
+    return _snapshot
+
+
+def dispose_snapshot() -> None:
+    global _snapshot
+
+    if _snapshot is not None:
+        _snapshot.close()
+    _snapshot = None
+
+
+def get_snapshot() -> IPDataSnapshot | None:
+    return _snapshot
@@ -5,6 +5,9 @@ from sqlalchemy.orm import sessionmaker
 
 from ipdata.app.main import app
 from ipdata.db import Base
+from ipdata.services.cache.ip_data_cache import ip_data_cache
+from ipdata.services.cache.location_cache import location_cache
+from ipdata.services.refresh.freshness import refresh_queue
 from ipdata.settings import settings
 
 
@@ -12,10 +15,25 @@ from ipdata.settings import settings
 def db_init(engine):
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    ip_data_cache.clear()
+    location_cache.clear()
+    refresh_queue.clear()
+
+
+@pytest.fixture(autouse=True)
+def no_job_workers(monkeypatch) -> None:
+    # Jobs are processed explicitly by the tests, background workers would race with them
+    monkeypatch.setattr(settings, "job_workers", 0)
+
+
+@pytest.fixture(params=[False, True], ids=["sync", "async"])
+def async_mode(request, monkeypatch) -> bool:
+    monkeypatch.setattr(settings, "async_mode", request.param)
+    return request.param
 
 
 @pytest.fixture
-def alice():
+def alice(async_mode):
     with TestClient(app) as client:
         yield client
 
@@ -0,0 +1,10 @@
+class FakeClock:
+    """
+    Clock which only moves when a test moves it, passed where a time() callable is expected.
+    """
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
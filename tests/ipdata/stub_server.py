@@ -0,0 +1,53 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from typing import Any
+
+from furl import furl
+
+
+class StubIPProvider:
+    """
+    Local HTTP server answering every GET with the same JSON body after `delay` seconds.
+    """
+
+    def __init__(self, body: dict[str, Any], status_code: int = 200, delay: float = 0.0) -> None:
+        self.body = body
+        self.status_code = status_code
+        self.delay = delay
+        self.paths: list[str] = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> furl:
+        host, port = self._server.server_address
+        return furl(f"http://{host}:{port}/")
+
+    def __enter__(self) -> "StubIPProvider":
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                stub.paths.append(self.path)
+                sleep(stub.delay)
+                content = json.dumps(stub.body).encode()
+                self.send_response(stub.status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
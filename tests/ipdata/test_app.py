@@ -1,17 +1,23 @@
+from contextlib import contextmanager
 from http import HTTPStatus
-from typing import Any
+from typing import Any, Iterator
 
 import pytest
 from fastapi.testclient import TestClient
 from requests import Response
+from sqlalchemy import Engine, event
 from sqlalchemy.orm import Session
 
+from ipdata.app.utils import get_ip_data_by_ips, get_location
 from ipdata.models.ip_data import IPDataModel, LocationModel
+from ipdata.services.cache.ip_data_cache import ip_data_cache
+from ipdata.services.cache.location_cache import location_cache
 from ipdata.services.ip_client.data import IPData
 from ipdata.services.ip_client.exceptions import IpStackException
 from tests.ipdata.responses import RESPONSE_OK, RESPONSE_OK2
 
 BASIC_IP_ADDRESS = "172.68.213.129"
+MANUAL_LOCATION = {**RESPONSE_OK["location"], "languages": ["cs", "sk"]}
 
 
 def when_user_create_ip_data(client: TestClient, ip_address: str) -> Response:
@@ -34,6 +40,25 @@ def when_user_create_ip_data_manually(client: TestClient, request_body: dict[str
     return response
 
 
+def given_ip_stack_client_returns(mocker, **kwargs) -> None:
+    mocker.patch("ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", **kwargs)
+    mocker.patch("ipdata.services.ip_client.ip_stack_client.AsyncIPStackClient.get_ip_data", **kwargs)
+
+
+@contextmanager
+def count_queries() -> Iterator[list[str]]:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+
 def then_response_should_be(res_status: HTTPStatus, res: Response) -> None:
     assert res.status_code == res_status, res.text
 
@@ -46,7 +71,7 @@ def then_response_should_be(res_status: HTTPStatus, res: Response) -> None:
     ],
 )
 def test_create_ip_data(alice: TestClient, db_session, ip: str, api_stack_response: IPData, mocker):
-    mocker.patch("ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", return_value=api_stack_response)
+    given_ip_stack_client_returns(mocker, return_value=api_stack_response)
     res = when_user_create_ip_data(alice, ip_address=ip)
 
     then_response_should_be(HTTPStatus.OK, res)
@@ -61,7 +86,7 @@ def test_create_ip_data_with_incorrect_ip_should_raise_error(alice: TestClient,
 
 def test_create_ip_data_with_ip_already_exists_in_db_should_raise_error(alice: TestClient, db_session, mocker):
     ip_stack_response = IPData(**RESPONSE_OK)
-    mocker.patch("ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", return_value=ip_stack_response)
+    given_ip_stack_client_returns(mocker, return_value=ip_stack_response)
 
     res1 = when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS)
     then_response_should_be(HTTPStatus.OK, res1)
@@ -71,8 +96,8 @@ def test_create_ip_data_with_ip_already_exists_in_db_should_raise_error(alice: T
 
 
 def test_create_ip_data_with_ip_no_info_should_raise_bad_request(alice: TestClient, mocker):
-    mocker.patch(
-        "ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data",
+    given_ip_stack_client_returns(
+        mocker,
         side_effect=IpStackException(code=999, err_type="no_ip_info", info="This IP address does not have any info."),
     )
 
@@ -82,7 +107,7 @@ def test_create_ip_data_with_ip_no_info_should_raise_bad_request(alice: TestClie
 
 def test_created_ip_data_record_should_have_proper_values_in_db(db_api: Session, alice, mocker):
     ip_stack_response = IPData(**RESPONSE_OK)
-    mocker.patch("ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", return_value=ip_stack_response)
+    given_ip_stack_client_returns(mocker, return_value=ip_stack_response)
 
     res = when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS)
     then_response_should_be(HTTPStatus.OK, res)
@@ -126,9 +151,7 @@ def test_create_two_ips_data_records_should_have_the_same_location_record_in_db(
 ) -> None:
     for response in [RESPONSE_OK, RESPONSE_OK2]:
         ip_stack_response = IPData(**response)
-        mocker.patch(
-            "ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", return_value=ip_stack_response
-        )
+        given_ip_stack_client_returns(mocker, return_value=ip_stack_response)
 
         res = when_user_create_ip_data(alice, ip_address=str(ip_stack_response.ip))
         then_response_should_be(HTTPStatus.OK, res)
@@ -144,7 +167,7 @@ def test_get_ip_data_by_ip_should_return_none_if_ip_not_exists_in_db(alice: Test
 
 def test_get_ip_data_by_ip_should_return_proper_data_if_ip_exists_in_db(alice: TestClient, mocker) -> None:
     ip_stack_response = IPData(**RESPONSE_OK)
-    mocker.patch("ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", return_value=ip_stack_response)
+    given_ip_stack_client_returns(mocker, return_value=ip_stack_response)
 
     res1 = when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS)
     then_response_should_be(HTTPStatus.OK, res1)
@@ -192,7 +215,7 @@ def test_delete_ip_data_by_ip_should_return_ok_response_if_ip_was_in_db_and_remo
     alice: TestClient, db_api: Session, mocker
 ) -> None:
     ip_stack_response = IPData(**RESPONSE_OK)
-    mocker.patch("ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", return_value=ip_stack_response)
+    given_ip_stack_client_returns(mocker, return_value=ip_stack_response)
 
     res1 = when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS)
     then_response_should_be(HTTPStatus.OK, res1)
@@ -214,9 +237,7 @@ def test_delete_ip_data_by_ip_should_remove_only_one_location_record_if_two_ips_
 ) -> None:
     for response in [RESPONSE_OK, RESPONSE_OK2]:
         ip_stack_response = IPData(**response)
-        mocker.patch(
-            "ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data", return_value=ip_stack_response
-        )
+        given_ip_stack_client_returns(mocker, return_value=ip_stack_response)
 
         res = when_user_create_ip_data(alice, ip_address=str(ip_stack_response.ip))
         then_response_should_be(HTTPStatus.OK, res)
@@ -280,3 +301,70 @@ def test_create_ip_data_manually_with_proper_request_body_should_add_ip_to_db(
     res = when_user_create_ip_data_manually(alice, request_body=request_body)
 
     then_response_should_be(HTTPStatus.OK, res)
+
+
+def test_create_ip_data_manually_should_store_languages_as_string(alice: TestClient, db_api: Session) -> None:
+    request_body = {**RESPONSE_OK, "location": {**RESPONSE_OK["location"], "languages": ["cs", "sk"]}}
+
+    res = when_user_create_ip_data_manually(alice, request_body=request_body)
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["location"]["languages"] == ["cs", "sk"]
+
+    assert db_api.query(LocationModel).one().languages == "cs;sk"
+
+
+@pytest.mark.parametrize("location_cached, expected_statements", [(True, 1), (False, 2)], ids=["warm", "cold"])
+def test_get_ip_data_should_read_location_from_location_cache(
+    alice: TestClient, mocker, location_cached: bool, expected_statements: int
+) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS))
+    ip_data_cache.clear()
+    if not location_cached:
+        location_cache.clear()
+
+    with count_queries() as statements:
+        res = when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS)
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["location"]["geoname_id"] == RESPONSE_OK["location"]["geoname_id"]
+    assert len(statements) == expected_statements
+
+
+def test_get_ip_data_by_ips_should_resolve_many_ips_in_one_query(alice: TestClient, db_api: Session, mocker) -> None:
+    for response in [RESPONSE_OK, RESPONSE_OK2]:
+        given_ip_stack_client_returns(mocker, return_value=IPData(**response))
+        then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=response["ip"]))
+
+    with count_queries() as statements:
+        ip_data = get_ip_data_by_ips(db_api, [RESPONSE_OK["ip"], RESPONSE_OK2["ip"], "10.0.0.1"])
+        geoname_ids = {get_location(db_api, entity.location_id).geoname_id for entity in ip_data.values()}
+
+    assert set(ip_data) == {RESPONSE_OK["ip"], RESPONSE_OK2["ip"]}
+    assert geoname_ids == {RESPONSE_OK["location"]["geoname_id"]}
+    assert len(statements) == 1
+
+
+def test_create_ip_data_manually_should_store_location_and_ip_data_in_two_statements(
+    alice: TestClient, db_api: Session
+) -> None:
+    with count_queries() as statements:
+        res = when_user_create_ip_data_manually(alice, request_body={**RESPONSE_OK, "location": MANUAL_LOCATION})
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert len(statements) == 2
+    assert all("ON CONFLICT" in statement for statement in statements)
+
+
+def test_create_ip_data_manually_with_ip_already_exists_in_db_should_raise_error_and_keep_data(
+    alice: TestClient, db_api: Session
+) -> None:
+    request_body = {**RESPONSE_OK, "location": MANUAL_LOCATION}
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data_manually(alice, request_body=request_body))
+
+    res = when_user_create_ip_data_manually(alice, request_body={**request_body, "city": "Brno"})
+
+    then_response_should_be(HTTPStatus.BAD_REQUEST, res)
+    assert res.json()["detail"] == "IP already exists in the database"
+    assert db_api.query(IPDataModel).one().city == RESPONSE_OK["city"]
+    assert db_api.query(LocationModel).count() == 1
@@ -0,0 +1,202 @@
+import json
+from http import HTTPStatus
+from threading import Lock
+from time import sleep
+from typing import Any, Callable
+
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy.orm import Session
+
+from ipdata.app.utils import save_ip_data_batch
+from ipdata.models.ip_data import IPDataModel, LocationModel
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.exceptions import IpStackException
+from ipdata.services.ip_client.fan_out import fetch_ip_data_batch
+from ipdata.services.ip_client.ip_stack_client import IP_STACK_BULK_LIMIT
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK, RESPONSE_OK2
+from tests.ipdata.test_app import (
+    count_queries,
+    given_ip_stack_client_returns,
+    then_response_should_be,
+    when_user_create_ip_data,
+)
+
+
+def when_user_get_ip_data_batch(client: TestClient, ips: list[str], **params: Any) -> Response:
+    return client.post("/ipdata/batch", json={"ips": ips}, params=params)
+
+
+def given_ip_data_in_db(client: TestClient, mocker, *responses: dict[str, Any]) -> None:
+    for response in responses:
+        given_ip_stack_client_returns(mocker, return_value=IPData(**response))
+        then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(client, ip_address=response["ip"]))
+
+
+def test_batch_should_return_found_and_not_found_ips(alice: TestClient, mocker) -> None:
+    given_ip_data_in_db(alice, mocker, RESPONSE_OK, RESPONSE_OK2)
+
+    res = when_user_get_ip_data_batch(alice, [RESPONSE_OK["ip"], "10.0.0.1", RESPONSE_OK2["ip"], "2001:db8::1"])
+
+    then_response_should_be(HTTPStatus.OK, res)
+    body = res.json()
+    assert [result["ip"] for result in body["results"]] == [RESPONSE_OK["ip"], RESPONSE_OK2["ip"]]
+    assert body["results"][0]["location"]["languages"] == ["cs", "sk"]
+    assert body["not_found"] == ["10.0.0.1", "2001:db8::1"]
+
+
+def test_batch_should_deduplicate_ips_and_use_one_query(alice: TestClient, mocker) -> None:
+    given_ip_data_in_db(alice, mocker, RESPONSE_OK)
+
+    with count_queries() as statements:
+        res = when_user_get_ip_data_batch(
+            alice, [RESPONSE_OK["ip"], RESPONSE_OK["ip"], "2001:DB8::1", "2001:db8:0::1", "10.0.0.1"]
+        )
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert len(res.json()["results"]) == 1
+    assert res.json()["not_found"] == ["2001:db8::1", "10.0.0.1"]
+    assert len(statements) == 1
+
+
+def test_batch_should_stream_ndjson(alice: TestClient, mocker) -> None:
+    given_ip_data_in_db(alice, mocker, RESPONSE_OK)
+
+    res = when_user_get_ip_data_batch(alice, [RESPONSE_OK["ip"], "10.0.0.1"], stream=True)
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert lines[0]["ip"] == RESPONSE_OK["ip"]
+    assert lines[0]["city"] == RESPONSE_OK["city"]
+    assert lines[1] == {"ip": "10.0.0.1", "detail": "IP not found in the database"}
+
+
+def test_batch_larger_than_max_size_should_be_rejected(alice: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "batch_max_size", 2)
+
+    res = when_user_get_ip_data_batch(alice, ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+    then_response_should_be(HTTPStatus.UNPROCESSABLE_CONTENT, res)
+    assert "at most 2 IP addresses" in res.text
+
+
+def test_batch_should_be_limited_before_duplicates_are_removed(alice: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "batch_max_size", 2)
+
+    res = when_user_get_ip_data_batch(alice, ["10.0.0.1", "10.0.0.1", "10.0.0.1"])
+
+    then_response_should_be(HTTPStatus.UNPROCESSABLE_CONTENT, res)
+
+
+def test_empty_batch_should_be_rejected(alice: TestClient) -> None:
+    res = when_user_get_ip_data_batch(alice, [])
+
+    then_response_should_be(HTTPStatus.UNPROCESSABLE_CONTENT, res)
+
+
+def when_user_enrich_ip_data_batch(client: TestClient, ips: list[str]) -> Response:
+    return client.post("/ipdata/batch/enrich", json={"ips": ips})
+
+
+def ip_stack_responses_by_ip(*responses: dict[str, Any]) -> Callable[[str], IPData]:
+    by_ip = {response["ip"]: response for response in responses}
+
+    def get_ip_data(ip: str) -> IPData:
+        if ip not in by_ip:
+            raise IpStackException(code=106, err_type="invalid_ip_address", info="The IP Address supplied is invalid.")
+        return IPData(**by_ip[ip])
+
+    return get_ip_data
+
+
+def test_enrich_batch_should_create_missing_ips_and_report_errors(alice: TestClient, db_api: Session, mocker) -> None:
+    given_ip_data_in_db(alice, mocker, RESPONSE_OK)
+    given_ip_stack_client_returns(mocker, side_effect=ip_stack_responses_by_ip(RESPONSE_OK, RESPONSE_OK2))
+
+    res = when_user_enrich_ip_data_batch(alice, [RESPONSE_OK["ip"], RESPONSE_OK2["ip"], "10.0.0.1"])
+
+    then_response_should_be(HTTPStatus.OK, res)
+    body = res.json()
+    assert [result["ip"] for result in body["created"]] == [RESPONSE_OK2["ip"]]
+    assert body["existing"] == [RESPONSE_OK["ip"]]
+    assert body["errors"] == [
+        {"ip": "10.0.0.1", "status_code": HTTPStatus.BAD_REQUEST, "detail": "Invalid IP address or domain"}
+    ]
+    assert db_api.query(IPDataModel).count() == 2
+    assert db_api.query(LocationModel).count() == 1
+
+    res = when_user_get_ip_data_batch(alice, [RESPONSE_OK["ip"], RESPONSE_OK2["ip"]])
+    assert res.json()["not_found"] == []
+
+
+def test_enrich_batch_should_report_ips_created_meanwhile_as_existing(
+    alice: TestClient, db_api: Session, mocker
+) -> None:
+    get_ip_data = ip_stack_responses_by_ip(RESPONSE_OK, RESPONSE_OK2)
+
+    def get_ip_data_created_meanwhile(ip: str) -> IPData:
+        ip_data = get_ip_data(ip)
+        if ip == RESPONSE_OK2["ip"]:
+            # Another request creates the IP after the batch found it missing
+            save_ip_data_batch(db_api, [ip_data])
+        return ip_data
+
+    given_ip_stack_client_returns(mocker, side_effect=get_ip_data_created_meanwhile)
+
+    res = when_user_enrich_ip_data_batch(alice, [RESPONSE_OK["ip"], RESPONSE_OK2["ip"]])
+
+    then_response_should_be(HTTPStatus.OK, res)
+    body = res.json()
+    assert [result["ip"] for result in body["created"]] == [RESPONSE_OK["ip"]]
+    assert body["existing"] == [RESPONSE_OK2["ip"]]
+    assert body["errors"] == []
+    assert db_api.query(IPDataModel).count() == 2
+
+
+class FakeBulkIPStackClient:
+    def __init__(self, *responses: dict[str, Any]) -> None:
+        self._get_ip_data = ip_stack_responses_by_ip(*responses)
+        self._lock = Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.bulk_calls: list[list[str]] = []
+
+    def get_ip_data(self, ip: str) -> IPData:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        sleep(0.01)
+        with self._lock:
+            self.in_flight -= 1
+        return self._get_ip_data(ip)
+
+    def get_ip_data_bulk(self, ips: list[str]) -> dict[str, IPData | IpStackException]:
+        self.bulk_calls.append(ips)
+        if "10.0.0.1" in ips:
+            raise IpStackException(code=104, err_type="usage_limit_reached", info="Monthly limit reached")
+        return {ip: self._get_ip_data(ip) for ip in ips}
+
+
+def test_fetch_ip_data_batch_should_limit_concurrency() -> None:
+    client = FakeBulkIPStackClient(RESPONSE_OK, RESPONSE_OK2)
+    ips = [RESPONSE_OK["ip"], RESPONSE_OK2["ip"]] + [f"10.0.1.{i}" for i in range(10)]
+
+    results = fetch_ip_data_batch(client, ips, concurrency=3)
+
+    assert isinstance(results[RESPONSE_OK["ip"]], IPData)
+    assert results["10.0.1.0"].code == 106
+    assert len(results) == len(ips)
+    assert 1 < client.max_in_flight <= 3
+
+
+def test_fetch_ip_data_batch_should_use_bulk_lookup_in_chunks() -> None:
+    client = FakeBulkIPStackClient(RESPONSE_OK, RESPONSE_OK2)
+    ips = [f"10.0.0.{i}" for i in range(IP_STACK_BULK_LIMIT)] + [RESPONSE_OK["ip"], RESPONSE_OK2["ip"]]
+
+    results = fetch_ip_data_batch(client, ips, concurrency=2, bulk=True)
+
+    assert sorted(len(chunk) for chunk in client.bulk_calls) == [2, IP_STACK_BULK_LIMIT]
+    assert isinstance(results[RESPONSE_OK["ip"]], IPData)
+    assert all(results[f"10.0.0.{i}"].code == 104 for i in range(IP_STACK_BULK_LIMIT))
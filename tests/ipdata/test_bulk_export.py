@@ -0,0 +1,99 @@
+import gzip
+import json
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any
+
+import zstandard
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy import Engine
+
+from ipdata.services.bulk_export.exporter import ExportWriter, export_chunks, export_query
+from ipdata.services.bulk_import.importer import import_file
+from tests.ipdata.test_app import (
+    then_response_should_be,
+    when_user_delete_ip_data_by_ip,
+    when_user_get_ip_data_by_ip,
+)
+from tests.ipdata.test_bulk_import import OTHER_LOCATION, given_dump, ip_record
+from tests.ipdata.test_range import given_ips_in_db
+
+IPS = ["10.0.0.1", "10.0.0.2", "10.1.0.1", "2001:db8::1"]
+
+
+def when_user_export_ip_data(client: TestClient, **params: Any) -> Response:
+    return client.get("/ipdata/export", params=params)
+
+
+def then_exported_ips_should_be(res: Response, ips: list[str]) -> None:
+    then_response_should_be(HTTPStatus.OK, res)
+    assert [json.loads(line)["ip"] for line in res.text.splitlines()] == ips
+
+
+def test_export_should_stream_records_as_api_returns_them(alice: TestClient) -> None:
+    given_ips_in_db(alice, list(reversed(IPS)))
+
+    res = when_user_export_ip_data(alice)
+
+    then_exported_ips_should_be(res, IPS)
+    assert res.headers["content-type"] == "application/x-ndjson"
+    for line in res.text.splitlines():
+        record = json.loads(line)
+        assert record == when_user_get_ip_data_by_ip(alice, record["ip"]).json()
+
+
+def test_export_should_filter_by_network_and_country_and_resume_after_cursor(alice: TestClient) -> None:
+    given_ips_in_db(alice, IPS)
+
+    then_exported_ips_should_be(when_user_export_ip_data(alice, network="10.0.0.0/16"), IPS[:2])
+    then_exported_ips_should_be(when_user_export_ip_data(alice, country_code="cz", after="10.0.0.2", limit=1), IPS[2:3])
+    then_exported_ips_should_be(when_user_export_ip_data(alice, after="10.1.0.1"), IPS[3:])
+    then_exported_ips_should_be(when_user_export_ip_data(alice, country_code="SK"), [])
+
+
+def test_export_should_compress_on_the_wire(alice: TestClient) -> None:
+    given_ips_in_db(alice, IPS)
+
+    for compression in ["gzip", "zstd"]:
+        res = when_user_export_ip_data(alice, compression=compression)
+
+        assert res.headers["content-encoding"] == compression
+        then_exported_ips_should_be(res, IPS)
+
+
+def test_columnar_export_should_return_chunks_with_resume_cursor(alice: TestClient) -> None:
+    given_ips_in_db(alice, IPS)
+
+    res = when_user_export_ip_data(alice, format="columnar", network="10.0.0.0/8")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    chunk = json.loads(res.text)
+    assert chunk["rows"] == 3
+    assert chunk["columns"]["ip"] == IPS[:3]
+    assert chunk["columns"]["location.languages"] == ["cs;sk"] * 3
+    assert chunk["next_cursor"] == "10.1.0.1"
+
+
+def test_csv_export_should_be_importable(engine: Engine, alice: TestClient, tmp_path: Path) -> None:
+    import_file(
+        engine, given_dump(tmp_path / "dump.jsonl", ip_record(IPS[0]), ip_record(IPS[1], location=OTHER_LOCATION))
+    )
+    exported = b"".join(export_chunks(engine, export_query(), ExportWriter("csv", "gzip")))
+    (tmp_path / "export.csv").write_bytes(gzip.decompress(exported))
+    expected = [when_user_get_ip_data_by_ip(alice, ip).json() for ip in IPS[:2]]
+
+    for ip in IPS[:2]:
+        then_response_should_be(HTTPStatus.OK, when_user_delete_ip_data_by_ip(alice, ip))
+    import_file(engine, str(tmp_path / "export.csv"))
+
+    assert [when_user_get_ip_data_by_ip(alice, ip).json() for ip in IPS[:2]] == expected
+
+
+def test_zstd_export_should_be_a_single_frame(engine: Engine, alice: TestClient) -> None:
+    given_ips_in_db(alice, IPS)
+
+    exported = b"".join(export_chunks(engine, export_query(), ExportWriter("ndjson", "zstd")))
+
+    lines = zstandard.ZstdDecompressor().decompressobj().decompress(exported).splitlines()
+    assert [json.loads(line)["ip"] for line in lines] == IPS
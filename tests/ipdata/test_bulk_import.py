@@ -0,0 +1,140 @@
+import csv
+import json
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+from ipdata.models.ip_data import IPDataModel, LocationModel
+from ipdata.services.bulk_import.importer import ImportProgress, import_file
+from tests.ipdata.responses import RESPONSE_OK2
+from tests.ipdata.test_app import when_user_get_ip_data_by_ip
+from tests.ipdata.test_range import MANUAL_REQUEST_BODY, given_ips_in_db
+
+OTHER_LOCATION = {**MANUAL_REQUEST_BODY["location"], "geoname_id": 3078610, "capital": "Brno"}
+
+
+def given_dump(path: Path, *records: dict | str) -> str:
+    path.write_text("".join((record if isinstance(record, str) else json.dumps(record)) + "\n" for record in records))
+    return str(path)
+
+
+def given_csv_dump(path: Path, *records: dict) -> str:
+    header = [name for name in MANUAL_REQUEST_BODY if name != "location"]
+    header += [f"location.{name}" for name in MANUAL_REQUEST_BODY["location"]]
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for record in records:
+            location = {**record["location"], "languages": ";".join(record["location"]["languages"])}
+            writer.writerow([record.get(name) for name in header if "." not in name] + list(location.values()))
+    return str(path)
+
+
+def ip_record(ip: str, **changes) -> dict:
+    return {**MANUAL_REQUEST_BODY, "ip": ip, **changes}
+
+
+def test_import_should_load_valid_records_and_intern_locations(
+    alice: TestClient, db_api: Session, engine: Engine, tmp_path: Path
+) -> None:
+    given_ips_in_db(alice, ["10.0.0.1"])
+    path = given_dump(
+        tmp_path / "dump.jsonl",
+        ip_record("10.0.0.1", city="Brno"),
+        ip_record("10.0.0.2"),
+        ip_record("2001:0DB8::1", location=OTHER_LOCATION),
+        "not json",
+        ip_record("10.0.0.3", latitude="north"),
+        ip_record("10.0.0.4"),
+    )
+
+    progress = import_file(engine, path)
+
+    assert (progress.rows, progress.imported, progress.existing, progress.invalid) == (6, 3, 1, 2)
+    assert db_api.query(IPDataModel).count() == 4
+    assert db_api.query(LocationModel).count() == 2
+    assert db_api.query(IPDataModel).filter(IPDataModel.ip == "10.0.0.1").one().city == MANUAL_REQUEST_BODY["city"]
+    stored_by_api = when_user_get_ip_data_by_ip(alice, "10.0.0.1").json()
+    assert when_user_get_ip_data_by_ip(alice, "10.0.0.2").json() == {**stored_by_api, "ip": "10.0.0.2"}
+    assert when_user_get_ip_data_by_ip(alice, "2001:db8::1").json()["location"]["capital"] == "Brno"
+
+
+def test_import_should_read_csv(db_api: Session, engine: Engine, tmp_path: Path) -> None:
+    path = given_csv_dump(tmp_path / "dump.csv", ip_record("10.0.0.1"), {**RESPONSE_OK2, "location": OTHER_LOCATION})
+
+    progress = import_file(engine, path)
+
+    assert progress.imported == 2
+    assert {ip_data.ip: ip_data.msa for ip_data in db_api.query(IPDataModel)} == {
+        "10.0.0.1": None,
+        RESPONSE_OK2["ip"]: None,
+    }
+    assert (
+        db_api.query(LocationModel).filter(LocationModel.geoname_id == OTHER_LOCATION["geoname_id"]).one().languages
+        == "cs;sk"
+    )
+
+
+def test_import_should_continue_where_interrupted_import_stopped(
+    db_api: Session, engine: Engine, tmp_path: Path
+) -> None:
+    path = given_dump(tmp_path / "dump.jsonl", *(ip_record(f"10.0.0.{i}") for i in range(1, 6)))
+    state_path = str(tmp_path / "dump.jsonl.import-state")
+
+    def crash_after_second_chunk(progress: ImportProgress) -> None:
+        if progress.rows == 4:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        import_file(engine, path, chunk_size=2, state_path=state_path, on_progress=crash_after_second_chunk)
+    assert db_api.query(IPDataModel).count() == 4
+
+    progress = import_file(engine, path, chunk_size=2, state_path=state_path)
+
+    assert (progress.rows, progress.imported, progress.existing) == (5, 5, 0)
+    assert db_api.query(IPDataModel).count() == 5
+
+
+def test_import_with_update_should_overwrite_stored_ips(
+    alice: TestClient, db_api: Session, engine: Engine, tmp_path: Path
+) -> None:
+    given_ips_in_db(alice, ["10.0.0.1"])
+    path = given_dump(
+        tmp_path / "dump.jsonl", ip_record("10.0.0.1", city="Brno"), ip_record("10.0.0.1", city="Ostrava")
+    )
+
+    progress = import_file(engine, path, update=True)
+
+    assert (progress.imported, progress.existing) == (1, 0)
+    assert db_api.query(IPDataModel).one().city == "Ostrava"
+
+
+def test_import_should_count_records_which_are_not_utf8_as_invalid(
+    db_api: Session, engine: Engine, tmp_path: Path
+) -> None:
+    path = given_dump(tmp_path / "dump.jsonl", ip_record("10.0.0.1"), ip_record("10.0.0.2"))
+    with open(path, "ab") as file:
+        file.write(b'{"ip": "10.0.0.3", "city": "Br\xfcnn"}\n')
+        file.write(json.dumps(ip_record("10.0.0.4")).encode() + b"\n")
+
+    progress = import_file(engine, path)
+
+    assert (progress.rows, progress.imported, progress.invalid) == (4, 3, 1)
+    assert db_api.query(IPDataModel).count() == 3
+
+
+def test_import_should_read_csv_values_spanning_lines(db_api: Session, engine: Engine, tmp_path: Path) -> None:
+    path = given_csv_dump(
+        tmp_path / "dump.csv", ip_record("10.0.0.1", city='Brno\n"Královo Pole"'), ip_record("10.0.0.2")
+    )
+    with open(path, "ab") as file:
+        file.write(b"10.0.0.3,Br\xfcnn\n")
+
+    progress = import_file(engine, path, chunk_size=1)
+
+    assert (progress.rows, progress.imported, progress.invalid) == (3, 2, 1)
+    assert progress.offset == Path(path).stat().st_size
+    assert db_api.query(IPDataModel).filter(IPDataModel.ip == "10.0.0.1").one().city == 'Brno\n"Královo Pole"'
@@ -0,0 +1,276 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from fastapi.testclient import TestClient
+
+from ipdata.app import main
+from ipdata.app.main import app
+from ipdata.schemas.ipdata import IPDataReturnSchema
+from ipdata.services.cache.backends import CacheBackendError, InMemoryCacheBackend
+from ipdata.services.cache.ip_data_cache import NOT_FOUND, IPDataCache, ip_data_cache, normalize_ip
+from ipdata.services.cache.lru_cache import LRUTTLCache
+from ipdata.services.ip_client.data import IPData
+from ipdata.settings import Settings, settings
+from tests.ipdata.fake_clock import FakeClock
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import (
+    BASIC_IP_ADDRESS,
+    given_ip_stack_client_returns,
+    then_response_should_be,
+    when_user_create_ip_data,
+    when_user_delete_ip_data_by_ip,
+    when_user_get_ip_data_by_ip,
+)
+
+IP_DATA_SCHEMA = IPDataReturnSchema(
+    **{**RESPONSE_OK, "location": {**RESPONSE_OK["location"], "languages": ["cs", "sk"]}}
+)
+
+
+def test_lru_cache_should_evict_least_recently_used_entry() -> None:
+    cache = LRUTTLCache(max_entries=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_should_expire_entries_after_ttl() -> None:
+    clock = FakeClock()
+    cache = LRUTTLCache(max_entries=10, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+
+    clock.now = 5
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.stats() | {"size": 0, "hits": 1, "misses": 2, "expirations": 2} == cache.stats()
+
+
+@pytest.mark.parametrize(
+    "ip, expected",
+    [
+        ("172.68.213.129", "172.68.213.129"),
+        ("2001:0db8:0000:0000:0000:0000:0000:0001", "2001:db8::1"),
+        ("2001:DB8::1", "2001:db8::1"),
+    ],
+)
+def test_normalize_ip_should_return_canonical_form(ip: str, expected: str) -> None:
+    assert normalize_ip(ip) == expected
+
+
+def test_get_ip_data_should_be_served_from_cache(alice: TestClient, mocker) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS))
+    cache_set = mocker.spy(ip_data_cache, "set")
+    hits = ip_data_cache.stats()["hits"]
+
+    res1 = when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS)
+    res2 = when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS)
+
+    then_response_should_be(HTTPStatus.OK, res2)
+    assert res1.json() == res2.json()
+    assert cache_set.call_count == 1
+    assert alice.get("/stats").json()["cache"]["hits"] == hits + 1
+
+
+def test_delete_ip_data_should_invalidate_cache(alice: TestClient, mocker) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS))
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS))
+
+    then_response_should_be(HTTPStatus.OK, when_user_delete_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS))
+
+    then_response_should_be(HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS))
+
+
+def test_create_ip_data_should_invalidate_cached_not_found(alice: TestClient, mocker) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    negative_hits = ip_data_cache.stats()["negative_hits"]
+    then_response_should_be(HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS))
+    then_response_should_be(HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS))
+    assert alice.get("/stats").json()["cache"]["negative_hits"] == negative_hits + 1
+
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=BASIC_IP_ADDRESS))
+
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS))
+
+
+class BrokenCacheBackend(InMemoryCacheBackend):
+    def get(self, key: str) -> bytes | None:
+        raise CacheBackendError("connection refused")
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise CacheBackendError("connection refused")
+
+
+def given_workers_sharing_cache(count: int) -> list[IPDataCache]:
+    backend = InMemoryCacheBackend()
+    return [IPDataCache(Settings(), backend) for _ in range(count)]
+
+
+def test_shared_cache_should_serve_entries_set_by_other_worker() -> None:
+    worker1, worker2 = given_workers_sharing_cache(2)
+
+    worker1.set(BASIC_IP_ADDRESS, IP_DATA_SCHEMA)
+    worker1.set_not_found("10.0.0.1")
+
+    assert worker2.get(BASIC_IP_ADDRESS) == IP_DATA_SCHEMA
+    assert worker2.get("10.0.0.1") is NOT_FOUND
+    assert worker2.stats()["shared"]["hits"] == 2
+
+
+def test_shared_cache_invalidation_should_drop_entries_in_all_workers() -> None:
+    worker1, worker2, worker3 = given_workers_sharing_cache(3)
+    worker1.set(BASIC_IP_ADDRESS, IP_DATA_SCHEMA)
+    assert worker2.get(BASIC_IP_ADDRESS) == IP_DATA_SCHEMA
+
+    worker3.invalidate(BASIC_IP_ADDRESS)
+
+    assert worker1.get(BASIC_IP_ADDRESS) is None
+    assert worker2.get(BASIC_IP_ADDRESS) is None
+
+
+def test_unavailable_shared_cache_should_fall_back_to_local_cache() -> None:
+    cache = IPDataCache(Settings(), BrokenCacheBackend())
+
+    assert cache.get(BASIC_IP_ADDRESS) is None
+    cache.set(BASIC_IP_ADDRESS, IP_DATA_SCHEMA)
+
+    assert cache.get(BASIC_IP_ADDRESS) == IP_DATA_SCHEMA
+    assert cache.stats()["shared"]["errors"] == 2
+
+
+class CountingCacheBackend(InMemoryCacheBackend):
+    def __init__(self) -> None:
+        super().__init__()
+        self.reads: list[list[str]] = []
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        self.reads.append(keys)
+        return super().get_many(keys)
+
+
+def test_get_many_should_read_shared_cache_at_once_without_filling_local_cache() -> None:
+    backend = CountingCacheBackend()
+    worker1, worker2 = IPDataCache(Settings(), backend), IPDataCache(Settings(), backend)
+    worker1.set(BASIC_IP_ADDRESS, IP_DATA_SCHEMA)
+    worker1.set_not_found("10.0.0.1")
+
+    results = worker2.get_many([BASIC_IP_ADDRESS, "10.0.0.1", "10.0.0.2"])
+
+    assert results == {BASIC_IP_ADDRESS: IP_DATA_SCHEMA, "10.0.0.1": NOT_FOUND, "10.0.0.2": None}
+    assert len(backend.reads) == 1
+    assert worker2.stats()["size"] == 0
+
+
+def test_get_many_should_not_promote_local_entries() -> None:
+    cache = IPDataCache(Settings(cache_max_entries=2))
+    cache.set("10.0.0.1", IP_DATA_SCHEMA)
+    cache.set("10.0.0.2", IP_DATA_SCHEMA)
+
+    assert cache.get_many(["10.0.0.1"]) == {"10.0.0.1": IP_DATA_SCHEMA}
+    cache.set("10.0.0.3", IP_DATA_SCHEMA)
+
+    assert cache.get("10.0.0.1") is None
+    assert cache.get("10.0.0.2") == IP_DATA_SCHEMA
+
+
+def test_app_should_use_shared_cache_backend_from_settings(async_mode: bool, monkeypatch, mocker) -> None:
+    monkeypatch.setattr(settings, "cache_backend", "memory")
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+
+    with TestClient(app) as client:
+        then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(client, ip_address=BASIC_IP_ADDRESS))
+        then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(client, ip_address=BASIC_IP_ADDRESS))
+        ip_data_cache.clear()
+        shared_hits = ip_data_cache.stats()["shared"]["hits"]
+
+        then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(client, ip_address=BASIC_IP_ADDRESS))
+        stats = client.get("/stats").json()["cache"]["shared"]
+        assert stats["enabled"] is True
+        assert stats["hits"] == shared_hits + 1
+
+    assert ip_data_cache.stats()["shared"]["enabled"] is False
+
+
+class LoopGuardedCacheBackend(InMemoryCacheBackend):
+    """
+    Records blocking calls made on the event loop, where a slow shared cache would stall every request.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.blocking_calls_on_loop: list[str] = []
+
+    def _guard(self, method: str) -> None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.blocking_calls_on_loop.append(method)
+
+    def get(self, key: str) -> bytes | None:
+        self._guard("get")
+        return super().get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._guard("set")
+        super().set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self._guard("delete")
+        super().delete(key)
+
+    def publish(self, channel: str, message: str) -> None:
+        self._guard("publish")
+        super().publish(channel, message)
+
+    async def get_many_async(self, keys: list[str]) -> list[bytes | None]:
+        return [InMemoryCacheBackend.get(self, key) for key in keys]
+
+    async def set_async(self, key: str, value: bytes, ttl: float) -> None:
+        InMemoryCacheBackend.set(self, key, value, ttl)
+
+    async def delete_async(self, key: str) -> None:
+        InMemoryCacheBackend.delete(self, key)
+
+    async def publish_async(self, channel: str, message: str) -> None:
+        InMemoryCacheBackend.publish(self, channel, message)
+
+
+def test_shared_cache_should_not_block_event_loop_in_async_mode(monkeypatch, mocker) -> None:
+    monkeypatch.setattr(settings, "async_mode", True)
+    backend = LoopGuardedCacheBackend()
+    monkeypatch.setattr(main, "create_cache_backend", lambda config: backend)
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+
+    with TestClient(app) as client:
+        then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(client, ip_address=BASIC_IP_ADDRESS))
+        then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(client, ip_address=BASIC_IP_ADDRESS))
+        ip_data_cache.clear()
+        shared_hits = ip_data_cache.stats()["shared"]["hits"]
+
+        then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(client, ip_address=BASIC_IP_ADDRESS))
+        assert ip_data_cache.stats()["shared"]["hits"] == shared_hits + 1
+
+        ip_data_cache.clear()
+        res = client.post("/ipdata/batch", json={"ips": [BASIC_IP_ADDRESS, "10.0.0.1"]})
+        then_response_should_be(HTTPStatus.OK, res)
+        assert [result["ip"] for result in res.json()["results"]] == [BASIC_IP_ADDRESS]
+
+        then_response_should_be(HTTPStatus.OK, when_user_delete_ip_data_by_ip(client, ip_address=BASIC_IP_ADDRESS))
+        ip_data_cache.clear()
+        then_response_should_be(HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(client, ip_address=BASIC_IP_ADDRESS))
+
+    assert backend.blocking_calls_on_loop == []
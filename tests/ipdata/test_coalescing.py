@@ -0,0 +1,239 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from threading import Barrier
+from time import monotonic, sleep
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, text
+from sqlalchemy.orm import Session
+
+from ipdata.db import get_pool_stats
+from ipdata.models.ip_data import IPDataModel
+from ipdata.services.cache.ip_data_cache import normalize_ip
+from ipdata.services.coalescing.advisory_lock import advisory_lock
+from ipdata.services.coalescing.single_flight import AsyncSingleFlight, SingleFlight
+from ipdata.services.ip_client.data import IPData
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import when_user_create_ip_data
+
+CONCURRENT_CALLS = 5
+
+
+class SlowIPStack:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def get_ip_data(self, _, ip: str) -> IPData:
+        self.calls += 1
+        sleep(0.2)
+        return IPData(**{**RESPONSE_OK, "ip": ip})
+
+    async def get_ip_data_async(self, _, ip: str) -> IPData:
+        self.calls += 1
+        await asyncio.sleep(0.2)
+        return IPData(**{**RESPONSE_OK, "ip": ip})
+
+
+@pytest.fixture
+def ip_stack(mocker) -> SlowIPStack:
+    ip_stack = SlowIPStack()
+    mocker.patch(
+        "ipdata.services.ip_client.ip_stack_client.IPStackClient.get_ip_data",
+        autospec=True,
+        side_effect=ip_stack.get_ip_data,
+    )
+    mocker.patch(
+        "ipdata.services.ip_client.ip_stack_client.AsyncIPStackClient.get_ip_data",
+        autospec=True,
+        side_effect=ip_stack.get_ip_data_async,
+    )
+    return ip_stack
+
+
+def when_users_create_ip_data_concurrently(client: TestClient, ip_address: str) -> list[HTTPStatus]:
+    barrier = Barrier(CONCURRENT_CALLS)
+
+    def create_ip_data(_) -> HTTPStatus:
+        barrier.wait()
+        return HTTPStatus(when_user_create_ip_data(client, ip_address=ip_address).status_code)
+
+    with ThreadPoolExecutor(CONCURRENT_CALLS) as executor:
+        return list(executor.map(create_ip_data, range(CONCURRENT_CALLS)))
+
+
+def given_create_lock_held_by_another_worker(engine: Engine, monkeypatch, lock_timeout: float):
+    monkeypatch.setattr(settings, "ip_stack_coalesce_requests", False)
+    monkeypatch.setattr(settings, "ip_stack_coalesce_across_workers", True)
+    monkeypatch.setattr(settings, "ip_stack_coalesce_lock_timeout", lock_timeout)
+    return advisory_lock(engine, normalize_ip(RESPONSE_OK["ip"]), timeout=1)
+
+
+def then_create_should_wait_for_lock(db: Session) -> None:
+    deadline = monotonic() + 5
+    while monotonic() < deadline:
+        waiting = db.execute(text("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND NOT granted")).scalar()
+        db.rollback()
+        if waiting:
+            return
+        sleep(0.01)
+    raise AssertionError("The create did not wait for the advisory lock")
+
+
+def test_single_flight_should_share_result_of_concurrent_calls() -> None:
+    single_flight = SingleFlight()
+    barrier = Barrier(CONCURRENT_CALLS)
+    calls = []
+
+    def call(_) -> object:
+        barrier.wait()
+        return single_flight.do("key", lambda: calls.append(sleep(0.1)) or object())
+
+    with ThreadPoolExecutor(CONCURRENT_CALLS) as executor:
+        results = list(executor.map(call, range(CONCURRENT_CALLS)))
+
+    assert len(calls) == 1
+    assert len(set(map(id, results))) == 1
+    assert single_flight.stats() == {"calls": CONCURRENT_CALLS, "shared": CONCURRENT_CALLS - 1, "in_flight": 0}
+
+
+def test_single_flight_should_share_exception_and_forget_finished_calls() -> None:
+    single_flight = SingleFlight()
+
+    def fail() -> None:
+        raise ValueError("upstream failed")
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", fail)
+
+    assert single_flight.do("key", lambda: 1) == 1
+
+
+def test_async_single_flight_should_share_result_of_concurrent_calls() -> None:
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def call() -> object:
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return object()
+
+    async def main() -> list[object]:
+        return await asyncio.gather(*(single_flight.do("key", call) for _ in range(CONCURRENT_CALLS)))
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert len(set(map(id, results))) == 1
+
+
+def test_async_single_flight_should_make_call_again_when_its_caller_is_cancelled() -> None:
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def call() -> int:
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main() -> list[int]:
+        leader = asyncio.create_task(single_flight.do("key", call))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(single_flight.do("key", call)) for _ in range(CONCURRENT_CALLS - 1)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 2
+    assert results == [2] * (CONCURRENT_CALLS - 1)
+    assert single_flight.stats() == {"calls": CONCURRENT_CALLS, "shared": CONCURRENT_CALLS - 2, "in_flight": 0}
+
+
+def test_async_single_flight_should_cancel_only_cancelled_waiting_caller() -> None:
+    single_flight = AsyncSingleFlight()
+
+    async def call() -> str:
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main() -> tuple[str, bool]:
+        leader = asyncio.create_task(single_flight.do("key", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(single_flight.do("key", call))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        await asyncio.sleep(0)
+        return await leader, follower.cancelled()
+
+    assert asyncio.run(main()) == ("result", True)
+
+
+def test_concurrent_creates_of_same_ip_should_call_upstream_once(
+    alice: TestClient, db_api: Session, ip_stack: SlowIPStack
+) -> None:
+    statuses = when_users_create_ip_data_concurrently(alice, RESPONSE_OK["ip"])
+
+    assert ip_stack.calls == 1
+    assert set(statuses) <= {HTTPStatus.OK, HTTPStatus.BAD_REQUEST}
+    assert statuses.count(HTTPStatus.OK) > 1
+    assert db_api.query(IPDataModel).count() == 1
+
+
+def test_concurrent_creates_in_different_workers_should_call_upstream_once(
+    alice: TestClient, db_api: Session, ip_stack: SlowIPStack, monkeypatch
+) -> None:
+    # Without in-process coalescing every request behaves like one coming to a different worker
+    monkeypatch.setattr(settings, "ip_stack_coalesce_requests", False)
+    monkeypatch.setattr(settings, "ip_stack_coalesce_across_workers", True)
+
+    statuses = when_users_create_ip_data_concurrently(alice, RESPONSE_OK["ip"])
+
+    assert ip_stack.calls == 1
+    assert set(statuses) <= {HTTPStatus.OK, HTTPStatus.BAD_REQUEST}
+    assert statuses.count(HTTPStatus.OK) > 1
+    assert db_api.query(IPDataModel).count() == 1
+
+
+def test_concurrent_creates_without_coalescing_should_not_fail_on_unique_constraint(
+    alice: TestClient, db_api: Session, ip_stack: SlowIPStack, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "ip_stack_coalesce_requests", False)
+
+    statuses = when_users_create_ip_data_concurrently(alice, RESPONSE_OK["ip"])
+
+    assert set(statuses) <= {HTTPStatus.OK, HTTPStatus.BAD_REQUEST}
+    assert statuses.count(HTTPStatus.OK) == 1
+    assert db_api.query(IPDataModel).count() == 1
+
+
+def test_create_should_not_wait_for_advisory_lock_longer_than_timeout(
+    alice: TestClient, db_api: Session, ip_stack: SlowIPStack, engine: Engine, monkeypatch
+) -> None:
+    with given_create_lock_held_by_another_worker(engine, monkeypatch, lock_timeout=0.1) as locked:
+        assert locked
+        res = when_user_create_ip_data(alice, ip_address=RESPONSE_OK["ip"])
+
+    assert res.status_code == HTTPStatus.OK
+    assert ip_stack.calls == 1
+    assert db_api.query(IPDataModel).count() == 1
+
+
+def test_create_waiting_for_advisory_lock_should_not_hold_session_connection(
+    alice: TestClient, db_api: Session, ip_stack: SlowIPStack, engine: Engine, monkeypatch
+) -> None:
+    with ThreadPoolExecutor(1) as executor:
+        with given_create_lock_held_by_another_worker(engine, monkeypatch, lock_timeout=10):
+            create = executor.submit(when_user_create_ip_data, alice, RESPONSE_OK["ip"])
+            then_create_should_wait_for_lock(db_api)
+            # Only the connection waiting for the lock
+            assert get_pool_stats()["checked_out"] == 1
+
+        assert create.result().status_code == HTTPStatus.OK
+
+    assert ip_stack.calls == 1
@@ -0,0 +1,56 @@
+from http import HTTPStatus
+
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ipdata import db
+from ipdata.app.main import app
+from ipdata.settings import Settings
+from tests.ipdata.test_app import BASIC_IP_ADDRESS, then_response_should_be, when_user_get_ip_data_by_ip
+
+
+def test_prepare_database_should_use_pool_settings() -> None:
+    engine = db.prepare_database(Settings(database_pool_size=3, database_pool_max_overflow=2))
+    try:
+        assert isinstance(engine.pool, db.InstrumentedQueuePool)
+        assert engine.pool.size() == 3
+        assert engine.pool._max_overflow == 2
+    finally:
+        engine.dispose()
+
+
+def test_engine_should_be_shared_between_requests(alice: TestClient) -> None:
+    engine = db.get_engine()
+    assert engine is not None
+
+    for _ in range(3):
+        res = when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS)
+        then_response_should_be(HTTPStatus.NOT_FOUND, res)
+
+    assert db.get_engine() is engine
+
+
+def test_stats_should_report_pool_checkouts(alice: TestClient) -> None:
+    db.pool_metrics.reset()
+
+    res = when_user_get_ip_data_by_ip(alice, ip_address=BASIC_IP_ADDRESS)
+    then_response_should_be(HTTPStatus.NOT_FOUND, res)
+
+    stats = alice.get("/stats").json()["db_pool"]
+    assert stats["checkouts"] == 1
+    assert stats["checkout_timeouts"] == 0
+    assert stats["size"] == db.get_engine().pool.size()
+
+
+def test_engine_should_be_disposed_on_shutdown(async_mode: bool) -> None:
+    with TestClient(app):
+        assert db.get_engine() is not None
+
+    assert db.get_engine() is None
+
+
+def test_async_mode_should_use_asyncpg_engine(async_mode: bool) -> None:
+    with TestClient(app):
+        engine = db.get_engine()
+        assert isinstance(engine, AsyncEngine) is async_mode
+        assert isinstance(engine.pool, db.InstrumentedPoolMixin)
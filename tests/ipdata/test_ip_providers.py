@@ -0,0 +1,148 @@
+import asyncio
+import random
+from time import monotonic
+
+import httpx
+import pytest
+
+from ipdata.services.ip_client.exceptions import IpStackException
+from ipdata.services.ip_client.ip_api_client import AsyncIPAPIClient, IPAPIClient
+from ipdata.services.ip_client.ip_stack_client import AsyncIPStackClient, IPStackClient
+from ipdata.services.ip_client.providers import create_ip_client
+from ipdata.services.ip_client.routing import (
+    MIN_LATENCY_SAMPLES,
+    AsyncIPClientRouter,
+    IPClientRouter,
+    ProviderStats,
+)
+from ipdata.settings import Settings
+from tests.ipdata.responses import RESPONSE_INVALID_IP_ADDRESS, RESPONSE_LIMIT_REACHED, RESPONSE_OK
+from tests.ipdata.stub_server import StubIPProvider
+
+RESPONSE_OK_FROM_IP_API = {**RESPONSE_OK, "city": "Brno"}
+
+
+def given_router(ip_stack: StubIPProvider, ip_api: StubIPProvider, **options) -> IPClientRouter:
+    return IPClientRouter(
+        {"ipstack": IPStackClient(ip_stack.url), "ipapi": IPAPIClient(ip_api.url)},
+        {"ipstack": ProviderStats(quota_cooldown=3600), "ipapi": ProviderStats(quota_cooldown=3600)},
+        **options,
+    )
+
+
+def given_latency_samples(stats: ProviderStats, latency: float) -> None:
+    for _ in range(MIN_LATENCY_SAMPLES):
+        stats.observe(latency, None)
+
+
+def test_primary_routing_should_fall_back_to_next_provider_on_failure() -> None:
+    with StubIPProvider({}, status_code=503) as ip_stack, StubIPProvider(RESPONSE_OK_FROM_IP_API) as ip_api:
+        router = given_router(ip_stack, ip_api)
+
+        ip_data = router.get_ip_data(RESPONSE_OK["ip"])
+
+    assert ip_data.city == "Brno"
+    assert router.stats["ipstack"].errors == 1
+    assert router.stats["ipapi"].answers == 1
+
+
+def test_primary_routing_should_not_fall_back_on_invalid_ip() -> None:
+    with StubIPProvider(RESPONSE_INVALID_IP_ADDRESS) as ip_stack, StubIPProvider(RESPONSE_OK) as ip_api:
+        router = given_router(ip_stack, ip_api)
+
+        with pytest.raises(IpStackException) as error:
+            router.get_ip_data("wrong.ip")
+
+    assert error.value.code == 106
+    assert ip_api.paths == []
+
+
+def test_provider_out_of_quota_should_be_asked_last() -> None:
+    with StubIPProvider(RESPONSE_LIMIT_REACHED) as ip_stack, StubIPProvider(RESPONSE_OK_FROM_IP_API) as ip_api:
+        router = given_router(ip_stack, ip_api)
+
+        router.get_ip_data(RESPONSE_OK["ip"])
+        router.get_ip_data(RESPONSE_OK["ip"])
+
+    assert len(ip_stack.paths) == 1
+    assert len(ip_api.paths) == 2
+    assert router.route(["ipstack", "ipapi"]) == ["ipapi", "ipstack"]
+
+
+def test_hedged_routing_should_return_first_answer_when_primary_is_slow() -> None:
+    with StubIPProvider(RESPONSE_OK, delay=1) as ip_stack, StubIPProvider(RESPONSE_OK_FROM_IP_API) as ip_api:
+        router = given_router(ip_stack, ip_api, policy="hedged", default_latency=0.05)
+
+        started_at = monotonic()
+        ip_data = router.get_ip_data(RESPONSE_OK["ip"])
+        elapsed = monotonic() - started_at
+
+    assert ip_data.city == "Brno"
+    assert elapsed < 0.5
+    assert len(ip_stack.paths) == 1
+
+
+def test_hedged_routing_should_not_ask_second_provider_when_primary_answers_in_time() -> None:
+    with StubIPProvider(RESPONSE_OK) as ip_stack, StubIPProvider(RESPONSE_OK_FROM_IP_API) as ip_api:
+        router = given_router(ip_stack, ip_api, policy="hedged", default_latency=1)
+
+        ip_data = router.get_ip_data(RESPONSE_OK["ip"])
+
+    assert ip_data.city == RESPONSE_OK["city"]
+    assert ip_api.paths == []
+
+
+def test_hedge_delay_should_follow_p95_latency_of_provider() -> None:
+    with StubIPProvider(RESPONSE_OK) as ip_stack, StubIPProvider(RESPONSE_OK) as ip_api:
+        router = given_router(ip_stack, ip_api, policy="hedged", default_latency=1, hedge_min_delay=0.05)
+
+    assert router.hedge_delay("ipstack") == 1
+    given_latency_samples(router.stats["ipstack"], 0.2)
+    assert router.hedge_delay("ipstack") == 0.2
+    given_latency_samples(router.stats["ipapi"], 0.001)
+    assert router.hedge_delay("ipapi") == 0.05
+
+
+def test_weighted_routing_should_prefer_faster_provider() -> None:
+    with StubIPProvider(RESPONSE_OK) as ip_stack, StubIPProvider(RESPONSE_OK) as ip_api:
+        router = given_router(ip_stack, ip_api, policy="weighted", rng=random.Random(0))
+    given_latency_samples(router.stats["ipstack"], 0.4)
+    given_latency_samples(router.stats["ipapi"], 0.1)
+
+    first = [router.route(["ipstack", "ipapi"])[0] for _ in range(1000)]
+
+    assert 700 < first.count("ipapi") < 900
+
+
+def test_async_hedged_routing_should_cancel_slower_request() -> None:
+    with StubIPProvider(RESPONSE_OK, delay=1) as ip_stack, StubIPProvider(RESPONSE_OK_FROM_IP_API) as ip_api:
+
+        async def main():
+            router = AsyncIPClientRouter(
+                {
+                    "ipstack": AsyncIPStackClient(ip_stack.url, httpx.AsyncClient()),
+                    "ipapi": AsyncIPAPIClient(ip_api.url, httpx.AsyncClient()),
+                },
+                {"ipstack": ProviderStats(quota_cooldown=3600), "ipapi": ProviderStats(quota_cooldown=3600)},
+                policy="hedged",
+                default_latency=0.05,
+            )
+            try:
+                return await asyncio.wait_for(router.get_ip_data(RESPONSE_OK["ip"]), timeout=0.5), router
+            finally:
+                await router.aclose()
+
+        ip_data, router = asyncio.run(main())
+
+    assert ip_data.city == "Brno"
+    assert router.stats["ipstack"].calls == 0
+
+
+def test_create_ip_client_should_build_configured_providers() -> None:
+    router = create_ip_client(Settings(ip_providers=["ipapi", "ipstack"], ip_provider_routing="hedged"))
+
+    assert router.providers == ["ipapi", "ipstack"]
+    assert router.policy == "hedged"
+
+    with pytest.raises(ValueError):
+        create_ip_client(Settings(ip_providers=["ipstack", "unknown"]))
@@ -0,0 +1,105 @@
+from http import HTTPStatus
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from ipdata.app.utils import get_ip_range_by_ip, ip_data_attributes, location_attributes
+from ipdata.models.ip_data import IPRangeModel, LocationModel
+from ipdata.services.ip_client.data import IPData, LocationData
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK, RESPONSE_OK2
+from tests.ipdata.test_app import (
+    given_ip_stack_client_returns,
+    then_response_should_be,
+    when_user_create_ip_data,
+    when_user_delete_ip_data_by_ip,
+    when_user_get_ip_data_by_ip,
+)
+from tests.ipdata.test_batch import ip_stack_responses_by_ip, when_user_enrich_ip_data_batch
+
+
+@pytest.fixture
+def range_store(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "range_store_enabled", True)
+
+
+def given_ip_ranges_in_db(db: Session, *networks: tuple[str, str]) -> None:
+    location = LocationModel(**location_attributes(LocationData(**{**RESPONSE_OK["location"], "geoname_id": 1})))
+    db.add(location)
+    db.add_all(
+        [
+            IPRangeModel(
+                network=network, location=location, **ip_data_attributes(IPData(**{**RESPONSE_OK, "city": city}))
+            )
+            for network, city in networks
+        ]
+    )
+    db.commit()
+
+
+def test_get_ip_data_should_fall_back_to_covering_network(alice: TestClient, range_store, mocker) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=RESPONSE_OK["ip"]))
+
+    res = when_user_get_ip_data_by_ip(alice, ip_address="172.68.213.7")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json() == {
+        **when_user_get_ip_data_by_ip(alice, ip_address=RESPONSE_OK["ip"]).json(),
+        "ip": "172.68.213.7",
+    }
+    then_response_should_be(HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(alice, ip_address="172.68.214.1"))
+
+
+def test_ip_ranges_should_be_resolved_by_longest_prefix(db_api: Session) -> None:
+    given_ip_ranges_in_db(
+        db_api, ("10.0.0.0/8", "wide"), ("10.1.0.0/16", "narrow"), ("10.1.2.0/24", "narrowest"), ("2001:db8::/32", "v6")
+    )
+
+    assert get_ip_range_by_ip(db_api, "10.1.2.3").city == "narrowest"
+    assert get_ip_range_by_ip(db_api, "10.1.3.3").city == "narrow"
+    assert get_ip_range_by_ip(db_api, "10.2.0.1").city == "wide"
+    assert get_ip_range_by_ip(db_api, "2001:db8:1::1").city == "v6"
+    assert get_ip_range_by_ip(db_api, "11.0.0.1") is None
+
+
+def test_exact_ip_should_take_precedence_over_network(alice: TestClient, db_api: Session, range_store, mocker) -> None:
+    given_ip_ranges_in_db(db_api, ("172.68.213.0/24", "block"))
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=RESPONSE_OK["ip"]))
+
+    assert when_user_get_ip_data_by_ip(alice, ip_address=RESPONSE_OK["ip"]).json()["city"] == RESPONSE_OK["city"]
+    assert when_user_get_ip_data_by_ip(alice, ip_address="172.68.213.1").json()["city"] == "block"
+
+
+def test_networks_should_not_be_used_when_range_store_is_disabled(alice: TestClient, db_api: Session) -> None:
+    given_ip_ranges_in_db(db_api, ("10.0.0.0/8", "wide"))
+
+    then_response_should_be(HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(alice, ip_address="10.0.0.1"))
+
+
+def test_enrich_batch_should_store_each_covering_network_once(
+    alice: TestClient, db_api: Session, range_store, monkeypatch, mocker
+) -> None:
+    monkeypatch.setattr(settings, "range_store_prefix_v4", 16)
+    second_ip_in_block = {**RESPONSE_OK2, "ip": "172.68.1.1"}
+    given_ip_stack_client_returns(mocker, side_effect=ip_stack_responses_by_ip(RESPONSE_OK, second_ip_in_block))
+
+    res = when_user_enrich_ip_data_batch(alice, [RESPONSE_OK["ip"], second_ip_in_block["ip"]])
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert [ip_range.network for ip_range in db_api.query(IPRangeModel)] == ["172.68.0.0/16"]
+    assert when_user_get_ip_data_by_ip(alice, ip_address="172.68.99.1").json()["city"] == RESPONSE_OK["city"]
+
+
+def test_delete_ip_data_should_keep_location_used_by_network(
+    alice: TestClient, db_api: Session, range_store, mocker
+) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip_address=RESPONSE_OK["ip"]))
+
+    then_response_should_be(HTTPStatus.OK, when_user_delete_ip_data_by_ip(alice, ip_address=RESPONSE_OK["ip"]))
+
+    assert db_api.query(LocationModel).count() == 1
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, ip_address=RESPONSE_OK["ip"]))
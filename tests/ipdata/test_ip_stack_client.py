@@ -1,12 +1,14 @@
+import asyncio
 from typing import Any
 
 import furl
+import httpx
 import pytest
 from pydantic import IPvAnyAddress
 
 from ipdata.services.ip_client.data import IPData
 from ipdata.services.ip_client.exceptions import IpStackException
-from ipdata.services.ip_client.ip_stack_client import IPStackClient, IPStackErrorResponse
+from ipdata.services.ip_client.ip_stack_client import AsyncIPStackClient, IPStackClient, IPStackErrorResponse
 from tests.ipdata.responses import (
     RESPONSE_INVALID_ACCESS_KEY,
     RESPONSE_INVALID_IP_ADDRESS,
@@ -27,6 +29,22 @@ class FakeIPStackClient(IPStackClient):
         return self._determine_response(self._fake_response)
 
 
+class FakeAsyncIPStackClient(AsyncIPStackClient):
+    def __init__(self, ip_url: furl, fake_response: dict[str, Any], status_code: int = 200) -> None:
+        super().__init__(ip_url)
+        self._session = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(status_code, json=fake_response))
+        )
+
+
+def get_ip_data_async(client: AsyncIPStackClient, ip: str) -> IPData:
+    async def inner() -> IPData:
+        async with client:
+            return await client.get_ip_data(ip)
+
+    return asyncio.run(inner())
+
+
 def test_ip_stack_client_should_return_proper_ipdata_object_if_ip_found() -> None:
     client = FakeIPStackClient(IP_STACK_URL, fake_response=RESPONSE_OK)
     ip_data = client.get_ip_data("ok.ip")
@@ -82,3 +100,58 @@ def test_ip_stack_client_should_raise_invalid_access_key_exception(
     with pytest.raises(IpStackException) as e:
         client.get_ip_data("whatever")
     assert e.value.code == expected_code
+
+
+def test_async_ip_stack_client_should_return_proper_ipdata_object_if_ip_found() -> None:
+    client = FakeAsyncIPStackClient(furl.furl(IP_STACK_URL), fake_response=RESPONSE_OK)
+    ip_data = get_ip_data_async(client, "ok.ip")
+
+    assert isinstance(ip_data, IPData)
+    assert ip_data.ip == IPvAnyAddress(RESPONSE_OK["ip"])
+    assert ip_data.location.geoname_id == RESPONSE_OK["location"]["geoname_id"]
+
+
+@pytest.mark.parametrize(
+    "response, status_code, expected_code",
+    [
+        (RESPONSE_INVALID_ACCESS_KEY, 200, 101),
+        (RESPONSE_LIMIT_REACHED, 200, 104),
+        (RESPONSE_NO_INFO, 200, 999),
+        ({}, 503, 503),
+    ],
+)
+def test_async_ip_stack_client_should_raise_ip_stack_exception(
+    response: dict[str, Any], status_code: int, expected_code: int
+) -> None:
+    client = FakeAsyncIPStackClient(furl.furl(IP_STACK_URL), fake_response=response, status_code=status_code)
+
+    with pytest.raises(IpStackException) as e:
+        get_ip_data_async(client, "whatever")
+    assert e.value.code == expected_code
+
+
+class FakeBulkIPStackClient(IPStackClient):
+    def __init__(self, ip_url: furl, fake_response: list[dict[str, Any]] | dict[str, Any]) -> None:
+        self._fake_response = fake_response
+        super().__init__(ip_url)
+
+    def _fetch_json_from_api(self, ip: str) -> Any:
+        return self._fake_response
+
+
+def test_ip_stack_client_bulk_lookup_should_return_result_per_ip() -> None:
+    client = FakeBulkIPStackClient(IP_STACK_URL, fake_response=[RESPONSE_OK, RESPONSE_NO_INFO])
+
+    results = client.get_ip_data_bulk([RESPONSE_OK["ip"], "10.0.0.1"])
+
+    assert isinstance(results[RESPONSE_OK["ip"]], IPData)
+    assert isinstance(results["10.0.0.1"], IpStackException)
+    assert results["10.0.0.1"].code == 999
+
+
+def test_ip_stack_client_bulk_lookup_should_raise_if_whole_request_failed() -> None:
+    client = FakeBulkIPStackClient(IP_STACK_URL, fake_response=RESPONSE_LIMIT_REACHED)
+
+    with pytest.raises(IpStackException) as e:
+        client.get_ip_data_bulk([RESPONSE_OK["ip"], "10.0.0.1"])
+    assert e.value.code == 104
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from ipdata.app.utils import claim_ip_data_jobs, process_ip_data_jobs
+from ipdata.models.ip_data import IPDataModel
+from ipdata.models.ip_data_job import IPDataJobModel
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.exceptions import CONNECTION_ERROR, IpStackException
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import (
+    given_ip_stack_client_returns,
+    then_response_should_be,
+    when_user_create_ip_data,
+)
+
+NEW_IP, EXISTING_IP, INVALID_IP, UNREACHABLE_IP = "10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"
+
+
+def given_ip_stack_client_answers(mocker) -> None:
+    def get_ip_data(ip: str) -> IPData:
+        if ip == INVALID_IP:
+            raise IpStackException(code=106, err_type="invalid_ip_address", info="")
+        if ip == UNREACHABLE_IP:
+            raise IpStackException(code=CONNECTION_ERROR, err_type="connection_error", info="")
+        return IPData(**{**RESPONSE_OK, "ip": ip})
+
+    given_ip_stack_client_returns(mocker, side_effect=get_ip_data)
+
+
+def when_user_create_ip_data_job(client: TestClient, ip_address: str) -> Response:
+    return client.post("/ipdata/jobs", json={"ip": ip_address})
+
+
+def when_user_get_ip_data_job(client: TestClient, job_id: str) -> Response:
+    return client.get(f"/ipdata/jobs/{job_id}")
+
+
+def when_job_worker_runs(alice: TestClient) -> int:
+    return alice.portal.call(process_ip_data_jobs)
+
+
+def then_job_should_be(alice: TestClient, job_id: str, status: str, status_code: int | None) -> dict:
+    job = when_user_get_ip_data_job(alice, job_id).json()
+    assert (job["status"], job["status_code"]) == (status, status_code)
+    return job
+
+
+def test_create_ip_data_job_should_return_job_without_calling_upstream(alice: TestClient, mocker) -> None:
+    given_ip_stack_client_returns(mocker, side_effect=AssertionError("upstream must not be called"))
+
+    res = when_user_create_ip_data_job(alice, NEW_IP)
+
+    then_response_should_be(HTTPStatus.ACCEPTED, res)
+    assert res.headers["Location"] == f"/ipdata/jobs/{res.json()['id']}"
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_job(alice, res.json()["id"]))
+    then_job_should_be(alice, res.json()["id"], "pending", None)
+
+
+def test_get_unknown_ip_data_job_should_return_not_found(alice: TestClient) -> None:
+    res = when_user_get_ip_data_job(alice, "0b5b2f4e-7a43-4c5e-9b65-3f7d2a1c9e10")
+
+    then_response_should_be(HTTPStatus.NOT_FOUND, res)
+
+
+def test_job_worker_should_create_ip_data_and_record_results(alice: TestClient, db_api: Session, mocker) -> None:
+    given_ip_stack_client_answers(mocker)
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, EXISTING_IP))
+    jobs = {ip: when_user_create_ip_data_job(alice, ip).json()["id"] for ip in (NEW_IP, EXISTING_IP, INVALID_IP)}
+
+    assert when_job_worker_runs(alice) == 3
+
+    then_job_should_be(alice, jobs[NEW_IP], "done", HTTPStatus.CREATED)
+    then_job_should_be(alice, jobs[EXISTING_IP], "done", HTTPStatus.OK)
+    job = then_job_should_be(alice, jobs[INVALID_IP], "failed", HTTPStatus.BAD_REQUEST)
+    assert job["detail"] == "Invalid IP address or domain"
+    assert job["finished_at"] is not None
+    assert db_api.query(IPDataModel).filter(IPDataModel.ip == NEW_IP).count() == 1
+    assert when_job_worker_runs(alice) == 0
+
+
+def test_job_worker_should_retry_transient_failures(alice: TestClient, mocker, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "job_max_attempts", 2)
+    monkeypatch.setattr(settings, "job_retry_delay", 0)
+    given_ip_stack_client_answers(mocker)
+    job_id = when_user_create_ip_data_job(alice, UNREACHABLE_IP).json()["id"]
+
+    when_job_worker_runs(alice)
+    job = then_job_should_be(alice, job_id, "pending", HTTPStatus.BAD_GATEWAY)
+    assert job["attempts"] == 1
+
+    when_job_worker_runs(alice)
+    job = then_job_should_be(alice, job_id, "failed", HTTPStatus.BAD_GATEWAY)
+    assert job["attempts"] == 2
+
+
+def test_claimed_jobs_should_not_be_taken_by_other_workers_until_lease_expires(
+    alice: TestClient, db_api: Session, db_session
+) -> None:
+    job_ids = [when_user_create_ip_data_job(alice, ip).json()["id"] for ip in (NEW_IP, EXISTING_IP)]
+    other_worker_db = next(db_session())
+
+    first = claim_ip_data_jobs(1, db_api)
+    second = claim_ip_data_jobs(10, other_worker_db)
+    other_worker_db.close()
+    assert {str(job.id) for job in first + second} == set(job_ids)
+    assert claim_ip_data_jobs(10, db_api) == []
+
+    # Jobs of a worker which died are taken again after the lease
+    db_api.execute(update(IPDataJobModel).values(available_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+    db_api.commit()
+    assert [job.attempts for job in claim_ip_data_jobs(10, db_api)] == [2, 2]
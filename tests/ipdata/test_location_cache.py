@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from time import monotonic, sleep
+
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, delete, text
+from sqlalchemy.orm import Session
+
+from ipdata.app.utils import get_location
+from ipdata.models.ip_data import IPDataModel, LocationModel
+from ipdata.schemas.ipdata import LocationDataWithSimpleLanguages
+from ipdata.services.cache.ip_data_cache import ip_data_cache
+from ipdata.services.cache.location_cache import LocationCache, location_cache
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import (
+    MANUAL_LOCATION,
+    count_queries,
+    then_response_should_be,
+    when_user_create_ip_data_manually,
+    when_user_delete_ip_data_by_ip,
+    when_user_get_ip_data_by_ip,
+)
+
+LOCATION = LocationDataWithSimpleLanguages(**MANUAL_LOCATION)
+
+
+def when_user_create_ip_data_with_location(client: TestClient, ip: str, location: dict = MANUAL_LOCATION):
+    return when_user_create_ip_data_manually(client, request_body={**RESPONSE_OK, "ip": ip, "location": location})
+
+
+def test_location_cache_should_look_up_locations_by_id_and_geoname_id() -> None:
+    cache = LocationCache()
+    cache.load([("a", LOCATION)])
+
+    assert cache.get("a") is LOCATION
+    assert cache.get_by_geoname_id(LOCATION.geoname_id) == ("a", LOCATION)
+    assert cache.set("a", LOCATION.model_copy()) is LOCATION
+
+    cache.invalidate("a")
+
+    assert cache.get("a") is None
+    assert cache.get_by_geoname_id(LOCATION.geoname_id) is None
+    assert cache.stats() == {"entries": 0, "hits": 2, "misses": 2}
+
+
+def test_create_with_cached_location_should_only_insert_ip_data(alice: TestClient) -> None:
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data_with_location(alice, "10.0.0.1"))
+
+    with count_queries() as statements:
+        res = when_user_create_ip_data_with_location(alice, "10.0.0.2")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert len(statements) == 1
+    assert statements[0].startswith("INSERT INTO ipdata")
+
+
+def test_reads_should_share_one_location_object(alice: TestClient, db_api: Session) -> None:
+    for ip in ["10.0.0.1", "10.0.0.2"]:
+        then_response_should_be(HTTPStatus.OK, when_user_create_ip_data_with_location(alice, ip))
+    location_cache.clear()
+    ip_data_cache.clear()
+
+    with count_queries() as statements:
+        for ip in ["10.0.0.1", "10.0.0.2"]:
+            then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, ip))
+
+    assert len([statement for statement in statements if "FROM location" in statement]) == 1
+    locations = [get_location(db_api, ip_data.location_id) for ip_data in db_api.query(IPDataModel)]
+    assert locations[0] is locations[1]
+
+
+def test_delete_of_last_ip_should_invalidate_its_location(alice: TestClient, db_api: Session) -> None:
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data_with_location(alice, "10.0.0.1"))
+
+    then_response_should_be(HTTPStatus.OK, when_user_delete_ip_data_by_ip(alice, "10.0.0.1"))
+
+    assert location_cache.get_by_geoname_id(MANUAL_LOCATION["geoname_id"]) is None
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data_with_location(alice, "10.0.0.2"))
+    assert db_api.query(LocationModel).count() == 1
+
+
+def test_create_should_store_location_again_if_another_worker_deleted_it(alice: TestClient, db_api: Session) -> None:
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data_with_location(alice, "10.0.0.1"))
+    db_api.execute(delete(IPDataModel))
+    db_api.execute(delete(LocationModel))
+    db_api.commit()
+
+    res = when_user_create_ip_data_with_location(alice, "10.0.0.2")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["location"]["geoname_id"] == MANUAL_LOCATION["geoname_id"]
+    assert db_api.query(LocationModel).count() == 1
+
+
+def then_delete_should_wait_for_row_lock(db: Session) -> None:
+    deadline = monotonic() + 5
+    while monotonic() < deadline:
+        waiting = db.execute(
+            text("SELECT count(*) FROM pg_locks WHERE locktype = 'transactionid' AND NOT granted")
+        ).scalar()
+        db.rollback()
+        if waiting:
+            return
+        sleep(0.01)
+    raise AssertionError("The delete did not wait for the concurrent create")
+
+
+def test_delete_of_last_ip_should_keep_location_used_by_concurrent_create(
+    alice: TestClient, db_api: Session, engine: Engine
+) -> None:
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data_with_location(alice, "10.0.0.1"))
+    location_id = db_api.query(LocationModel).one().id
+    db_api.rollback()
+
+    with ThreadPoolExecutor(1) as executor, Session(engine) as other_worker:
+        other_worker.add(IPDataModel(ip="10.0.0.2", location_id=location_id))
+        other_worker.flush()
+        delete_ip_data = executor.submit(when_user_delete_ip_data_by_ip, alice, "10.0.0.1")
+        then_delete_should_wait_for_row_lock(db_api)
+        other_worker.commit()
+
+        then_response_should_be(HTTPStatus.OK, delete_ip_data.result())
+
+    assert db_api.query(LocationModel).one().id == location_id
+    assert [str(ip_data.ip) for ip_data in db_api.query(IPDataModel)] == ["10.0.0.2"]
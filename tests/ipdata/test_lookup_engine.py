@@ -0,0 +1,220 @@
+from http import HTTPStatus
+from ipaddress import ip_address, ip_network
+from random import Random
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from ipdata.app import utils
+from ipdata.app.main import app
+from ipdata.schemas.ipdata import IPDataReturnSchema
+from ipdata.services.cache.backends import InMemoryCacheBackend
+from ipdata.services.cache.ip_data_cache import IPDataCache, running_loop
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.lookup.ip_lookup_engine import IPLookupEngine, ip_lookup_engine
+from ipdata.services.lookup.radix_trie import NO_VALUE, RadixTrie
+from ipdata.services.serialization.ip_data_json import encode_ip_data_schema
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK, RESPONSE_OK2
+from tests.ipdata.test_app import (
+    count_queries,
+    given_ip_stack_client_returns,
+    then_response_should_be,
+    when_user_create_ip_data,
+    when_user_delete_ip_data_by_ip,
+    when_user_get_ip_data_by_ip,
+)
+from tests.ipdata.test_batch import given_ip_data_in_db, when_user_get_ip_data_batch
+from tests.ipdata.test_cache import IP_DATA_SCHEMA
+from tests.ipdata.test_ip_range_store import given_ip_ranges_in_db
+
+
+@pytest.fixture
+def lookup_client(async_mode: bool, monkeypatch):
+    monkeypatch.setattr(settings, "lookup_engine_enabled", True)
+    with TestClient(app) as client:
+        yield client
+
+
+def given_trie(*networks: str) -> RadixTrie:
+    trie = RadixTrie(ip_network(networks[0]).max_prefixlen)
+    for value, network in enumerate(networks):
+        network = ip_network(network)
+        trie.insert(int(network.network_address), network.prefixlen, value)
+    return trie
+
+
+def lookup(trie: RadixTrie, ip: str) -> int:
+    return trie.lookup(int(ip_network(ip).network_address))
+
+
+def test_radix_trie_should_return_longest_prefix_match() -> None:
+    trie = given_trie("10.0.0.0/8", "10.1.2.0/24", "10.1.0.0/16", "10.1.2.3/32", "192.168.0.0/16")
+
+    assert lookup(trie, "10.1.2.3") == 3
+    assert lookup(trie, "10.1.2.4") == 1
+    assert lookup(trie, "10.1.3.1") == 2
+    assert lookup(trie, "10.200.0.1") == 0
+    assert lookup(trie, "192.168.255.255") == 4
+    assert lookup(trie, "11.0.0.1") == NO_VALUE
+    assert len(trie) == 5
+
+
+def test_radix_trie_should_support_ipv6_and_removal() -> None:
+    trie = given_trie("2001:db8::/32", "2001:db8::1/128", "::/0")
+
+    assert lookup(trie, "2001:db8::1") == 1
+    assert trie.remove(int(ip_network("2001:db8::1").network_address), 128) == 1
+
+    assert lookup(trie, "2001:db8::1") == 0
+    assert lookup(trie, "2001:db9::1") == 2
+    assert len(trie) == 2
+
+
+def test_radix_trie_should_match_linear_scan_for_random_prefixes() -> None:
+    random = Random(7)
+    networks = list(
+        {
+            ip_network((random.getrandbits(32), random.choice([8, 12, 16, 20, 24, 28, 32])), strict=False)
+            for _ in range(500)
+        }
+    )
+    trie = given_trie(*map(str, networks))
+
+    for _ in range(2000):
+        address = random.getrandbits(32)
+        matching = [
+            i
+            for i, network in enumerate(networks)
+            if int(network.network_address) == address >> (32 - network.prefixlen) << (32 - network.prefixlen)
+        ]
+        expected = max(matching, key=lambda i: networks[i].prefixlen, default=NO_VALUE)
+        assert trie.lookup(address) == expected
+    assert trie.node_count() < 2 * len(networks) + 1
+
+
+def test_lookup_engine_should_keep_writes_made_during_rebuild() -> None:
+    engine = IPLookupEngine()
+    second_schema = IPDataReturnSchema(**{**IP_DATA_SCHEMA.model_dump(), "ip": RESPONSE_OK2["ip"]})
+
+    with engine.rebuild() as index:
+        index.add(IP_DATA_SCHEMA, IP_DATA_SCHEMA.location)
+        engine.set(second_schema)
+        engine.invalidate(IP_DATA_SCHEMA.ip)
+
+    assert engine.get(IP_DATA_SCHEMA.ip) is None
+    assert engine.get(RESPONSE_OK2["ip"]) == second_schema
+    assert engine.stats()["memory"]["entries"] == 1
+
+
+def test_lookup_engine_should_intern_locations() -> None:
+    engine = IPLookupEngine()
+    schemas = [IPDataReturnSchema(**{**IP_DATA_SCHEMA.model_dump(), "ip": f"10.0.0.{i}"}) for i in range(3)]
+
+    with engine.rebuild() as index:
+        for schema in schemas:
+            index.add(schema, schema.location)
+
+    assert len({id(engine.get(f"10.0.0.{i}").location) for i in range(3)}) == 1
+    assert engine.stats()["memory"]["locations"] == 1
+
+
+def test_lookup_engine_should_build_responses_from_compact_records() -> None:
+    engine = IPLookupEngine()
+
+    with engine.rebuild() as index:
+        index.add(IP_DATA_SCHEMA, IP_DATA_SCHEMA.location)
+        index.add(IP_DATA_SCHEMA, IP_DATA_SCHEMA.location, ip_network("10.0.0.0/8"))
+
+    assert engine.get(IP_DATA_SCHEMA.ip) == IP_DATA_SCHEMA
+    assert engine.get_json(IP_DATA_SCHEMA.ip) == encode_ip_data_schema(IP_DATA_SCHEMA)
+    in_block = IP_DATA_SCHEMA.model_copy(update={"ip": ip_address("10.1.2.3")})
+    assert engine.get_json("10.1.2.3") == encode_ip_data_schema(in_block)
+    assert engine.get_json("11.0.0.1") is None
+
+
+def test_lookup_engine_should_be_rebuilt_outside_of_event_loop(async_mode: bool, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "lookup_engine_enabled", True)
+    rebuilds = []
+    rebuild = utils.rebuild_ip_lookup_engine
+
+    def rebuild_ip_lookup_engine(db: Session) -> None:
+        rebuilds.append((isinstance(db, Session), running_loop()))
+        rebuild(db)
+
+    monkeypatch.setattr(utils, "rebuild_ip_lookup_engine", rebuild_ip_lookup_engine)
+
+    with TestClient(app):
+        pass
+
+    assert rebuilds == [(True, None)]
+
+
+def test_lookup_engine_should_drop_ips_invalidated_by_other_workers() -> None:
+    backend, engine = InMemoryCacheBackend(), IPLookupEngine()
+    with engine.rebuild() as index:
+        index.add(IP_DATA_SCHEMA, IP_DATA_SCHEMA.location)
+    IPDataCache(settings).connect(backend, on_invalidate=engine.invalidate)
+    other_worker_cache = IPDataCache(settings, backend)
+
+    other_worker_cache.invalidate(IP_DATA_SCHEMA.ip)
+
+    assert engine.get(IP_DATA_SCHEMA.ip) is None
+
+
+def test_get_ip_data_should_be_served_by_lookup_engine_without_query(lookup_client: TestClient, mocker) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(lookup_client, ip_address=RESPONSE_OK["ip"]))
+
+    with count_queries() as statements:
+        res = when_user_get_ip_data_by_ip(lookup_client, ip_address=RESPONSE_OK["ip"])
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["city"] == RESPONSE_OK["city"]
+    assert statements == []
+    assert lookup_client.get("/stats").json()["lookup_engine"]["hits"] >= 1
+
+
+def test_lookup_engine_should_be_loaded_from_database_at_startup(async_mode: bool, monkeypatch, mocker) -> None:
+    with TestClient(app) as client:
+        given_ip_data_in_db(client, mocker, RESPONSE_OK, RESPONSE_OK2)
+    monkeypatch.setattr(settings, "lookup_engine_enabled", True)
+
+    with TestClient(app) as client:
+        with count_queries() as statements:
+            res = when_user_get_ip_data_batch(client, [RESPONSE_OK["ip"], RESPONSE_OK2["ip"]])
+        memory = client.get("/stats").json()["lookup_engine"]["memory"]
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert len(res.json()["results"]) == 2
+    assert statements == []
+    assert memory["entries"] == 2
+    assert memory["locations"] == 1
+    assert not ip_lookup_engine.enabled
+
+
+def test_deleted_ip_should_be_removed_from_lookup_engine(lookup_client: TestClient, mocker) -> None:
+    given_ip_stack_client_returns(mocker, return_value=IPData(**RESPONSE_OK))
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(lookup_client, ip_address=RESPONSE_OK["ip"]))
+
+    then_response_should_be(HTTPStatus.OK, when_user_delete_ip_data_by_ip(lookup_client, ip_address=RESPONSE_OK["ip"]))
+
+    then_response_should_be(
+        HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(lookup_client, ip_address=RESPONSE_OK["ip"])
+    )
+
+
+def test_lookup_engine_should_resolve_network_blocks(async_mode: bool, db_api, monkeypatch) -> None:
+    given_ip_ranges_in_db(db_api, ("172.68.0.0/16", "block"))
+    monkeypatch.setattr(settings, "range_store_enabled", True)
+    monkeypatch.setattr(settings, "lookup_engine_enabled", True)
+
+    with TestClient(app) as client:
+        with count_queries() as statements:
+            res = when_user_get_ip_data_by_ip(client, ip_address="172.68.1.1")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["ip"] == "172.68.1.1"
+    assert res.json()["city"] == "block"
+    assert statements == []
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import pytest
+from fastapi.testclient import TestClient
+from furl import furl
+
+from ipdata.services.ip_client.exceptions import IpStackException
+from ipdata.services.metrics.registry import Counter, Histogram, request_duration, stage_duration, upstream_errors
+from tests.ipdata.responses import RESPONSE_LIMIT_REACHED, RESPONSE_OK
+from tests.ipdata.test_app import (
+    MANUAL_LOCATION,
+    then_response_should_be,
+    when_user_create_ip_data_manually,
+    when_user_get_ip_data_by_ip,
+)
+from tests.ipdata.test_ip_stack_client import IP_STACK_URL, FakeAsyncIPStackClient, get_ip_data_async
+
+
+def when_user_get_metrics(client: TestClient) -> str:
+    res = client.get("/metrics")
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.headers["content-type"].startswith("text/plain")
+    return res.text
+
+
+def test_histogram_should_sum_up_observations_of_all_threads() -> None:
+    histogram = Histogram("test_seconds", "Test", ["stage"], buckets=[0.1, 1.0])
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda value: histogram.observe(value, "db"), [0.0625, 0.5, 4.0] * 100))
+
+    assert histogram.count("db") == 300
+    assert list(histogram.render()) == [
+        "# HELP test_seconds Test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="db",le="0.1"} 100',
+        'test_seconds_bucket{stage="db",le="1.0"} 200',
+        'test_seconds_bucket{stage="db",le="+Inf"} 300',
+        'test_seconds_sum{stage="db"} 456.25',
+        'test_seconds_count{stage="db"} 300',
+    ]
+
+
+def test_counter_should_escape_label_values() -> None:
+    counter = Counter("test_total", "Test", ["code"])
+
+    counter.inc('a"b')
+    counter.inc('a"b', amount=2)
+
+    assert counter.value('a"b') == 3
+    assert list(counter.render())[-1] == 'test_total{code="a\\"b"} 3'
+
+
+def test_metrics_should_time_requests_by_route_and_stages(alice: TestClient) -> None:
+    requests = request_duration.count("GET", "/ipdata/{ip}", "200")
+    not_found = request_duration.count("GET", "/ipdata/{ip}", "404")
+    db_reads = stage_duration.count("db_get_ip_data")
+    then_response_should_be(
+        HTTPStatus.OK,
+        when_user_create_ip_data_manually(alice, {**RESPONSE_OK, "ip": "10.0.0.1", "location": MANUAL_LOCATION}),
+    )
+
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, "10.0.0.1"))
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, "10.0.0.1"))
+    then_response_should_be(HTTPStatus.NOT_FOUND, when_user_get_ip_data_by_ip(alice, "10.0.0.2"))
+    metrics = when_user_get_metrics(alice)
+
+    assert request_duration.count("GET", "/ipdata/{ip}", "200") == requests + 2
+    assert request_duration.count("GET", "/ipdata/{ip}", "404") == not_found + 1
+    # The second read is answered by the response cache
+    assert stage_duration.count("db_get_ip_data") == db_reads + 2
+    assert 'ipdata_request_duration_seconds_count{method="GET",route="/ipdata/{ip}",status="200"}' in metrics
+    assert 'ipdata_stage_duration_seconds_bucket{stage="build_response",le="+Inf"}' in metrics
+    assert 'ipdata_db_pool_connections{state="checked_out"}' in metrics
+    assert 'ipdata_cache_hit_ratio{cache="ip_data"}' in metrics
+
+
+def test_metrics_should_not_label_unmatched_paths(alice: TestClient) -> None:
+    unmatched = request_duration.count("GET", "unmatched", "404")
+
+    then_response_should_be(HTTPStatus.NOT_FOUND, alice.get("/no/such/path"))
+
+    assert request_duration.count("GET", "unmatched", "404") == unmatched + 1
+
+
+@pytest.mark.parametrize(
+    "status_code, response, code",
+    [(HTTPStatus.OK, RESPONSE_LIMIT_REACHED, "104"), (HTTPStatus.BAD_GATEWAY, {}, "502")],
+)
+def test_upstream_errors_should_be_counted_by_code(status_code: int, response: dict, code: str) -> None:
+    errors = upstream_errors.value("ipstack", code)
+    upstream_calls = stage_duration.count("upstream")
+
+    with pytest.raises(IpStackException):
+        get_ip_data_async(FakeAsyncIPStackClient(furl(IP_STACK_URL), response, status_code), "10.0.0.1")
+
+    assert upstream_errors.value("ipstack", code) == errors + 1
+    assert stage_duration.count("upstream") == upstream_calls + 1
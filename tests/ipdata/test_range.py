@@ -0,0 +1,104 @@
+from http import HTTPStatus
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy.orm import Session
+
+from ipdata.models.ip_data import IPDataModel
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import (
+    count_queries,
+    then_response_should_be,
+    when_user_create_ip_data_manually,
+    when_user_get_ip_data_by_ip,
+)
+
+MANUAL_REQUEST_BODY = {**RESPONSE_OK, "location": {**RESPONSE_OK["location"], "languages": ["cs", "sk"]}}
+
+
+def given_ips_in_db(client: TestClient, ips: list[str]) -> None:
+    for ip in ips:
+        res = when_user_create_ip_data_manually(client, request_body={**MANUAL_REQUEST_BODY, "ip": ip})
+        then_response_should_be(HTTPStatus.OK, res)
+
+
+def when_user_get_ip_data_range(client: TestClient, cidr: str, **params: Any) -> Response:
+    return client.get(f"/ipdata/range/{cidr}", params=params)
+
+
+def test_ip_should_be_stored_in_canonical_form(alice: TestClient, db_api: Session) -> None:
+    given_ips_in_db(alice, ["2001:0DB8:0000:0000:0000:0000:0000:0001"])
+
+    assert db_api.query(IPDataModel).one().ip == "2001:db8::1"
+    res = when_user_get_ip_data_by_ip(alice, ip_address="2001:db8:0::1")
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["ip"] == "2001:db8::1"
+
+
+def test_range_should_return_ips_inside_network_in_order(alice: TestClient) -> None:
+    given_ips_in_db(alice, ["172.68.213.129", "172.68.0.1", "172.69.0.1", "172.67.255.255", "2001:db8::1"])
+
+    res = when_user_get_ip_data_range(alice, "172.68.0.0/16")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert [result["ip"] for result in res.json()["results"]] == ["172.68.0.1", "172.68.213.129"]
+    assert res.json()["next_cursor"] is None
+
+
+def test_range_should_be_paginated_with_cursor(alice: TestClient) -> None:
+    ips = [f"10.1.{i}.{j}" for i in range(3) for j in range(3)]
+    given_ips_in_db(alice, ips)
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 4} | ({"after": cursor} if cursor else {})
+        with count_queries() as statements:
+            res = when_user_get_ip_data_range(alice, "10.1.0.0/16", **params)
+        then_response_should_be(HTTPStatus.OK, res)
+        assert len(statements) == 1
+        pages.append([result["ip"] for result in res.json()["results"]])
+        cursor = res.json()["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [4, 4, 1]
+    assert sum(pages, []) == sorted(ips, key=lambda ip: tuple(int(part) for part in ip.split(".")))
+
+
+def test_range_should_support_ipv6(alice: TestClient) -> None:
+    given_ips_in_db(alice, ["2001:db8::1", "2001:db8:0:1::1", "2001:db9::1"])
+
+    res = when_user_get_ip_data_range(alice, "2001:db8::/32")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert [result["ip"] for result in res.json()["results"]] == ["2001:db8::1", "2001:db8:0:1::1"]
+
+
+def test_range_page_size_should_be_limited(alice: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "range_page_max_size", 2)
+    given_ips_in_db(alice, ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+    res = when_user_get_ip_data_range(alice, "10.0.0.0/24", limit=100)
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert len(res.json()["results"]) == 2
+    assert res.json()["next_cursor"] == "10.0.0.2"
+
+
+@pytest.mark.parametrize(
+    "cidr, params, status",
+    [
+        ("10.0.0.1/16", {}, HTTPStatus.UNPROCESSABLE_CONTENT),
+        ("wrong", {}, HTTPStatus.UNPROCESSABLE_CONTENT),
+        ("10.0.0.0/16", {"after": "2001:db8::1"}, HTTPStatus.BAD_REQUEST),
+    ],
+)
+def test_range_with_incorrect_input_should_raise_error(
+    alice: TestClient, cidr: str, params: dict[str, Any], status: HTTPStatus
+) -> None:
+    res = when_user_get_ip_data_range(alice, cidr, **params)
+
+    then_response_should_be(status, res)
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from ipdata.app.utils import refresh_stale_ip_data
+from ipdata.models.ip_data import IPDataModel
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.exceptions import IpStackException
+from ipdata.services.refresh.freshness import refresh_queue
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import (
+    given_ip_stack_client_returns,
+    then_response_should_be,
+    when_user_create_ip_data,
+    when_user_create_ip_data_manually,
+    when_user_get_ip_data_by_ip,
+)
+
+STALE_IP, OTHER_STALE_IP, FRESH_IP = "10.0.0.1", "10.0.0.2", "10.0.0.3"
+
+
+@pytest.fixture
+def refresh_enabled(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "refresh_enabled", True)
+    monkeypatch.setattr(settings, "refresh_batch_size", 1)
+
+
+def given_ip_data_created(alice: TestClient, mocker, *ips: str) -> None:
+    given_ip_stack_client_returns(mocker, side_effect=lambda ip: IPData(**{**RESPONSE_OK, "ip": ip}))
+    for ip in ips:
+        then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, ip))
+
+
+def given_ip_data_expired(db: Session, *ips: str) -> None:
+    db.execute(
+        update(IPDataModel)
+        .where(IPDataModel.ip.in_(ips))
+        .values(expires_at=datetime.now(timezone.utc) - timedelta(hours=1))
+    )
+    db.commit()
+
+
+def when_refresher_runs(alice: TestClient) -> int:
+    return alice.portal.call(refresh_stale_ip_data)
+
+
+def then_ip_data_in_db(db: Session, ip: str) -> IPDataModel:
+    db.expire_all()
+    return db.query(IPDataModel).filter(IPDataModel.ip == ip).one()
+
+
+def test_created_ip_data_should_expire_after_ttl(alice: TestClient, db_api: Session, mocker) -> None:
+    given_ip_data_created(alice, mocker, STALE_IP)
+    res = when_user_create_ip_data_manually(
+        alice,
+        request_body={**RESPONSE_OK, "ip": FRESH_IP, "location": {**RESPONSE_OK["location"], "languages": ["cs"]}},
+    )
+    then_response_should_be(HTTPStatus.OK, res)
+
+    fetched = then_ip_data_in_db(db_api, STALE_IP)
+    ttl = (fetched.expires_at - fetched.fetched_at).total_seconds()
+    assert (
+        settings.ip_data_ttl * (1 - settings.ip_data_ttl_jitter)
+        <= ttl
+        <= settings.ip_data_ttl * (1 + settings.ip_data_ttl_jitter)
+    )
+    manual = then_ip_data_in_db(db_api, FRESH_IP)
+    assert manual.fetched_at is None and manual.expires_at is None
+
+
+def test_stale_ip_data_should_be_returned_and_queued_for_refresh(
+    alice: TestClient, db_api: Session, mocker, refresh_enabled
+) -> None:
+    given_ip_data_created(alice, mocker, STALE_IP, FRESH_IP)
+    given_ip_data_expired(db_api, STALE_IP)
+    given_ip_stack_client_returns(mocker, side_effect=AssertionError("upstream must not be called"))
+
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, STALE_IP))
+    then_response_should_be(HTTPStatus.OK, when_user_get_ip_data_by_ip(alice, FRESH_IP))
+
+    assert refresh_queue.take(10) == [STALE_IP]
+
+
+def test_refresher_should_refresh_queued_ips_first(alice: TestClient, db_api: Session, mocker, refresh_enabled) -> None:
+    given_ip_data_created(alice, mocker, STALE_IP, OTHER_STALE_IP, FRESH_IP)
+    given_ip_data_expired(db_api, STALE_IP)
+    given_ip_data_expired(db_api, OTHER_STALE_IP)
+    fresh_expires_at = then_ip_data_in_db(db_api, FRESH_IP).expires_at
+    refresh_queue.put(OTHER_STALE_IP)
+    given_ip_stack_client_returns(mocker, side_effect=lambda ip: IPData(**{**RESPONSE_OK, "ip": ip, "city": "Brno"}))
+
+    assert when_refresher_runs(alice) == 1
+
+    refreshed = then_ip_data_in_db(db_api, OTHER_STALE_IP)
+    assert refreshed.city == "Brno"
+    assert refreshed.expires_at > datetime.now(timezone.utc)
+    assert then_ip_data_in_db(db_api, STALE_IP).city == RESPONSE_OK["city"]
+    assert then_ip_data_in_db(db_api, FRESH_IP).expires_at == fresh_expires_at
+    assert when_user_get_ip_data_by_ip(alice, OTHER_STALE_IP).json()["city"] == "Brno"
+
+    assert when_refresher_runs(alice) == 1
+    assert then_ip_data_in_db(db_api, STALE_IP).city == "Brno"
+    assert alice.get("/stats").json()["refresh"]["refreshed"] == 2
+
+
+def test_refresher_should_keep_data_and_retry_later_when_upstream_fails(
+    alice: TestClient, db_api: Session, mocker, refresh_enabled
+) -> None:
+    given_ip_data_created(alice, mocker, STALE_IP)
+    given_ip_data_expired(db_api, STALE_IP)
+    given_ip_stack_client_returns(mocker, side_effect=IpStackException(code=500, err_type="error", info=""))
+
+    assert when_refresher_runs(alice) == 0
+
+    ip_data = then_ip_data_in_db(db_api, STALE_IP)
+    assert ip_data.city == RESPONSE_OK["city"]
+    retry_in = (ip_data.expires_at - datetime.now(timezone.utc)).total_seconds()
+    assert settings.refresh_retry_delay - 60 < retry_in <= settings.refresh_retry_delay
+    assert when_refresher_runs(alice) == 0
+    assert alice.get("/stats").json()["refresh"]["failed"] == 1
@@ -0,0 +1,148 @@
+import threading
+from http import HTTPStatus
+from time import monotonic, sleep
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import SecretStr
+from structlog.testing import capture_logs
+
+from ipdata.services.cache.ip_data_cache import ip_data_cache
+from ipdata.services.instrumentation.profiler import ProfilerBusyError, SamplingProfiler, sampling_profiler
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import (
+    MANUAL_LOCATION,
+    then_response_should_be,
+    when_user_create_ip_data_manually,
+    when_user_get_ip_data_by_ip,
+)
+
+ADMIN_TOKEN = "secret"
+
+
+@pytest.fixture
+def admin_token(monkeypatch) -> str:
+    monkeypatch.setattr(settings, "admin_token", SecretStr(ADMIN_TOKEN))
+    monkeypatch.setattr(settings, "profiler_interval", 0.001)
+    yield ADMIN_TOKEN
+    sampling_profiler.stop()
+
+
+def given_ip_in_db(client: TestClient, ip: str) -> None:
+    then_response_should_be(
+        HTTPStatus.OK,
+        when_user_create_ip_data_manually(client, {**RESPONSE_OK, "ip": ip, "location": MANUAL_LOCATION}),
+    )
+    ip_data_cache.clear()
+
+
+def when_user_get_ip_data_with_request_id(client: TestClient, ip: str, request_id: str) -> tuple:
+    with capture_logs() as logs:
+        res = client.get(f"/ipdata/{ip}", headers={"X-Request-ID": request_id})
+    return res, [log for log in logs if log.get("request_id") == request_id]
+
+
+def then_profile_should_finish() -> None:
+    deadline = monotonic() + 5
+    while sampling_profiler.running and monotonic() < deadline:
+        sleep(0.01)
+    assert not sampling_profiler.running
+
+
+def test_request_log_should_log_timings_of_every_request(alice: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "request_log", "all")
+    given_ip_in_db(alice, "10.0.0.1")
+
+    res, logs = when_user_get_ip_data_with_request_id(alice, "10.0.0.1", "request-1")
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.headers["x-request-id"] == "request-1"
+    [log] = logs
+    assert log["event"] == "request"
+    assert log["log_level"] == "info"
+    assert log["route"] == "/ipdata/{ip}"
+    assert log["status"] == HTTPStatus.OK
+    assert log["ip"] == "10.0.0.1"
+    assert log["queries"] >= 1
+    assert log["rows"] >= 1
+    assert 0 < log["db_ms"] <= log["duration_ms"]
+    assert "db_get_ip_data" in log["stages_ms"]
+    assert "statements" not in log
+
+
+def test_slow_request_should_be_logged_with_its_statements(alice: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "slow_request_threshold", 0.0)
+    given_ip_in_db(alice, "10.0.0.1")
+
+    _, logs = when_user_get_ip_data_with_request_id(alice, "10.0.0.1", "request-2")
+
+    [log] = logs
+    assert log["event"] == "slow_request"
+    assert log["log_level"] == "warning"
+    assert any("FROM ipdata" in statement["statement"] for statement in log["statements"])
+    assert sum(statement["rows"] for statement in log["statements"]) == log["rows"]
+
+
+def test_request_log_should_only_log_slow_requests_by_default(alice: TestClient) -> None:
+    res, logs = when_user_get_ip_data_with_request_id(alice, "10.0.0.1", "request-3")
+
+    then_response_should_be(HTTPStatus.NOT_FOUND, res)
+    assert logs == []
+
+
+def test_request_without_id_should_get_one(alice: TestClient) -> None:
+    res = when_user_get_ip_data_by_ip(alice, "10.0.0.1")
+
+    assert len(res.headers["x-request-id"]) == 32
+
+
+def test_admin_endpoints_should_require_admin_token(alice: TestClient, monkeypatch) -> None:
+    then_response_should_be(HTTPStatus.NOT_FOUND, alice.get("/admin/profile"))
+
+    monkeypatch.setattr(settings, "admin_token", SecretStr(ADMIN_TOKEN))
+
+    then_response_should_be(HTTPStatus.FORBIDDEN, alice.get("/admin/profile"))
+    then_response_should_be(HTTPStatus.FORBIDDEN, alice.get("/admin/profile", headers={"X-Admin-Token": "wrong"}))
+
+
+def test_profiler_should_sample_the_next_requests(alice: TestClient, admin_token: str) -> None:
+    headers = {"X-Admin-Token": admin_token}
+    res = alice.post("/admin/profile", params={"requests": 2}, headers=headers)
+    then_response_should_be(HTTPStatus.ACCEPTED, res)
+    assert res.json()["running"] is True
+    then_response_should_be(HTTPStatus.CONFLICT, alice.post("/admin/profile", headers=headers))
+
+    for _ in range(2):
+        when_user_get_ip_data_by_ip(alice, "10.0.0.1")
+    then_profile_should_finish()
+
+    res = alice.get("/admin/profile", headers=headers)
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.headers["x-profile-running"] == "false"
+    for line in res.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+
+def spin(stop: threading.Event) -> None:
+    while not stop.is_set():
+        pass
+
+
+def test_profiler_should_fold_stacks_of_other_threads() -> None:
+    profiler, stop = SamplingProfiler(), threading.Event()
+    spinner = threading.Thread(target=spin, args=(stop,), name="spinner")
+    spinner.start()
+
+    profiler.start(duration=0.2, interval=0.001)
+    with pytest.raises(ProfilerBusyError):
+        profiler.start(duration=0.2)
+    sleep(0.05)
+    profiler.stop()
+    stop.set()
+    spinner.join()
+
+    assert profiler.stats()["samples"] > 0
+    assert "spinner;threading:Thread._bootstrap;" in profiler.folded()
+    assert "tests.ipdata.test_request_log:spin " in profiler.folded()
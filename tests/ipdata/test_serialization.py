@@ -0,0 +1,54 @@
+from http import HTTPStatus
+
+import pytest
+from fastapi.testclient import TestClient
+
+from ipdata.services.cache.ip_data_cache import ip_data_cache
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK, RESPONSE_OK2
+from tests.ipdata.test_app import then_response_should_be, when_user_get_ip_data_by_ip
+from tests.ipdata.test_batch import given_ip_data_in_db, when_user_get_ip_data_batch
+
+
+def when_user_get_ip_data_without_fast_path(client: TestClient, ip: str, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(settings, "response_fast_path", False)
+        ip_data_cache.clear()
+        return when_user_get_ip_data_by_ip(client, ip_address=ip)
+
+
+@pytest.mark.parametrize("ip", [RESPONSE_OK["ip"], "2001:db8::1"])
+def test_fast_path_should_return_the_same_bytes_as_response_model(alice: TestClient, mocker, monkeypatch, ip) -> None:
+    given_ip_data_in_db(alice, mocker, {**RESPONSE_OK2, "ip": ip})
+    ip_data_cache.clear()
+
+    res = when_user_get_ip_data_by_ip(alice, ip_address=ip)
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.headers["content-type"] == "application/json"
+    assert res.content == when_user_get_ip_data_without_fast_path(alice, ip, monkeypatch).content
+
+
+def test_fast_path_should_answer_for_network_blocks_with_requested_ip(alice: TestClient, mocker, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "range_store_enabled", True)
+    given_ip_data_in_db(alice, mocker, RESPONSE_OK)
+    neighbour = RESPONSE_OK["ip"].rsplit(".", 1)[0] + ".1"
+    ip_data_cache.clear()
+
+    res = when_user_get_ip_data_by_ip(alice, ip_address=neighbour)
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["ip"] == neighbour
+    assert res.content == when_user_get_ip_data_without_fast_path(alice, neighbour, monkeypatch).content
+
+
+def test_encoded_responses_should_be_cached_and_readable_by_batch(alice: TestClient, mocker) -> None:
+    given_ip_data_in_db(alice, mocker, RESPONSE_OK)
+    ip_data_cache.clear()
+
+    res = when_user_get_ip_data_by_ip(alice, ip_address=RESPONSE_OK["ip"])
+
+    assert ip_data_cache.get_json(RESPONSE_OK["ip"]) == res.content
+    batch = when_user_get_ip_data_batch(alice, [RESPONSE_OK["ip"]])
+    then_response_should_be(HTTPStatus.OK, batch)
+    assert batch.json()["results"] == [res.json()]
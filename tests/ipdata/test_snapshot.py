@@ -0,0 +1,118 @@
+from http import HTTPStatus
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from ipdata.app import main
+from ipdata.app.main import app
+from ipdata.models.ip_data import LocationModel
+from ipdata.services.snapshot.export import export_snapshot
+from ipdata.services.snapshot.snapshot_format import SnapshotFormatError, flatten_networks
+from ipdata.services.snapshot.snapshot_reader import IPDataSnapshot
+from ipdata.settings import settings
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import count_queries, then_response_should_be, when_user_get_ip_data_by_ip
+from tests.ipdata.test_batch import when_user_get_ip_data_batch
+from tests.ipdata.test_ip_range_store import given_ip_ranges_in_db
+from tests.ipdata.test_range import MANUAL_REQUEST_BODY, given_ips_in_db
+
+
+@pytest.fixture
+def snapshot_path(tmp_path: Path) -> str:
+    return str(tmp_path / "ipdata.snapshot")
+
+
+def given_snapshot(db: Session, path: str, include_ranges: bool = False) -> IPDataSnapshot:
+    export_snapshot(db, path, include_ranges=include_ranges)
+    return IPDataSnapshot(path)
+
+
+def test_flatten_networks_should_let_most_specific_network_win() -> None:
+    networks = [(0, 255, 0), (16, 31, 1), (20, 20, 2), (32, 47, 1), (300, 301, 3)]
+
+    assert list(flatten_networks(networks)) == [
+        (0, 15, 0),
+        (16, 19, 1),
+        (20, 20, 2),
+        (21, 47, 1),
+        (48, 255, 0),
+        (300, 301, 3),
+    ]
+
+
+def test_snapshot_should_answer_like_the_api(alice: TestClient, db_api: Session, snapshot_path: str) -> None:
+    given_ips_in_db(alice, [RESPONSE_OK["ip"], "10.0.0.1", "2001:db8::1"])
+    given_ips_in_db(alice, ["10.0.0.2"])
+
+    snapshot = given_snapshot(db_api, snapshot_path)
+
+    for ip in [RESPONSE_OK["ip"], "10.0.0.1", "10.0.0.2", "2001:db8::1"]:
+        assert snapshot.get(ip).model_dump(mode="json") == when_user_get_ip_data_by_ip(alice, ip_address=ip).json()
+    assert snapshot.get("10.0.0.3") is None
+    assert snapshot.get("2001:db8::2") is None
+    assert snapshot.stats() | {"ipv4": 2, "ipv6": 1, "records": 1, "locations": 1} == snapshot.stats()
+    snapshot.close()
+
+
+def test_snapshot_should_resolve_network_blocks(db_api: Session, alice: TestClient, snapshot_path: str) -> None:
+    given_ip_ranges_in_db(db_api, ("10.0.0.0/8", "wide"), ("10.1.0.0/16", "narrow"), ("2001:db8::/32", "v6"))
+    given_ips_in_db(alice, ["10.1.0.1"])
+
+    snapshot = given_snapshot(db_api, snapshot_path, include_ranges=True)
+
+    assert snapshot.get("10.1.0.1").city == MANUAL_REQUEST_BODY["city"]
+    assert snapshot.get("10.1.0.2").city == "narrow"
+    assert str(snapshot.get("10.1.0.2").ip) == "10.1.0.2"
+    assert snapshot.get("10.2.0.1").city == "wide"
+    assert snapshot.get("2001:db8:ffff::1").city == "v6"
+    assert snapshot.get("11.0.0.1") is None
+    snapshot.close()
+
+
+def test_file_which_is_not_a_snapshot_should_be_rejected(snapshot_path: str) -> None:
+    Path(snapshot_path).write_bytes(b"not a snapshot" * 10)
+
+    with pytest.raises(SnapshotFormatError):
+        IPDataSnapshot(snapshot_path)
+
+
+def test_snapshot_of_location_without_is_eu_should_be_rejected(
+    alice: TestClient, db_api: Session, snapshot_path: str
+) -> None:
+    given_ips_in_db(alice, ["10.0.0.1"])
+    db_api.execute(update(LocationModel).values(is_eu=None))
+    db_api.commit()
+
+    with pytest.raises(SnapshotFormatError, match=f"Location {MANUAL_REQUEST_BODY['location']['geoname_id']} "):
+        export_snapshot(db_api, snapshot_path)
+    assert not Path(snapshot_path).exists()
+
+
+def test_app_in_snapshot_mode_should_not_query_database(
+    alice: TestClient, db_api: Session, snapshot_path: str, monkeypatch
+) -> None:
+    given_ips_in_db(alice, [RESPONSE_OK["ip"]])
+    export_snapshot(db_api, snapshot_path)
+    monkeypatch.setattr(settings, "read_mode", "snapshot")
+    monkeypatch.setattr(settings, "snapshot_path", snapshot_path)
+    monkeypatch.setattr(settings, "job_workers", 1)
+    job_workers_started = []
+    monkeypatch.setattr(main, "process_ip_data_jobs_continuously", job_workers_started.append)
+
+    with TestClient(app) as client:
+        with count_queries() as statements:
+            res = when_user_get_ip_data_by_ip(client, ip_address=RESPONSE_OK["ip"])
+            res_not_found = when_user_get_ip_data_by_ip(client, ip_address="10.0.0.1")
+            res_batch = when_user_get_ip_data_batch(client, [RESPONSE_OK["ip"], "10.0.0.1"])
+        stats = client.get("/stats").json()["snapshot"]
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert res.json()["city"] == RESPONSE_OK["city"]
+    then_response_should_be(HTTPStatus.NOT_FOUND, res_not_found)
+    assert res_batch.json()["not_found"] == ["10.0.0.1"]
+    assert statements == []
+    assert job_workers_started == []
+    assert stats["ipv4"] == 1
@@ -0,0 +1,177 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine
+
+from ipdata.services.ip_client.budget import (
+    DatabaseBudgetStore,
+    InMemoryBudgetStore,
+    UpstreamBudget,
+    lookup_priority,
+)
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.exceptions import BUDGET_EXHAUSTED, IpStackException
+from ipdata.settings import settings
+from tests.ipdata.fake_clock import FakeClock
+from tests.ipdata.responses import RESPONSE_OK
+from tests.ipdata.test_app import (
+    given_ip_stack_client_returns,
+    then_response_should_be,
+    when_user_create_ip_data,
+)
+from tests.ipdata.test_batch import when_user_enrich_ip_data_batch
+
+
+class CountingBudgetStore(InMemoryBudgetStore):
+    def __init__(self, clock: FakeClock) -> None:
+        super().__init__(clock)
+        self.consumed: list[str] = []
+
+    def consume(self, key: str, amount: int, limit: int, ttl: float) -> int | None:
+        self.consumed.append(key.split(":")[1])
+        return super().consume(key, amount, limit, ttl)
+
+
+def given_budget(clock: FakeClock, **options) -> UpstreamBudget:
+    return UpstreamBudget(InMemoryBudgetStore(clock), clock=clock, **options)
+
+
+def then_budget_is_exhausted(budget: UpstreamBudget, provider: str = "ipstack") -> None:
+    with pytest.raises(IpStackException) as error:
+        budget.acquire(provider)
+    assert error.value.code == BUDGET_EXHAUSTED
+
+
+@pytest.fixture
+def ip_stack_quota(mocker, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "ip_provider_monthly_quotas", {"ipstack": 3})
+    monkeypatch.setattr(settings, "ip_provider_budget_store", "database")
+    mocker.patch("ipdata.services.ip_client.providers._budget", None)
+    given_ip_stack_client_returns(mocker, side_effect=lambda ip: IPData(**{**RESPONSE_OK, "ip": ip}))
+
+
+def test_budget_should_refuse_lookups_over_rate_limit_until_next_second() -> None:
+    clock = FakeClock()
+    budget = given_budget(clock, rate_limits={"ipstack": 2}, monthly_quotas={}, max_wait=0)
+
+    budget.acquire("ipstack")
+    budget.acquire("ipstack")
+    then_budget_is_exhausted(budget)
+    budget.acquire("ipapi")
+
+    clock.now += 1
+    budget.acquire("ipstack")
+
+
+def test_budget_should_wait_for_next_second_when_allowed() -> None:
+    budget = UpstreamBudget(InMemoryBudgetStore(), rate_limits={"ipstack": 1}, monthly_quotas={}, max_wait=1.5)
+
+    budget.acquire("ipstack")
+    budget.acquire("ipstack")
+
+    assert 0 < budget.stats("ipstack")["wait_seconds_total"] <= 1
+
+
+def test_budget_should_keep_reserve_of_monthly_quota_for_interactive_lookups() -> None:
+    budget = given_budget(FakeClock(), rate_limits={}, monthly_quotas={"ipstack": 10}, reserve=0.2)
+
+    with lookup_priority("background"):
+        for _ in range(6):
+            budget.acquire("ipstack")
+        then_budget_is_exhausted(budget)
+    with lookup_priority("batch"):
+        budget.acquire("ipstack", amount=2)
+        then_budget_is_exhausted(budget)
+    budget.acquire("ipstack", amount=2)
+    then_budget_is_exhausted(budget)
+
+    stats = budget.stats("ipstack")
+    assert stats["remaining_this_month"] == 0
+    assert stats["denied"] == {"background": 1, "batch": 1, "interactive": 1}
+
+
+def test_budget_should_start_new_month_with_full_quota() -> None:
+    clock = FakeClock()
+    budget = given_budget(clock, rate_limits={}, monthly_quotas={"ipstack": 1})
+
+    budget.acquire("ipstack")
+    then_budget_is_exhausted(budget)
+
+    clock.now += 31 * 24 * 3600
+    budget.acquire("ipstack")
+
+
+def test_database_budget_store_should_be_shared_between_workers(engine: Engine) -> None:
+    first_worker, second_worker = DatabaseBudgetStore(lambda: engine), DatabaseBudgetStore(lambda: engine)
+
+    assert first_worker.consume("ipstack:month:2026-10", 2, 3, 60) == 2
+    assert second_worker.consume("ipstack:month:2026-10", 2, 3, 60) is None
+    assert second_worker.consume("ipstack:month:2026-10", 1, 3, 60) == 3
+
+
+def test_async_acquire_should_respect_budget() -> None:
+    budget = given_budget(FakeClock(), rate_limits={}, monthly_quotas={"ipstack": 1})
+
+    asyncio.run(budget.acquire_async("ipstack"))
+    with pytest.raises(IpStackException):
+        asyncio.run(budget.acquire_async("ipstack"))
+
+
+def test_enrich_batch_should_leave_budget_reserve_for_interactive_creates(alice: TestClient, ip_stack_quota) -> None:
+    res = when_user_enrich_ip_data_batch(alice, ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+    then_response_should_be(HTTPStatus.OK, res)
+    assert len(res.json()["created"]) == 2
+    assert [error["status_code"] for error in res.json()["errors"]] == [HTTPStatus.TOO_MANY_REQUESTS]
+
+    then_response_should_be(HTTPStatus.OK, when_user_create_ip_data(alice, "10.0.0.4"))
+    then_response_should_be(HTTPStatus.TOO_MANY_REQUESTS, when_user_create_ip_data(alice, "10.0.0.5"))
+
+    budget = alice.get("/stats").json()["ip_providers"]["providers"]["ipstack"]["budget"]
+    assert budget["remaining_this_month"] == 0
+
+
+def test_lookup_refused_for_the_month_should_not_take_per_second_slot() -> None:
+    clock = FakeClock()
+    store = CountingBudgetStore(clock)
+    budget = UpstreamBudget(store, rate_limits={"ipstack": 2}, monthly_quotas={"ipstack": 1}, max_wait=0, clock=clock)
+    budget.acquire("ipstack")
+
+    then_budget_is_exhausted(budget)
+
+    assert store.consumed == ["month", "second", "month"]
+
+
+def test_lookup_refused_for_the_second_should_give_monthly_quota_back() -> None:
+    clock = FakeClock()
+    budget = given_budget(clock, rate_limits={"ipstack": 1}, monthly_quotas={"ipstack": 2}, max_wait=0)
+    budget.acquire("ipstack")
+
+    then_budget_is_exhausted(budget)
+    assert budget.stats("ipstack")["remaining_this_month"] == 1
+
+    clock.now += 1
+    budget.acquire("ipstack")
+    then_budget_is_exhausted(budget)
+    assert budget.stats("ipstack")["denied"] == {"interactive": 2}
+
+
+def test_database_budget_store_should_release_consumed_amount(engine: Engine) -> None:
+    store = DatabaseBudgetStore(lambda: engine)
+    store.consume("ipstack:month:2026-10", 3, 3, 60)
+
+    store.release("ipstack:month:2026-10", 2)
+
+    assert store.consume("ipstack:month:2026-10", 2, 3, 60) == 3
+
+
+def test_async_acquire_should_give_monthly_quota_back_when_refused_for_the_second() -> None:
+    budget = given_budget(FakeClock(), rate_limits={"ipstack": 1}, monthly_quotas={"ipstack": 2}, max_wait=0)
+    asyncio.run(budget.acquire_async("ipstack"))
+
+    with pytest.raises(IpStackException):
+        asyncio.run(budget.acquire_async("ipstack"))
+
+    assert budget.stats("ipstack")["remaining_this_month"] == 1
@@ -0,0 +1,194 @@
+import asyncio
+from http import HTTPStatus
+
+import furl
+import httpx
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+from ipdata.services.ip_client.data import IPData
+from ipdata.services.ip_client.exceptions import CIRCUIT_OPEN, CONNECTION_ERROR, IpStackException
+from ipdata.services.ip_client.ip_stack_client import AsyncIPStackClient, IPStackClient
+from ipdata.services.ip_client.providers import get_ip_client, get_provider_guard
+from ipdata.services.ip_client.upstream_guard import CircuitBreaker, UpstreamGuard
+from ipdata.settings import settings
+from tests.ipdata.fake_clock import FakeClock
+from tests.ipdata.responses import RESPONSE_INVALID_IP_ADDRESS, RESPONSE_OK
+from tests.ipdata.test_app import then_response_should_be, when_user_create_ip_data
+
+IP_STACK_URL = furl.furl("https://example.com")
+
+
+class FlakyUpstream:
+    """
+    Fails with the given errors, one per call, and then answers with RESPONSE_OK.
+    """
+
+    def __init__(self, *errors: BaseException) -> None:
+        self._errors = list(errors)
+        self.calls = 0
+
+    def __call__(self) -> dict:
+        self.calls += 1
+        if self._errors:
+            raise self._errors.pop(0)
+        return RESPONSE_OK
+
+
+class FakeSession(requests.Session):
+    def __init__(self, *outcomes: requests.Response | Exception) -> None:
+        super().__init__()
+        self._outcomes = list(outcomes)
+        self.requests: list[dict] = []
+
+    def get(self, url, **kwargs) -> requests.Response:
+        self.requests.append(kwargs)
+        outcome = self._outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def json_response(status_code: int, body: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = httpx.Response(status_code, json=body).content
+    return response
+
+
+def http_error(status_code: int) -> IpStackException:
+    return IpStackException(code=status_code, err_type="http_error", info="")
+
+
+def given_guard(clock: FakeClock | None = None, retry_attempts: int = 3, failure_threshold: int = 2) -> UpstreamGuard:
+    return UpstreamGuard(
+        "ipstack",
+        retry_attempts=retry_attempts,
+        retry_max_wait=0,
+        failure_threshold=failure_threshold,
+        reset_timeout=30,
+        clock=clock or FakeClock(),
+    )
+
+
+@pytest.fixture
+def fresh_ip_stack_guard(mocker) -> UpstreamGuard:
+    guard = get_provider_guard("ipstack")
+    mocker.patch.object(guard, "circuit_breaker", CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    return guard
+
+
+def test_guard_should_retry_transient_errors() -> None:
+    guard = given_guard()
+    upstream = FlakyUpstream(
+        http_error(503), IpStackException(code=CONNECTION_ERROR, err_type="connection_error", info="")
+    )
+
+    assert guard.call(upstream) == RESPONSE_OK
+    assert upstream.calls == 3
+    assert guard.stats()["retries"] == 2
+    assert guard.stats()["errors"] == {"http_error": 1, "connection_error": 1}
+    assert guard.stats()["circuit"] == CircuitBreaker.CLOSED
+
+
+def test_guard_should_not_retry_errors_reported_by_upstream() -> None:
+    guard = given_guard()
+    upstream = FlakyUpstream(IpStackException(code=104, err_type="usage_limit_reached", info=""))
+
+    with pytest.raises(IpStackException):
+        guard.call(upstream)
+    assert upstream.calls == 1
+    assert guard.stats()["circuit"] == CircuitBreaker.CLOSED
+
+
+def test_guard_should_open_circuit_and_let_single_probe_through_after_reset_timeout() -> None:
+    clock = FakeClock()
+    guard = given_guard(clock, retry_attempts=1)
+
+    for _ in range(2):
+        with pytest.raises(IpStackException):
+            guard.call(FlakyUpstream(http_error(500)))
+    upstream = FlakyUpstream()
+    with pytest.raises(IpStackException) as error:
+        guard.call(upstream)
+
+    assert error.value.code == CIRCUIT_OPEN
+    assert upstream.calls == 0
+    assert guard.stats()["circuit"] == CircuitBreaker.OPEN
+
+    clock.now = 30
+    with pytest.raises(IpStackException):
+        guard.call(FlakyUpstream(http_error(500)))
+    assert guard.stats()["circuit"] == CircuitBreaker.OPEN
+
+    clock.now = 60
+    assert guard.call(upstream) == RESPONSE_OK
+    assert guard.stats()["circuit"] == CircuitBreaker.CLOSED
+
+
+def test_guard_should_retry_async_calls() -> None:
+    guard = given_guard()
+    upstream = FlakyUpstream(http_error(429))
+
+    async def request() -> dict:
+        return upstream()
+
+    assert asyncio.run(guard.call_async(request)) == RESPONSE_OK
+    assert upstream.calls == 2
+
+
+def test_ip_stack_client_should_send_timeouts_and_retry_connection_errors() -> None:
+    session = FakeSession(requests.exceptions.ConnectTimeout("timed out"), json_response(200, RESPONSE_OK))
+    client = IPStackClient(IP_STACK_URL, session, given_guard())
+
+    ip_data = client.get_ip_data(RESPONSE_OK["ip"])
+
+    assert isinstance(ip_data, IPData)
+    assert len(session.requests) == 2
+    assert session.requests[0]["timeout"] == (settings.ip_stack_connect_timeout, settings.ip_stack_read_timeout)
+
+
+def test_ip_stack_client_should_not_retry_invalid_ip() -> None:
+    session = FakeSession(json_response(200, RESPONSE_INVALID_IP_ADDRESS))
+    client = IPStackClient(IP_STACK_URL, session, given_guard())
+
+    with pytest.raises(IpStackException) as error:
+        client.get_ip_data("wrong.ip")
+    assert error.value.code == 106
+    assert len(session.requests) == 1
+
+
+def test_async_ip_stack_client_should_retry_connection_errors() -> None:
+    requests_sent: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests_sent.append(request)
+        if len(requests_sent) == 1:
+            raise httpx.ConnectError("connection refused")
+        return httpx.Response(200, json=RESPONSE_OK)
+
+    async def main() -> IPData:
+        async with AsyncIPStackClient(
+            IP_STACK_URL, httpx.AsyncClient(transport=httpx.MockTransport(handler)), given_guard()
+        ) as client:
+            return await client.get_ip_data(RESPONSE_OK["ip"])
+
+    assert isinstance(asyncio.run(main()), IPData)
+    assert len(requests_sent) == 2
+    assert requests_sent[0].extensions["timeout"]["connect"] == settings.ip_stack_connect_timeout
+
+
+def test_ip_stack_client_should_be_shared_between_requests() -> None:
+    assert get_ip_client() is get_ip_client()
+
+
+def test_create_ip_data_should_fail_fast_when_circuit_is_open(
+    alice: TestClient, fresh_ip_stack_guard: UpstreamGuard
+) -> None:
+    fresh_ip_stack_guard.circuit_breaker.record_failure()
+
+    res = when_user_create_ip_data(alice, ip_address=RESPONSE_OK["ip"])
+
+    then_response_should_be(HTTPStatus.BAD_GATEWAY, res)
+    assert alice.get("/stats").json()["ip_providers"]["providers"]["ipstack"]["upstream"]["rejected"] == 1